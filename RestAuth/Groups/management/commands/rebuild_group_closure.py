@@ -0,0 +1,30 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of RestAuth (https://restauth.net).
+#
+# RestAuth is free software: you can redistribute it and/or modify it under the terms of the GNU
+# General Public License as published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# RestAuth is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without
+# even the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with RestAuth. If not,
+# see <http://www.gnu.org/licenses/>.
+
+from __future__ import unicode_literals
+
+from django.core.management.base import NoArgsCommand
+from django.db import transaction
+
+from Groups.models import GroupClosure
+
+
+class Command(NoArgsCommand):
+    help = "Rebuild the table of inherited group memberships used by the Django backend."
+
+    def handle_noargs(self, **options):
+        with transaction.atomic():
+            GroupClosure.objects.rebuild()
+        self.stdout.write('Rebuilt closure with %s entries.' % GroupClosure.objects.count())
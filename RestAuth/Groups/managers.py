@@ -15,13 +15,106 @@
 
 from __future__ import unicode_literals
 
+from collections import defaultdict
+from collections import deque
+
 from django.db import models
+from django.utils import six
+
 from Groups.querysets import GroupQuerySet
 
 
+def get_descendants(group_id, edges):
+    """Breadth-first search for all descendants of a group.
+
+    :param group_id: The id of the group to start with.
+    :param edges: A dictionary mapping group ids to a set of the ids of their direct subgroups.
+    :return: A dictionary mapping the ids of all descendants (including the group itself) to the
+        length of the shortest path from the given group.
+    """
+    depths = {group_id: 0}
+    queue = deque([group_id])
+    while queue:
+        current = queue.popleft()
+        for child in edges.get(current, ()):
+            if child not in depths:
+                depths[child] = depths[current] + 1
+                queue.append(child)
+    return depths
+
+
 class GroupManager(models.Manager):
     def get_queryset(self):
         return GroupQuerySet(self.model)
 
     def member(self, user, service=None, depth=None):
         return self.get_queryset().member(user, service, depth)
+
+
+class GroupClosureManager(models.Manager):
+    def ancestors(self, group_id, include_self=True):
+        """Get the ids of all groups that the given group inherits memberships from."""
+        qs = self.filter(descendant_id=group_id)
+        if include_self is False:
+            qs = qs.exclude(ancestor_id=group_id)
+        return list(qs.values_list('ancestor_id', flat=True))
+
+    def add_edge(self, parent_id, child_id):
+        """Incrementally update the closure after ``child_id`` became a subgroup of ``parent_id``.
+
+        Every ancestor of the parent now reaches every descendant of the child, the depth is only
+        updated if the new path is shorter than any existing path.
+        """
+        ancestors = dict(self.filter(descendant_id=parent_id).values_list('ancestor_id', 'depth'))
+        descendants = dict(self.filter(ancestor_id=child_id).values_list('descendant_id', 'depth'))
+
+        existing = {}
+        qs = self.filter(ancestor_id__in=list(ancestors), descendant_id__in=list(descendants))
+        for pk, ancestor, descendant, depth in qs.values_list(
+                'id', 'ancestor_id', 'descendant_id', 'depth'):
+            existing[(ancestor, descendant)] = (pk, depth)
+
+        new = []
+        updates = defaultdict(list)
+        for ancestor, ancestor_depth in six.iteritems(ancestors):
+            for descendant, descendant_depth in six.iteritems(descendants):
+                depth = ancestor_depth + 1 + descendant_depth
+                if (ancestor, descendant) not in existing:
+                    new.append(self.model(ancestor_id=ancestor, descendant_id=descendant,
+                                          depth=depth))
+                elif existing[(ancestor, descendant)][1] > depth:
+                    updates[depth].append(existing[(ancestor, descendant)][0])
+
+        for depth, pks in six.iteritems(updates):
+            self.filter(pk__in=pks).update(depth=depth)
+        self.bulk_create(new)
+
+    def rebuild(self, group_ids=None):
+        """Recompute the closure for the given ancestors from the sub-group relation.
+
+        This is used whenever a sub-group relation is removed, since the shortest path between two
+        groups cannot be updated incrementally in that case.
+
+        :param group_ids: Ids of ancestors to recompute. If ``None``, the whole table is rebuilt.
+        """
+        from Groups.models import Group
+
+        through = Group.groups.through
+        edges = defaultdict(set)
+        for parent, child in through.objects.values_list('from_group_id', 'to_group_id'):
+            edges[parent].add(child)
+
+        if group_ids is None:
+            group_ids = list(Group.objects.values_list('id', flat=True))
+            self.all().delete()
+        else:
+            # filter groups that do not exist (anymore)
+            group_ids = list(Group.objects.filter(id__in=group_ids).values_list('id', flat=True))
+            self.filter(ancestor_id__in=group_ids).delete()
+
+        rows = []
+        for group_id in group_ids:
+            for descendant, depth in six.iteritems(get_descendants(group_id, edges)):
+                rows.append(self.model(ancestor_id=group_id, descendant_id=descendant,
+                                       depth=depth))
+        self.bulk_create(rows, batch_size=500)
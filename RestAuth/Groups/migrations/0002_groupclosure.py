@@ -0,0 +1,59 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from collections import defaultdict
+
+from django.db import models, migrations
+
+from Groups.managers import get_descendants
+
+
+def build_closure(apps, schema_editor):
+    Group = apps.get_model('Groups', 'Group')
+    GroupClosure = apps.get_model('Groups', 'GroupClosure')
+
+    edges = defaultdict(set)
+    through = Group._meta.get_field('groups').rel.through
+    for parent, child in through.objects.values_list('from_group_id', 'to_group_id'):
+        edges[parent].add(child)
+
+    rows = []
+    for group_id in Group.objects.values_list('id', flat=True):
+        for descendant, depth in get_descendants(group_id, edges).items():
+            rows.append(GroupClosure(ancestor_id=group_id, descendant_id=descendant, depth=depth))
+    GroupClosure.objects.bulk_create(rows, batch_size=500)
+
+
+def clear_closure(apps, schema_editor):
+    apps.get_model('Groups', 'GroupClosure').objects.all().delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('Groups', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='GroupClosure',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', serialize=False, auto_created=True, primary_key=True)),
+                ('depth', models.PositiveIntegerField()),
+                ('ancestor', models.ForeignKey(related_name='descendant_links', to='Groups.Group')),
+                ('descendant', models.ForeignKey(related_name='ancestor_links', to='Groups.Group')),
+            ],
+            options={
+            },
+            bases=(models.Model,),
+        ),
+        migrations.AlterUniqueTogether(
+            name='groupclosure',
+            unique_together=set([('ancestor', 'descendant')]),
+        ),
+        migrations.AlterIndexTogether(
+            name='groupclosure',
+            index_together=set([('descendant', 'depth')]),
+        ),
+        migrations.RunPython(build_closure, clear_closure),
+    ]
@@ -18,9 +18,15 @@ from __future__ import unicode_literals
 from django.conf import settings
 from django.contrib.auth.models import User as Service
 from django.db import models
+from django.db.models.signals import m2m_changed
+from django.db.models.signals import post_delete
+from django.db.models.signals import post_save
+from django.db.models.signals import pre_delete
 from django.db.utils import IntegrityError
+from django.dispatch import receiver
 
 from Users.models import ServiceUser as User
+from Groups.managers import GroupClosureManager
 from Groups.managers import GroupManager
 
 group_permissions = (
@@ -52,15 +58,11 @@ class Group(models.Model):
         permissions = group_permissions
 
     def get_members(self, depth=None):
-        expr = models.Q(group=self)
         if depth is None:
             depth = settings.GROUP_RECURSION_DEPTH
 
-        kwarg = 'group'
-        for i in range(depth):
-            kwarg += '__groups'
-            expr |= models.Q(**{kwarg: self})
-        return User.objects.filter(expr).distinct()
+        return User.objects.filter(group__descendant_links__descendant=self,
+                                   group__descendant_links__depth__lte=depth).distinct()
 
     def is_member(self, username):
         return self.get_members().filter(username=username).exists()
@@ -84,3 +86,81 @@ class Group(models.Model):
             return "%s/%s" % (self.name, self.service.username)
         else:
             return "%s/None" % (self.name)
+
+
+class GroupClosure(models.Model):
+    """Transitive closure of the sub-group relation.
+
+    Every group has a row for itself with ``depth=0`` and one row for every direct or indirect
+    subgroup, with ``depth`` being the length of the shortest path. Members of ``ancestor`` are
+    thus members of ``descendant`` if ``depth`` is not greater than
+    :setting:`GROUP_RECURSION_DEPTH`.
+    """
+    ancestor = models.ForeignKey(Group, related_name='descendant_links')
+    descendant = models.ForeignKey(Group, related_name='ancestor_links')
+    depth = models.PositiveIntegerField()
+
+    objects = GroupClosureManager()
+
+    class Meta:
+        unique_together = ('ancestor', 'descendant')
+        index_together = (('descendant', 'depth'), )
+
+
+# The receivers are not bound to sender=Group: Saving or deleting a deferred instance (e.g. loaded
+# with only()) sends the signals with the deferred subclass as sender.
+@receiver(post_save)
+def create_closure_self_link(sender, instance, created, raw, **kwargs):
+    # Every group is its own descendant. Raw saves (e.g. loaddata) are included, since the row is
+    # not part of any fixture.
+    if not isinstance(instance, Group):
+        return
+    if created or (raw and not GroupClosure.objects.filter(
+            ancestor_id=instance.id, descendant_id=instance.id).exists()):
+        GroupClosure.objects.create(ancestor_id=instance.id, descendant_id=instance.id, depth=0)
+
+
+@receiver(m2m_changed, sender=Group.groups.through)
+def update_closure(sender, instance, action, reverse, pk_set, **kwargs):
+    # Keep the closure up to date no matter how subgroups are modified, including loaddata.
+    if action == 'post_add':
+        for pk in pk_set:
+            if reverse:  # instance is the subgroup
+                GroupClosure.objects.add_edge(pk, instance.id)
+            else:
+                GroupClosure.objects.add_edge(instance.id, pk)
+    elif action == 'pre_clear' and reverse:
+        # The former parents are unknown after the relation was cleared
+        instance._closure_ancestors = GroupClosure.objects.ancestors(instance.id,
+                                                                     include_self=False)
+    elif action in ('post_remove', 'post_clear'):
+        if not reverse:
+            ancestors = GroupClosure.objects.ancestors(instance.id)
+        elif action == 'post_remove':
+            ancestors = set()
+            for pk in pk_set:
+                ancestors.update(GroupClosure.objects.ancestors(pk))
+        else:
+            ancestors = getattr(instance, '_closure_ancestors', None)
+        if ancestors:
+            GroupClosure.objects.rebuild(ancestors)
+
+
+@receiver(pre_delete)
+def collect_closure_ancestors(sender, instance, **kwargs):
+    # Paths through a removed group are gone, so we have to recompute its ancestors. This is only
+    # necessary if the group has any subgroups, other rows are removed by the cascade.
+    if not isinstance(instance, Group):
+        return
+    if GroupClosure.objects.filter(ancestor=instance, depth__gt=0).exists():
+        instance._closure_ancestors = GroupClosure.objects.ancestors(instance.id,
+                                                                     include_self=False)
+
+
+@receiver(post_delete)
+def rebuild_closure_ancestors(sender, instance, **kwargs):
+    if not isinstance(instance, Group):
+        return
+    ancestors = getattr(instance, '_closure_ancestors', None)
+    if ancestors:
+        GroupClosure.objects.rebuild(ancestors)
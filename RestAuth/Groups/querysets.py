@@ -17,7 +17,6 @@ from __future__ import unicode_literals
 
 from django.conf import settings
 from django.db import models
-from django.db.models import Q
 
 
 class GroupQuerySet(models.query.QuerySet):
@@ -25,11 +24,5 @@ class GroupQuerySet(models.query.QuerySet):
         if depth is None:  # pragma: no branch
             depth = settings.GROUP_RECURSION_DEPTH
 
-        expr = Q(users=user, service=service)
-
-        kwarg = 'users'
-        for i in range(depth):
-            kwarg = 'parent_groups__%s' % kwarg
-            expr |= models.Q(**{kwarg: user, 'service': service})
-
-        return self.filter(expr).distinct()
+        return self.filter(service=service, ancestor_links__ancestor__users=user,
+                           ancestor_links__depth__lte=depth).distinct()
@@ -15,12 +15,20 @@
 
 from __future__ import unicode_literals
 
+import os
 import unittest
 
+from django.conf import settings
+from django.contrib.auth.models import User as Service
+from django.core.management import call_command
+from django.test import TransactionTestCase
 from django.utils import six
 from django.utils.six.moves import http_client
+from django.utils.six import StringIO
 
+from Groups.models import GroupClosure
 from backends import backend
+from backends.django import DjangoBackend
 from common.compat import encode_str as _e
 from common.testdata import CliMixin
 from common.testdata import RestAuthTransactionTest
@@ -86,6 +94,15 @@ class GetGroupsTests(GroupTests):  # GET /groups/
         self.assertEqual(resp.status_code, http_client.OK)
         self.assertCountEqual(self.parse(resp, 'list'), [groupname1])
 
+    def test_get_groups_paginated(self):
+        groups = [groupname1, groupname2, groupname3]
+        for group in groups:
+            backend.create_group(service=self.service, group=group)
+        backend.create_group(service=self.service2, group=groupname4)
+
+        self.assertCountEqual(self.get_pages('/groups/', 1), groups)
+        self.assertCountEqual(self.get_pages('/groups/', 10), groups)
+
 
 class GetGroupsOfUserTests(GroupTests):  # GET /groups/?user=<user>
     def test_user_doesnt_exist(self):
@@ -212,6 +229,34 @@ class GetGroupsOfUserTests(GroupTests):  # GET /groups/?user=<user>
         self.assertEqual(resp.status_code, http_client.OK)
         self.assertCountEqual(self.parse(resp, 'list'), [groupname1, groupname3])
 
+    @unittest.skipIf(backend.SUPPORTS_SUBGROUPS is False, 'Backend does not support subgroups.')
+    def test_diamond_inheritance(self):
+        """
+        group1 is inherited by group4 via group2 and group3, group4 must still only be listed once.
+        """
+        for group in [groupname1, groupname2, groupname3, groupname4]:
+            backend.create_group(service=self.service, group=group)
+        backend.add_member(group=groupname1, service=self.service, user=username1)
+        for meta, sub in [(groupname1, groupname2), (groupname1, groupname3),
+                          (groupname2, groupname4), (groupname3, groupname4)]:
+            backend.add_subgroup(group=meta, service=self.service, subgroup=sub,
+                                 subservice=self.service)
+
+        resp = self.get('/groups/', {'user': username1})
+        self.assertEqual(resp.status_code, http_client.OK)
+        self.assertCountEqual(self.parse(resp, 'list'),
+                              [groupname1, groupname2, groupname3, groupname4])
+
+    def test_renamed_user(self):
+        backend.create_group(service=self.service, group=groupname1)
+        backend.add_member(group=groupname1, service=self.service, user=username1)
+        backend.rename_user(user=username1, name=username5)
+
+        resp = self.get('/groups/', {'user': username5})
+        self.assertEqual(resp.status_code, http_client.OK)
+        self.assertEqual(self.parse(resp, 'list'), [groupname1])
+        self.assertEqual(backend.members(group=groupname1, service=self.service), [username5])
+
 
 class CreateGroupTests(GroupTests):  # POST /groups/
     def test_create_group(self):
@@ -437,6 +482,19 @@ class GetUsersInGroupTests(GroupUserTests):  # GET /groups/<group>/users/
         self.assertEqual(resp.status_code, http_client.OK)
         self.assertEqual(self.parse(resp, 'list'), [username1])
 
+    def test_paginated(self):
+        users = [username1, username2, username3]
+        for user in users:
+            backend.add_member(group=groupname1, service=self.service, user=user)
+
+        self.assertCountEqual(self.get_pages('/groups/%s/users/' % groupname1, 1), users)
+        self.assertCountEqual(self.get_pages('/groups/%s/users/' % groupname1, 10), users)
+        self.assertEqual(self.get_pages('/groups/%s/users/' % groupname2, 1), [])
+
+        resp = self.get('/groups/%s/users/' % groupname6, {'limit': 1})
+        self.assertEqual(resp.status_code, http_client.NOT_FOUND)
+        self.assertEqual(resp['Resource-Type'], 'group')
+
     def test_two_users(self):
         backend.add_member(group=groupname1, service=self.service, user=username1)
         backend.add_member(group=groupname1, service=self.service, user=username2)
@@ -518,6 +576,78 @@ class GetUsersInGroupTests(GroupUserTests):  # GET /groups/<group>/users/
                               [username1, username2, username3, username4, username5])
 
 
+class FilterUsersInGroupTests(GroupUserTests):  # GET /groups/<group>/users/?user=<user>
+    def get_members(self, group, users):
+        resp = self.get('/groups/%s/users/' % group, {'user': users})
+        self.assertEqual(resp.status_code, http_client.OK)
+        return self.parse(resp, 'list')
+
+    def test_group_does_not_exist(self):
+        resp = self.get('/groups/%s/users/' % groupname6, {'user': [username1]})
+        self.assertEqual(resp.status_code, http_client.NOT_FOUND)
+        self.assertEqual(resp['Resource-Type'], 'group')
+
+    @unittest.skipIf(backend.SUPPORTS_GROUP_VISIBILITY is False, 'Backend has no group visibility')
+    def test_service_isolation(self):
+        backend.add_member(group=groupname4, service=self.service2, user=username1)
+
+        resp = self.get('/groups/%s/users/' % groupname4, {'user': [username1]})
+        self.assertEqual(resp.status_code, http_client.NOT_FOUND)
+        self.assertEqual(resp['Resource-Type'], 'group')
+
+    def test_filter(self):
+        backend.add_member(group=groupname1, service=self.service, user=username1)
+        backend.add_member(group=groupname1, service=self.service, user=username2)
+
+        self.assertEqual(self.get_members(groupname1, [username1]), [username1])
+        self.assertCountEqual(self.get_members(groupname1, [username1, username2, username3]),
+                              [username1, username2])
+        self.assertEqual(self.get_members(groupname2, [username1, username2]), [])
+
+        # non-existing users are not members
+        self.assertEqual(self.get_members(groupname1, [username4, username5]), [])
+
+    @unittest.skipIf(backend.SUPPORTS_SUBGROUPS is False, 'Backend does not support subgroups.')
+    def test_inheritance(self):
+        backend.add_member(group=groupname1, service=self.service, user=username1)
+        backend.add_member(group=groupname2, service=self.service, user=username2)
+        backend.add_subgroup(group=groupname1, service=self.service, subgroup=groupname2,
+                             subservice=self.service)
+
+        self.assertEqual(self.get_members(groupname1, [username1, username2]), [username1])
+        self.assertCountEqual(self.get_members(groupname2, [username1, username2, username3]),
+                              [username1, username2])
+
+    def test_is_member_any(self):
+        backend.add_member(group=groupname2, service=self.service, user=username1)
+
+        self.assertFalse(backend.is_member_any(username1, []))
+        self.assertFalse(backend.is_member_any(username1, [(groupname1, self.service)]))
+        self.assertTrue(backend.is_member_any(
+            username1, [(groupname1, self.service), (groupname2, self.service)]))
+        self.assertFalse(backend.is_member_any(
+            username2, [(groupname1, self.service), (groupname2, self.service)]))
+
+        # non-existing users and groups are simply no match
+        self.assertFalse(backend.is_member_any(username4, [(groupname2, self.service)]))
+        self.assertTrue(backend.is_member_any(
+            username1, [(groupname6, self.service), (groupname2, self.service)]))
+
+    @unittest.skipIf(backend.SUPPORTS_SUBGROUPS is False, 'Backend does not support subgroups.')
+    def test_is_member_any_inheritance(self):
+        backend.add_member(group=groupname1, service=self.service, user=username1)
+        backend.add_subgroup(group=groupname1, service=self.service, subgroup=groupname2,
+                             subservice=self.service)
+        backend.add_subgroup(group=groupname2, service=self.service, subgroup=groupname3,
+                             subservice=self.service)
+
+        self.assertTrue(backend.is_member_any(username1, [(groupname3, self.service)]))
+        with self.settings(GROUP_RECURSION_DEPTH=1):
+            self.assertFalse(backend.is_member_any(username1, [(groupname3, self.service)]))
+            self.assertTrue(backend.is_member_any(
+                username1, [(groupname3, self.service), (groupname2, self.service)]))
+
+
 class AddUserToGroupTests(GroupUserTests):  # POST /groups/<group>/users/
     def test_group_doesnt_exist(self):
         resp = self.post('/groups/%s/users/' % groupname6, {'user': username1})
@@ -757,6 +887,22 @@ class VerifyUserInGroupTests(GroupUserTests):
         self.assertFalse(self.is_member(groupname1, username5))
         self.assertTrue(self.is_member(groupname2, username5))
 
+    @unittest.skipIf(backend.SUPPORTS_SUBGROUPS is False, 'Backend does not support subgroups.')
+    def test_cyclic_inheritance(self):
+        backend.add_member(group=groupname1, service=self.service, user=username1)
+        backend.add_member(group=groupname2, service=self.service, user=username2)
+        backend.add_subgroup(group=groupname1, service=self.service, subgroup=groupname2,
+                             subservice=self.service)
+        backend.add_subgroup(group=groupname2, service=self.service, subgroup=groupname1,
+                             subservice=self.service)
+
+        self.assertTrue(self.is_member(groupname1, username1))
+        self.assertTrue(self.is_member(groupname1, username2))
+        self.assertTrue(self.is_member(groupname2, username1))
+        self.assertTrue(self.is_member(groupname2, username2))
+        self.assertFalse(self.is_member(groupname1, username3))
+        self.assertFalse(self.is_member(groupname2, username3))
+
 
 # DELETE /groups/<group>/users/<user>/
 class DeleteUserFromGroupTests(GroupUserTests):
@@ -1147,6 +1293,108 @@ class RemoveSubGroupTests(GroupUserTests):
                               [(groupname1, self.service)])
 
 
+@unittest.skipUnless(isinstance(backend, DjangoBackend),
+                     'Only the Django backend uses GroupClosure')
+class GroupClosureTests(GroupUserTests):
+    def get_closure(self):
+        return set(GroupClosure.objects.values_list('ancestor__name', 'descendant__name', 'depth'))
+
+    def assertRebuildEqual(self):
+        closure = self.get_closure()
+        call_command('rebuild_group_closure', stdout=StringIO())
+        self.assertEqual(closure, self.get_closure())
+
+    def test_self_reference(self):
+        self.assertEqual(self.get_closure(), set([
+            (groupname1, groupname1, 0),
+            (groupname2, groupname2, 0),
+            (groupname3, groupname3, 0),
+            (groupname4, groupname4, 0),
+            (groupname5, groupname5, 0),
+        ]))
+        self.assertRebuildEqual()
+
+    def test_diamond(self):
+        # group1 -> group2 -> group4 and group1 -> group3 -> group4 -> group5
+        backend.add_subgroup(group=groupname1, service=self.service, subgroup=groupname2,
+                             subservice=self.service)
+        backend.add_subgroup(group=groupname1, service=self.service, subgroup=groupname3,
+                             subservice=self.service)
+        backend.add_subgroup(group=groupname2, service=self.service, subgroup=groupname4,
+                             subservice=self.service2)
+        backend.add_subgroup(group=groupname3, service=self.service, subgroup=groupname4,
+                             subservice=self.service2)
+        backend.add_subgroup(group=groupname4, service=self.service2, subgroup=groupname5,
+                             subservice=self.service2)
+        self.assertIn((groupname1, groupname4, 2), self.get_closure())
+        self.assertIn((groupname1, groupname5, 3), self.get_closure())
+        self.assertRebuildEqual()
+
+        # shortcut reduces the depth
+        backend.add_subgroup(group=groupname1, service=self.service, subgroup=groupname5,
+                             subservice=self.service2)
+        self.assertIn((groupname1, groupname5, 1), self.get_closure())
+        self.assertRebuildEqual()
+
+        # removing one path keeps the other one
+        backend.remove_subgroup(group=groupname2, service=self.service, subgroup=groupname4,
+                                subservice=self.service2)
+        self.assertIn((groupname1, groupname4, 2), self.get_closure())
+        self.assertNotIn((groupname2, groupname4, 1), self.get_closure())
+        self.assertRebuildEqual()
+
+        # removing a group in the middle removes the path
+        backend.remove_group(group=groupname3, service=self.service)
+        self.assertNotIn((groupname1, groupname4, 2), self.get_closure())
+        self.assertIn((groupname1, groupname5, 1), self.get_closure())
+        self.assertRebuildEqual()
+
+    def test_cycle(self):
+        backend.add_member(group=groupname1, service=self.service, user=username1)
+        backend.add_subgroup(group=groupname1, service=self.service, subgroup=groupname2,
+                             subservice=self.service)
+        backend.add_subgroup(group=groupname2, service=self.service, subgroup=groupname1,
+                             subservice=self.service)
+        self.assertIn((groupname1, groupname1, 0), self.get_closure())
+        self.assertIn((groupname2, groupname1, 1), self.get_closure())
+        self.assertTrue(backend.is_member(group=groupname2, service=self.service, user=username1))
+        self.assertRebuildEqual()
+
+    def test_set_subgroups(self):
+        backend.add_subgroup(group=groupname1, service=self.service, subgroup=groupname2,
+                             subservice=self.service)
+        backend.add_subgroup(group=groupname2, service=self.service, subgroup=groupname3,
+                             subservice=self.service)
+        backend.set_subgroups(group=groupname2, service=self.service, subgroups=[],
+                              subservice=self.service)
+        self.assertNotIn((groupname1, groupname3, 2), self.get_closure())
+        self.assertRebuildEqual()
+
+
+@unittest.skipUnless(isinstance(backend, DjangoBackend),
+                     'Only the Django backend uses GroupClosure')
+class GroupClosureFixtureTests(TransactionTestCase):
+    def test_loaddata(self):
+        # groups saved by loaddata have no closure rows in the fixture
+        fixture = os.path.join(settings.BASE_DIR, 'fixtures', 'testserver.json')
+        call_command('loaddata', fixture, verbosity=0)
+        closure = set(GroupClosure.objects.values_list('ancestor__name', 'descendant__name',
+                                                       'depth'))
+        self.assertEqual(closure, set([
+            ('top-level', 'top-level', 0),
+            ('netgroup', 'netgroup', 0),
+            ('orggroup', 'orggroup', 0),
+            ('orggroup', 'netgroup', 1),
+        ]))
+
+        service = Service.objects.get(username='example.net')
+        backend.create_user(user=username1)
+        backend.add_member(group='netgroup', service=service, user=username1)
+        self.assertTrue(backend.is_member(group='netgroup', service=service, user=username1))
+        self.assertEqual(backend.members(group='netgroup', service=service), [username1])
+        self.assertEqual(backend.list_groups(service=service, user=username1), ['netgroup'])
+
+
 class CliTests(RestAuthTransactionTest, CliMixin):
     def test_add(self):
         with capture() as (stdout, stderr):
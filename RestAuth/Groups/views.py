@@ -31,6 +31,7 @@ from common.errors import GroupNotFound
 from common.responses import HttpResponseCreated
 from common.responses import HttpResponseNoContent
 from common.responses import HttpRestAuthResponse
+from common.responses import HttpRestAuthStreamingResponse
 from common.responses import HttpResponseNotImplemented
 from common.views import RestAuthView
 from common.views import RestAuthResourceView
@@ -59,6 +60,11 @@ class GroupsView(RestAuthView):
             if not request.user.has_perm('Groups.groups_list'):
                 return HttpResponseForbidden()
 
+            limit, after = self._parse_page(request)
+            if limit is not None:
+                groups, after = backend.page_groups(request.user, limit, after=after)
+                return self._page_response(request, [g.lower() for g in groups], after)
+
             groups = backend.list_groups(service=request.user)
         else:
             if not request.user.has_perm('Groups.groups_for_user'):
@@ -67,8 +73,8 @@ class GroupsView(RestAuthView):
             # Get all groups of a user
             groups = backend.list_groups(service=request.user, user=username)
 
-        groups = [g.lower() for g in groups]
-        return HttpRestAuthResponse(request, groups)
+        groups = (g.lower() for g in groups)
+        return HttpRestAuthStreamingResponse(request, groups)
 
     def post(self, request, largs, dry=False):
         """Create a new group."""
@@ -141,13 +147,29 @@ class GroupUsersIndex(RestAuthResourceView):
     put_required = (('users', list),)
 
     def get(self, request, largs, name):
-        """Get all users in a group."""
+        """Get all users in a group or the given users that are in a group."""
 
-        if not request.user.has_perm('Groups.group_users'):
-            return HttpResponseForbidden()
+        usernames = request.GET.getlist('user')
+        if usernames:
+            if not request.user.has_perm('Groups.group_user_in_group'):
+                return HttpResponseForbidden()
 
-        # If GroupNotFound: 404 Not Found
-        users = backend.members(group=name, service=request.user)
+            # If GroupNotFound: 404 Not Found
+            users = backend.members_of(group=name, service=request.user,
+                                       users=[stringprep(u) for u in usernames])
+        else:
+            if not request.user.has_perm('Groups.group_users'):
+                return HttpResponseForbidden()
+
+            limit, after = self._parse_page(request)
+            if limit is not None:
+                # If GroupNotFound: 404 Not Found
+                users, after = backend.page_members(name, request.user, limit, after=after)
+                return self._page_response(request, users, after)
+
+            # If GroupNotFound: 404 Not Found
+            users = backend.members(group=name, service=request.user)
+            return HttpRestAuthStreamingResponse(request, users)
         return HttpRestAuthResponse(request, users)
 
     def post(self, request, largs, name):
@@ -102,6 +102,14 @@ MIN_PASSWORD_LENGTH = 6
 VALIDATORS = []
 GROUP_RECURSION_DEPTH = 3
 SECURE_CACHE = True
+SERVICE_CACHE = {'SIZE': 100, 'TTL': 60}
+SERVICE_TOKEN_LIFETIME = 300
+PASSWORD_CACHE = None
+HASHING_EXECUTOR = None
+DEFERRED_REHASH = None
+AUTH_THROTTLE = None
+REPLICA_ROUTER = None
+BATCH = {'MAX_OPERATIONS': 100, 'THREADS': 4}
 SERVICE_PASSWORD_HASHER = 'default'
 
 # backends:
@@ -211,6 +219,21 @@ if not LOGGING:
                 'handlers': ['subresource'],
                 'propagate': False,
                 'level': LOG_LEVEL,
+            },
+            'tokens': {
+                'handlers': ['base'],
+                'propagate': False,
+                'level': LOG_LEVEL,
+            },
+            'batch': {
+                'handlers': ['base'],
+                'propagate': False,
+                'level': LOG_LEVEL,
+            },
+            'common.executor': {
+                'handlers': ['general'],
+                'propagate': False,
+                'level': LOG_LEVEL,
             }
         }
     }
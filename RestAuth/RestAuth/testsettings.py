@@ -50,6 +50,11 @@ DATABASES = {
 DATA_BACKEND = {
     'BACKEND': os.environ.get('DATA_BACKEND', 'backends.django.DjangoBackend')
 }
+if DATA_BACKEND['BACKEND'] == 'backends.sharded.ShardedBackend':
+    DATA_BACKEND['SHARDS'] = [
+        {'NAME': 'shard1', 'BACKEND': 'backends.memory.MemoryBackend'},
+        {'NAME': 'shard2', 'BACKEND': 'backends.memory.MemoryBackend'},
+    ]
 
 ALLOWED_HOSTS = [
     '[::1]',
@@ -107,6 +112,15 @@ MIN_PASSWORD_LENGTH = 6
 VALIDATORS = []
 GROUP_RECURSION_DEPTH = 3
 SECURE_CACHE = True
+SERVICE_CACHE = {'SIZE': 100, 'TTL': 60}
+SERVICE_TOKEN_LIFETIME = 300
+PASSWORD_CACHE = None
+HASHING_EXECUTOR = None
+DEFERRED_REHASH = None
+AUTH_THROTTLE = None
+REPLICA_ROUTER = None
+# worker threads can't see the in-memory test database
+BATCH = {'MAX_OPERATIONS': 100, 'THREADS': 1}
 SERVICE_PASSWORD_HASHER = 'django.contrib.auth.hashers.MD5PasswordHasher'
 
 # backends:
@@ -230,6 +244,11 @@ LOGGING = {
             'handlers': ['subresource'],
             'propagate': False,
             'level': LOG_LEVEL,
+        },
+        'tokens': {
+            'handlers': ['base'],
+            'propagate': False,
+            'level': LOG_LEVEL,
         }
     }
 }
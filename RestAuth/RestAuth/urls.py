@@ -19,10 +19,15 @@ from django.conf.urls import include
 from django.conf.urls import patterns
 from django.conf.urls import url
 
+from Services.decorator import login_required
+from common.batch import BatchView
+
 urlpatterns = patterns(
     '',
     url(r'^/?$', 'RestAuth.views.index'),
     url(r'^users/',  include('Users.urls')),
     url(r'^groups/', include('Groups.urls')),
+    url(r'^tokens/', include('Services.urls')),
+    url(r'^batch/$', login_required(realm='/batch/')(BatchView.as_view()), name='batch'),
     url(r'^test/', include('Test.urls')),
 )
@@ -39,6 +39,17 @@ from django.core.wsgi import get_wsgi_application
 os.environ['DJANGO_SETTINGS_MODULE'] = 'RestAuth.settings'
 application = get_wsgi_application()
 
+
+def start_executor():
+    # start the worker processes before the webserver starts any threads
+    from common.executor import get_executor
+    if get_executor() is not None:
+        get_executor().start()
+
+
+start_executor()
+
+
 def check_password(environ, user, password):
     try:
         # set up environment:
@@ -18,12 +18,17 @@
 from __future__ import unicode_literals
 
 import base64
+import hashlib
+import hmac
 
 from django.conf import settings
-from django.core.cache import cache
 from django.utils import six
 
+from Services.models import SERVICE_CACHE_KEY
 from Services.models import Service
+from Services.models import get_service_cache
+from Services.tokens import verify_token
+from common.throttle import get_throttle
 
 
 class InternalAuthenticationBackend:
@@ -42,65 +47,83 @@ class InternalAuthenticationBackend:
         """
         Authenticate against a header as send by HTTP basic
         authentication and a host. This method takes care of decoding
-        the header.
+        the header. Instead of basic authentication, the header may also
+        contain a bearer token (see :py:mod:`Services.tokens`).
 
         .. NOTE:: We return None as soon as any check fails in order to avoid
            any accidental pass-through to other parts of the authentication.
         """
         method, data = header.split()
-        if method.lower() != 'basic':
-            return None  # we only support basic authentication
+        if method.lower() == 'bearer':
+            # tokens are signed by us, so verifying them doesn't need any query
+            return verify_token(data, host)
+        elif method.lower() != 'basic':
+            return None  # we only support basic authentication and tokens
 
-        qs = Service.objects.only('username', 'password')
+        qs = Service.objects.only('username', 'password', 'is_active', 'is_superuser')
 
         if settings.SECURE_CACHE:
-            cache_key = 'service_%s' % data
-            cache_data = cache.get(cache_key)
+            # The raw header is never used as key, so the cache does not contain any credentials.
+            service_cache = get_service_cache()
+            raw = data.encode('utf-8') if isinstance(data, six.text_type) else data
+            cache_key = hmac.new(SERVICE_CACHE_KEY, raw, hashlib.sha256).digest()
+            serv = service_cache.get(cache_key)
 
-            if cache_data is None:
+            if serv is None:
                 try:
                     name, password = self._decode(data)
                 except:
                     return None
 
+                # reject clients that failed too often before hashing anything
+                throttle = get_throttle()
+                throttle_key = 'service:%s:%s' % (host, name)
+                if throttle is not None:
+                    throttle.check(throttle_key)
+
                 try:
                     serv = qs.get(username=name)
                 except Service.DoesNotExist:
-                    return None
+                    return self._failed(throttle, throttle_key)
 
                 if serv.check_password(password):
-                    # get hosts, store data in cache:
-                    hosts = serv.hosts.values_list('address', flat=True)
-                    cache.set(cache_key, (serv, hosts))
-
-                    if host in hosts:
-                        return serv
-                    else:
-                        return None
+                    serv.get_all_permissions()  # compile permissions before caching the service
+                    service_cache.set(cache_key, serv)
                 else:
-                    return None
+                    return self._failed(throttle, throttle_key)
+
+            # hosts are verified using the in-process host index, so this doesn't need a query
+            if serv.verify_host(host):
+                return serv
             else:
-                serv, hosts = cache_data
-                if host in hosts:
-                    return serv
-                else:
-                    return None
+                return None
         else:
             try:
                 name, password = self._decode(data)
             except:
                 return None
 
+            throttle = get_throttle()
+            throttle_key = 'service:%s:%s' % (host, name)
+            if throttle is not None:
+                throttle.check(throttle_key)
+
             try:
                 serv = qs.get(username=name)
                 if serv.verify(password, host):
                     # service successfully verified
                     return serv
                 else:
-                    return None
+                    return self._failed(throttle, throttle_key)
             except Service.DoesNotExist:
                 # service does not exist
-                return None
+                return self._failed(throttle, throttle_key)
+
+    def _failed(self, throttle, key):
+        """Record a failed authentication attempt."""
+        if throttle is not None:
+            throttle.fail(key)
+        return None
 
     def get_user(self, user_id):  # pragma: no cover
         """
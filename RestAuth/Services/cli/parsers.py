@@ -79,7 +79,7 @@ subparser = subparsers.add_parser(
 subparser.add_argument(
     'hosts', metavar='HOST', nargs='*',
     help='Hosts that this service is able to connect from. Note: This must be '
-    'an IPv4 or IPv6 address, NOT a hostname.'
+    'an IPv4 or IPv6 address or network (e.g. 192.168.0.0/24), NOT a hostname.'
 )
 subparser = subparsers.add_parser(
     'add-hosts', parents=[service_arg_parser],
@@ -89,7 +89,7 @@ subparser = subparsers.add_parser(
 subparser.add_argument(
     'hosts', metavar='HOST', nargs='+',
     help='Add hosts that this service is able to connect from. Note: This '
-    'must be an IPv4 or IPv6 address, NOT a hostname.'
+    'must be an IPv4 or IPv6 address or network (e.g. 192.168.0.0/24), NOT a hostname.'
 )
 subparser = subparsers.add_parser(
     'rm-hosts', parents=[service_arg_parser],
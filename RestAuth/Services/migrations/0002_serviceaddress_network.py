@@ -0,0 +1,21 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+import Services.models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('Services', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='serviceaddress',
+            name='address',
+            field=models.CharField(unique=True, max_length=49, validators=[Services.models.validate_network]),
+            preserve_default=True,
+        ),
+    ]
@@ -15,14 +15,24 @@
 
 from __future__ import unicode_literals
 
+import os
+import time
+import uuid
+
 from django.conf import settings
 from django.contrib.auth.hashers import check_password
 from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import Permission
 from django.contrib.auth.models import User
+from django.core.cache import cache
 from django.core.exceptions import ImproperlyConfigured
+from django.core.exceptions import ValidationError
 from django.db import models
 from django.utils import importlib
 
+from common.cache import LRUCache
+from common.network import PrefixIndex
+from common.network import normalize_network
 
 SERVICE_HASHER = None
 
@@ -52,6 +62,101 @@ def get_service_hasher():
     return SERVICE_HASHER
 
 
+SERVICE_CACHE = None
+SERVICE_CACHE_KEY = os.urandom(32)
+
+# The version of the service cache is stored in the cache configured in CACHES, so other processes
+# notice if a process invalidates the service cache (see invalidate_service_cache()).
+SERVICE_CACHE_VERSION_KEY = 'restauth-service-cache-version'
+SERVICE_CACHE_VERSION = None
+SERVICE_CACHE_VERSION_CHECKED = 0
+SERVICE_CACHE_VERSION_INTERVAL = 1
+
+
+def _check_service_cache_version():
+    """Clear the service cache of this process if a different process invalidated it.
+
+    The shared version is checked at most every ``SERVICE_CACHE_VERSION_INTERVAL`` seconds.
+    """
+    global HOST_INDEX, SERVICE_CACHE_VERSION, SERVICE_CACHE_VERSION_CHECKED
+
+    now = time.time()
+    if now - SERVICE_CACHE_VERSION_CHECKED < SERVICE_CACHE_VERSION_INTERVAL:
+        return
+    SERVICE_CACHE_VERSION_CHECKED = now
+
+    version = cache.get(SERVICE_CACHE_VERSION_KEY)
+    if version != SERVICE_CACHE_VERSION:
+        if SERVICE_CACHE is not None:
+            SERVICE_CACHE.clear()
+        HOST_INDEX = None
+        SERVICE_CACHE_VERSION = version
+
+
+def get_service_cache():
+    """Get the in-process cache for verified service credentials.
+
+    The cache maps a keyed digest of the ``Authorization`` header to the service, see
+    :setting:`SERVICE_CACHE`.
+    """
+    global SERVICE_CACHE
+
+    if SERVICE_CACHE is None:
+        config = settings.SERVICE_CACHE
+        SERVICE_CACHE = LRUCache(size=config.get('SIZE', 100), ttl=config.get('TTL', 60))
+    _check_service_cache_version()
+    return SERVICE_CACHE
+
+
+HOST_INDEX = None
+
+
+def get_host_index():
+    """Get the in-process index of the networks that services may connect from.
+
+    The index maps the networks of all services to the primary keys of the services. It is rebuilt
+    if the service cache is invalidated or after ``TTL`` seconds (see :setting:`SERVICE_CACHE`).
+    """
+    global HOST_INDEX
+
+    _check_service_cache_version()
+    if HOST_INDEX is None or HOST_INDEX[0] < time.time():
+        index = PrefixIndex()
+        qs = ServiceAddress.objects.exclude(services=None).values_list('address', 'services')
+        for address, service in qs:
+            try:
+                index.add(address, service)
+            except ValueError:  # pragma: no cover - not validated by earlier versions
+                continue
+        HOST_INDEX = (time.time() + settings.SERVICE_CACHE.get('TTL', 60), index)
+    return HOST_INDEX[1]
+
+
+def invalidate_service_cache():
+    """Invalidate all cached service credentials and the host index.
+
+    The caches of this process are cleared right away. Other processes clear their caches once
+    they notice the new version in the cache configured in :setting:`CACHES`. If that cache is not
+    shared between processes (e.g. the default in-memory cache), other processes only notice the
+    change once their entries expire.
+    """
+    global HOST_INDEX, SERVICE_CACHE_VERSION
+
+    if SERVICE_CACHE is not None:
+        SERVICE_CACHE.clear()
+    HOST_INDEX = None
+
+    SERVICE_CACHE_VERSION = uuid.uuid4().hex
+    cache.set(SERVICE_CACHE_VERSION_KEY, SERVICE_CACHE_VERSION, None)
+
+
+def validate_network(value):
+    try:
+        normalize_network(value)
+    except ValueError:
+        raise ValidationError('Enter a valid IPv4 or IPv6 address or network.', code='invalid')
+
+
 class ServiceUsernameNotValid(BaseException):
     pass
 
@@ -79,6 +184,9 @@ def service_create(name, password, *hosts):
 
 
 class Service(User):
+    # compiled permissions, see get_all_permissions()
+    _permissions = None
+
     class Meta:
         proxy = True
 
@@ -93,11 +201,22 @@ class Service(User):
 
     def set_password(self, raw_password):
         self.password = make_password(raw_password, hasher=get_service_hasher())
+        self._password_changed = True
+
+    def save(self, *args, **kwargs):
+        super(Service, self).save(*args, **kwargs)
+
+        # Invalidate only after the new hash is saved, otherwise a concurrent request might cache
+        # the old credentials again.
+        if getattr(self, '_password_changed', False):
+            self._password_changed = False
+            invalidate_service_cache()
 
     def check_password(self, raw_password):
         def setter(raw_password):
-            self.set_password(raw_password)
-            self.save()
+            # The password did not change, so cached credentials remain valid.
+            self.password = make_password(raw_password, hasher=get_service_hasher())
+            self.save(update_fields=['password'])
         return check_password(raw_password, self.password, setter,
                               preferred=get_service_hasher())
 
@@ -108,7 +227,17 @@ class Service(User):
             return False
 
     def verify_host(self, host):
-        if self.hosts.filter(address=host).exists():
+        if settings.SECURE_CACHE and settings.SERVICE_CACHE:
+            index = get_host_index()
+        else:  # nothing is cached, so always use the current hosts of this service
+            index = PrefixIndex()
+            for address in self.hosts.values_list('address', flat=True):
+                try:
+                    index.add(address, self.pk)
+                except ValueError:  # pragma: no cover - not validated by earlier versions
+                    continue
+
+        if self.pk in index.lookup(host):
             return True
         else:
             return False
@@ -121,6 +250,8 @@ class Service(User):
         cleaned_hosts = [h.strip(', ') for h in raw_hosts]
         hosts = []
         for raw_host in cleaned_hosts:
+            validate_network(raw_host)
+            raw_host = normalize_network(raw_host)
             try:
                 host = ServiceAddress.objects.get(address=raw_host)
             except ServiceAddress.DoesNotExist:
@@ -130,16 +261,22 @@ class Service(User):
             hosts.append(host)
 
         self.hosts.add(*hosts)
+        invalidate_service_cache()
 
     def del_hosts(self, *raw_hosts):
         hosts = []
         for raw_host in raw_hosts:
             host = raw_host.strip(', ')
+            try:
+                host = normalize_network(host)
+            except ValueError:
+                pass
             try:
                 hosts.append(ServiceAddress.objects.get(address=host))
             except ServiceAddress.DoesNotExist:
                 pass
         self.hosts.remove(*hosts)
+        invalidate_service_cache()
 
     @property
     def addresses(self):
@@ -149,8 +286,32 @@ class Service(User):
     def permissions(self):
         return self.user_permissions.values_list('codename', flat=True).order_by('codename')
 
+    def get_all_permissions(self, obj=None):
+        """Get all permissions of this service as frozenset of ``"<app_label>.<codename>"``.
+
+        Unlike the default implementation, this method loads the permissions only once per
+        instance. Instances are cached by the authentication backend, so permission checks
+        usually do not cause any query.
+        """
+        if obj is not None:  # pragma: no cover
+            return super(Service, self).get_all_permissions(obj=obj)
+
+        if self._permissions is None:
+            qs = Permission.objects.filter(models.Q(user=self) | models.Q(group__user=self))
+            qs = qs.values_list('content_type__app_label', 'codename').order_by()
+            self._permissions = frozenset('%s.%s' % perm for perm in qs)
+        return self._permissions
+
+    def has_perm(self, perm, obj=None):
+        if obj is not None:  # pragma: no cover
+            return super(Service, self).has_perm(perm, obj=obj)
+        return self.is_active and (self.is_superuser or perm in self.get_all_permissions())
+
+
 class ServiceAddress(models.Model):
-    address = models.GenericIPAddressField(unique=True)
+    """An IPv4 or IPv6 address or network (in CIDR notation) that services may connect from."""
+
+    address = models.CharField(max_length=49, unique=True, validators=[validate_network])
     services = models.ManyToManyField(User, related_name='hosts')
 
     def __unicode__(self):  # pragma: no cover
@@ -15,13 +15,17 @@
 
 from __future__ import unicode_literals
 
+import time
+
 from base64 import b64encode
 
+from django.conf import settings
 from django.contrib.auth.models import Permission
 from django.contrib.auth import authenticate
 from django.contrib.contenttypes.models import ContentType
 from django.core.cache import cache
 from django.core.exceptions import ImproperlyConfigured
+from django.core.exceptions import ValidationError
 from django.db import transaction
 from django.test import TestCase
 from django.test.client import Client
@@ -31,11 +35,16 @@ from django.utils.six.moves import http_client
 
 import RestAuthCommon
 
+from Services import models
 from Services.models import Service
 from Services.models import ServiceUsernameNotValid
 from Services.models import service_create
+from Services.models import get_service_cache
 from Services.models import get_service_hasher
+from Services.models import invalidate_service_cache
 from Services.models import load_service_hasher
+from common import throttle
+from common.errors import Throttled
 from common.testdata import CliMixin
 from common.testdata import RestAuthTest
 from common.testdata import password1
@@ -163,6 +172,110 @@ class BasicAuthTests(RestAuthTest):  # GET /users/
         self.assertEqual(resp.status_code, http_client.UNAUTHORIZED)
 
 
+@override_settings(LOGGING_CONFIG=None)
+class TokenTests(RestAuthTest):
+    def setUp(self):
+        self.handler = RestAuthCommon.handlers.JSONContentHandler()
+        self.c = Client(
+            HTTP_ACCEPT=self.handler.mime,
+            REMOTE_ADDR='127.0.0.1',
+        )
+        self.service = service_create('example.com', 'nopass', '127.0.0.1')
+        u_ct = ContentType.objects.get(app_label="Users", model="serviceuser")
+        p, c = Permission.objects.get_or_create(
+            codename='users_list', content_type=u_ct,
+            defaults={'name': 'List all users'}
+        )
+        self.service.user_permissions.add(p)
+
+    def tearDown(self):
+        Service.objects.all().delete()
+
+    def set_auth(self, user, password):
+        decoded = '%s:%s' % (user, password)
+        return {
+            'HTTP_AUTHORIZATION': "Basic %s" % (b64encode(decoded.encode()).decode()),
+        }
+
+    def get_token(self, **headers):
+        resp = self.post('/tokens/', {}, **headers)
+        self.assertEqual(resp.status_code, http_client.OK)
+        data = self.parse(resp, 'dict')
+        self.assertEqual(data['expires'], settings.SERVICE_TOKEN_LIFETIME)
+        return data['token']
+
+    def test_token(self):
+        token = self.get_token(**self.set_auth('example.com', 'nopass'))
+
+        resp = self.get('/users/', HTTP_AUTHORIZATION='Bearer %s' % token)
+        self.assertEqual(resp.status_code, http_client.OK)
+        self.assertCountEqual(self.parse(resp, 'list'), [])
+
+        # permission snapshot:
+        resp = self.post('/users/', {'user': 'foobar'}, HTTP_AUTHORIZATION='Bearer %s' % token)
+        self.assertEqual(resp.status_code, http_client.FORBIDDEN)
+
+        # tokens can't be used to get new tokens:
+        resp = self.post('/tokens/', {}, HTTP_AUTHORIZATION='Bearer %s' % token)
+        self.assertEqual(resp.status_code, http_client.FORBIDDEN)
+
+    def test_no_queries(self):
+        token = self.get_token(**self.set_auth('example.com', 'nopass'))
+        with self.assertNumQueries(0):
+            service = authenticate(header='Bearer %s' % token, host='127.0.0.1')
+            self.assertEqual(service.pk, self.service.pk)
+            self.assertEqual(service.name, 'example.com')
+            self.assertTrue(service.has_perm('Users.users_list'))
+            self.assertFalse(service.has_perm('Users.user_create'))
+
+    def test_flags(self):
+        self.service.is_superuser = True
+        self.service.save()
+        token = self.get_token(**self.set_auth('example.com', 'nopass'))
+        service = authenticate(header='Bearer %s' % token, host='127.0.0.1')
+        self.assertTrue(service.is_superuser)
+        self.assertTrue(service.has_perm('Users.user_create'))
+
+        resp = self.get('/groups/', HTTP_AUTHORIZATION='Bearer %s' % token)
+        self.assertEqual(resp.status_code, http_client.OK)
+
+        self.service.is_superuser = False
+        self.service.is_active = False
+        self.service.save()
+        invalidate_service_cache()
+        token = self.get_token(**self.set_auth('example.com', 'nopass'))
+        service = authenticate(header='Bearer %s' % token, host='127.0.0.1')
+        self.assertFalse(service.is_superuser)
+        self.assertFalse(service.is_active)
+        self.assertFalse(service.has_perm('Users.users_list'))
+
+    def test_wrong_host(self):
+        token = self.get_token(**self.set_auth('example.com', 'nopass'))
+        self.assertIsNone(authenticate(header='Bearer %s' % token, host='127.0.0.2'))
+
+    def test_expired(self):
+        token = self.get_token(**self.set_auth('example.com', 'nopass'))
+        with self.settings(SERVICE_TOKEN_LIFETIME=-1):
+            expired = self.get_token(**self.set_auth('example.com', 'nopass'))
+        self.assertIsNotNone(authenticate(header='Bearer %s' % token, host='127.0.0.1'))
+        self.assertIsNone(authenticate(header='Bearer %s' % expired, host='127.0.0.1'))
+
+    def test_tampered(self):
+        token = self.get_token(**self.set_auth('example.com', 'nopass'))
+        payload, signature = token.split('.')
+        for header in ['Bearer %s.%s' % (payload[:-1], signature),
+                       'Bearer %s.%s' % (payload, signature[:-1]),
+                       'Bearer %s' % payload, 'Bearer foo.bar.baz', 'Bearer äöü']:
+            self.assertIsNone(authenticate(header=header, host='127.0.0.1'))
+
+        with self.settings(SECRET_KEY='other'):
+            self.assertIsNone(authenticate(header='Bearer %s' % token, host='127.0.0.1'))
+
+    def test_wrong_credentials(self):
+        resp = self.post('/tokens/', {}, **self.set_auth('example.com', 'wrong'))
+        self.assertEqual(resp.status_code, http_client.UNAUTHORIZED)
+
+
 class ServiceHostTests(TestCase):
     """
     Test Service model, more specifically the hosts functionality. This is not
@@ -209,6 +322,45 @@ class ServiceHostTests(TestCase):
         self.assertFalse(self.service.verify_host('127.0.0.2'))
         self.assertFalse(self.service.verify_host('::2'))
 
+    def test_verify_network(self):
+        self.assertIsNone(self.service.set_hosts('192.168.0.0/24', '2001:DB8::/32', '10.0.0.1'))
+        self.assertCountEqual(self.get_hosts(), ['192.168.0.0/24', '2001:db8::/32', '10.0.0.1'])
+
+        with self.assertNumQueries(1):  # builds the host index
+            self.assertTrue(self.service.verify_host('192.168.0.1'))
+        with self.assertNumQueries(0):
+            self.assertTrue(self.service.verify_host('192.168.0.255'))
+            self.assertTrue(self.service.verify_host('2001:db8::1'))
+            self.assertTrue(self.service.verify_host('10.0.0.1'))
+            self.assertFalse(self.service.verify_host('192.168.1.1'))
+            self.assertFalse(self.service.verify_host('2001:db9::1'))
+            self.assertFalse(self.service.verify_host('10.0.0.2'))
+            self.assertFalse(self.service.verify_host('foobar'))
+
+        # other services do not match:
+        other = service_create('example.net', 'nopass', '192.168.0.1')
+        self.assertFalse(other.verify_host('192.168.0.2'))
+        self.assertTrue(other.verify_host('192.168.0.1'))
+        self.assertTrue(self.service.verify_host('192.168.0.1'))
+
+        self.assertIsNone(self.service.del_hosts('192.168.0.0/24'))
+        self.assertFalse(self.service.verify_host('192.168.0.2'))
+
+    def test_verify_host_no_cache(self):
+        self.service.set_hosts('192.168.0.0/24')
+        with self.settings(SECURE_CACHE=False):
+            self.assertTrue(self.service.verify_host('192.168.0.1'))
+
+            # changes that bypass Service.del_hosts() are still seen right away
+            self.service.hosts.clear()
+            with self.assertNumQueries(1):
+                self.assertFalse(self.service.verify_host('192.168.0.1'))
+
+    def test_invalid_network(self):
+        for network in ['192.168.0.1/24', '192.168.0.0/33', '::1/129', '10.0.0.0/', 'foo/8']:
+            self.assertRaises(ValidationError, self.service.add_hosts, network)
+        self.assertCountEqual(self.get_hosts(), [])
+
     def test_verify(self):
         hosts = ['127.0.0.1', '::1']
         self.assertIsNone(self.service.set_hosts(*hosts))
@@ -294,6 +446,81 @@ class AuthBackendTests(RestAuthTest):
         header = '%s %s' % ('Basic', encoded)
         self.assertTrue(authenticate(header=header, host=host) is None)
 
+    def test_cache(self):
+        self.assertTrue(self.auth(self.service, 'nopass'))
+        self.assertEqual(len(get_service_cache()), 1)
+        with self.assertNumQueries(0):
+            self.assertTrue(self.auth(self.service, 'nopass'))
+            self.assertTrue(self.auth(self.service, 'nopass', '::2') is None)
+
+    def test_cache_invalidation(self):
+        self.assertTrue(self.auth(self.service, 'nopass'))
+
+        self.service.set_password('newpass')
+        self.assertEqual(len(get_service_cache()), 1)  # not saved yet
+        self.service.save()
+        self.assertEqual(len(get_service_cache()), 0)
+        self.assertTrue(self.auth(self.service, 'nopass') is None)
+        self.assertTrue(self.auth(self.service, 'newpass'))
+
+        self.service.add_hosts('::2')
+        self.assertTrue(self.auth(self.service, 'newpass', '::2'))
+        self.service.del_hosts('::2')
+        self.assertTrue(self.auth(self.service, 'newpass', '::2') is None)
+        self.service.set_hosts('::2')
+        self.assertTrue(self.auth(self.service, 'newpass', '::2'))
+        self.assertTrue(self.auth(self.service, 'newpass', '::1') is None)
+
+    def test_cache_invalidation_other_process(self):
+        self.assertTrue(self.auth(self.service, 'nopass'))
+        self.assertEqual(len(get_service_cache()), 1)
+
+        # another process (e.g. restauth-service) invalidated the cache
+        cache.set(models.SERVICE_CACHE_VERSION_KEY, 'other-version')
+        models.SERVICE_CACHE_VERSION_CHECKED = time.time()
+        self.assertEqual(len(get_service_cache()), 1)  # checked at most once a second
+
+        models.SERVICE_CACHE_VERSION_CHECKED = 0
+        self.assertEqual(len(get_service_cache()), 0)
+        self.assertEqual(models.SERVICE_CACHE_VERSION, 'other-version')
+
+    def test_permissions(self):
+        u_ct = ContentType.objects.get(app_label="Users", model="serviceuser")
+        perm = Permission.objects.get_or_create(
+            codename='users_list', content_type=u_ct, defaults={'name': 'List users'})[0]
+        self.service.user_permissions.add(perm)
+
+        service = self.auth(self.service, 'nopass')
+        with self.assertNumQueries(0):
+            self.assertTrue(service.has_perm('Users.users_list'))
+            self.assertTrue(service.has_perms(['Users.users_list']))
+            self.assertFalse(service.has_perm('Users.user_create'))
+            self.assertFalse(service.has_perms(['Users.users_list', 'Users.user_create']))
+
+            # the next request gets the cached service with compiled permissions
+            service = self.auth(self.service, 'nopass')
+            self.assertTrue(service.has_perm('Users.users_list'))
+
+        with capture():
+            cli(['rm-permissions', self.service.name, 'users_list'])
+        self.assertFalse(self.auth(self.service, 'nopass').has_perm('Users.users_list'))
+
+    @override_settings(AUTH_THROTTLE={'LIMIT': 2, 'WINDOW': 60})
+    def test_throttle(self):
+        throttle._throttle = None
+        self.addCleanup(setattr, throttle, '_throttle', None)
+
+        for secure_cache in [True, False]:
+            with self.settings(SECURE_CACHE=secure_cache):
+                self.assertIsNone(self.auth(self.service, 'wrong'))
+                self.assertIsNone(self.auth(self.service, 'wrong'))
+                self.assertRaises(Throttled, self.auth, self.service, 'nopass')
+
+                # other hosts are not affected:
+                self.assertIsNone(self.auth(self.service, 'wrong', host='::2'))
+
+                throttle.get_throttle().clear()
+                self.assertTrue(self.auth(self.service, 'nopass'))
 
     def test_no_cache(self):
         with self.settings(SECURE_CACHE=False):
@@ -326,6 +553,48 @@ class ServiceHasherTests(RestAuthTest):
                 self.assertRaises(ImproperlyConfigured):
             load_service_hasher()
 
+    def test_hmac_sha256(self):
+        md5 = 'django.contrib.auth.hashers.MD5PasswordHasher'
+        hmac = 'common.hashers.HmacSha256Hasher'
+
+        with self.settings(SERVICE_PASSWORD_HASHER=md5, PASSWORD_HASHERS=(md5, hmac)):
+            load_service_hasher()
+            service = service_create(servicename3, password1)
+            self.assertTrue(service.password.startswith('md5$'))
+
+        with self.settings(SERVICE_PASSWORD_HASHER=hmac, PASSWORD_HASHERS=(md5, hmac)):
+            load_service_hasher()
+
+            # password is transparently upgraded:
+            self.assertTrue(service.check_password(password1))
+            service = Service.objects.get(username=servicename3)
+            self.assertTrue(service.password.startswith('hmac_sha256$'))
+
+            self.assertTrue(service.check_password(password1))
+            self.assertFalse(service.check_password(password2))
+
+            # the pepper is derived from the SECRET_KEY:
+            with self.settings(SECRET_KEY='other'):
+                self.assertFalse(service.check_password(password1))
+
+    def test_rehash_keeps_cache(self):
+        md5 = 'django.contrib.auth.hashers.MD5PasswordHasher'
+        hmac = 'common.hashers.HmacSha256Hasher'
+
+        with self.settings(SERVICE_PASSWORD_HASHER=md5, PASSWORD_HASHERS=(md5, hmac)):
+            load_service_hasher()
+            service = service_create(servicename3, password1)
+        version = models.SERVICE_CACHE_VERSION
+
+        with self.settings(SERVICE_PASSWORD_HASHER=hmac, PASSWORD_HASHERS=(md5, hmac)):
+            load_service_hasher()
+
+            # the password did not change, so the cache is not invalidated
+            self.assertTrue(service.check_password(password1))
+            service = Service.objects.get(username=servicename3)
+            self.assertTrue(service.password.startswith('hmac_sha256$'))
+            self.assertEqual(models.SERVICE_CACHE_VERSION, version)
+
     def tearDown(self):
         load_service_hasher()
 
@@ -467,7 +736,8 @@ Permissions: %s
             except SystemExit as e:
                 self.assertEqual(e.code, 2)
                 self.assertEqual(stdout.getvalue(), '')
-                self.assertHasLine(stderr, 'error: Enter a valid IPv4 or IPv6 address.$')
+                self.assertHasLine(stderr,
+                                   'error: Enter a valid IPv4 or IPv6 address or network.$')
         self.assertCountEqual(s.hosts.values_list('address', flat=True), [])
 
     def test_add_hosts(self):
@@ -496,7 +766,8 @@ Permissions: %s
             except SystemExit as e:
                 self.assertEqual(e.code, 2)
                 self.assertEqual(stdout.getvalue(), '')
-                self.assertHasLine(stderr, 'error: Enter a valid IPv4 or IPv6 address.$')
+                self.assertHasLine(stderr,
+                                   'error: Enter a valid IPv4 or IPv6 address or network.$')
         self.assertCountEqual(s.hosts.values_list('address', flat=True), [])
 
     def test_rm_hosts(self):
@@ -585,3 +856,11 @@ Permissions: %s
         s = Service.objects.get(username=servicename5)
         self.assertFalse(s.has_perm('Users.props_list'))
         self.assertTrue(s.has_perm('Groups.groups_list'))
+
+    def test_permissions_invalidate_cache(self):
+        service_cache = get_service_cache()
+        for action in ['set-permissions', 'add-permissions', 'rm-permissions']:
+            service_cache.set('key', self.service)
+            with capture() as (stdout, stderr):
+                cli([action, self.service.name, 'users_list'])
+            self.assertEqual(len(service_cache), 0)
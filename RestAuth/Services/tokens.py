@@ -0,0 +1,91 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of RestAuth (https://restauth.net).
+#
+# RestAuth is free software: you can redistribute it and/or modify it under the terms of the GNU
+# General Public License as published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# RestAuth is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without
+# even the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with RestAuth.  If not,
+# see <http://www.gnu.org/licenses/>.
+
+"""Short-lived access tokens for services.
+
+A token contains the id and name of the service, the host it was issued to, the permissions and
+flags of the service and an expiry date. It is signed with a key derived from
+:setting:`SECRET_KEY`, so it can be verified with a single HMAC and without accessing the database.
+"""
+
+from __future__ import unicode_literals
+
+import base64
+import hashlib
+import hmac
+import json
+import time
+
+from django.conf import settings
+from django.utils.crypto import constant_time_compare
+
+from Services.models import Service
+
+
+def _key():
+    return hashlib.sha256(('RestAuth.tokens:%s' % settings.SECRET_KEY).encode('utf-8')).digest()
+
+
+def _sign(payload):
+    signature = hmac.new(_key(), payload, hashlib.sha256).digest()
+    return base64.urlsafe_b64encode(signature).rstrip(b'=')
+
+
+def create_token(service, host):
+    """Create a token for ``service`` that may only be used from ``host``.
+
+    :return: The token and the number of seconds it is valid.
+    """
+    lifetime = settings.SERVICE_TOKEN_LIFETIME
+    data = {
+        'id': service.pk,
+        'name': service.username,
+        'host': host,
+        'perms': sorted(service.get_all_permissions()),
+        'is_superuser': service.is_superuser,
+        'is_active': service.is_active,
+        'expires': int(time.time()) + lifetime,
+    }
+    payload = base64.urlsafe_b64encode(json.dumps(data, sort_keys=True).encode('utf-8'))
+    payload = payload.rstrip(b'=')
+    return '%s.%s' % (payload.decode('ascii'), _sign(payload).decode('ascii')), lifetime
+
+
+def verify_token(token, host):
+    """Verify a token created by :py:func:`create_token`.
+
+    :return: The :py:class:`~Services.models.Service` the token was issued for or ``None`` if the
+        token is invalid, expired or used from a different host. The service is not loaded from the
+        database, its permissions and flags are those at the time the token was created.
+    """
+    try:
+        payload, signature = token.encode('ascii').split(b'.')
+    except (UnicodeError, ValueError):
+        return None
+    if not constant_time_compare(_sign(payload), signature):
+        return None
+
+    try:
+        data = json.loads(base64.urlsafe_b64decode(payload + b'=' * (-len(payload) % 4)).decode(
+            'utf-8'))
+    except (TypeError, ValueError):  # pragma: no cover - we signed it ourself
+        return None
+    if data['expires'] < time.time() or data['host'] != host:
+        return None
+
+    service = Service(id=data['id'], username=data['name'], is_superuser=data['is_superuser'],
+                      is_active=data['is_active'])
+    service._permissions = frozenset(data['perms'])
+    return service
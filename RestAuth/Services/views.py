@@ -14,3 +14,34 @@
 #
 # You should have received a copy of the GNU General Public License
 # along with RestAuth.  If not, see <http://www.gnu.org/licenses/>.
+
+"""This module implements all HTTP queries to ``/tokens/``."""
+
+from __future__ import unicode_literals
+
+import logging
+
+from django.http import HttpResponseForbidden
+
+from Services.tokens import create_token
+from common.responses import HttpRestAuthResponse
+from common.views import RestAuthView
+
+
+class TokensView(RestAuthView):
+    """Handle requests to ``/tokens/``."""
+
+    http_method_names = ['post']
+    log = logging.getLogger('tokens')
+
+    def post(self, request, largs):
+        """Create a new token for the authenticated service."""
+
+        method = request.META.get('HTTP_AUTHORIZATION', '').split(' ', 1)[0]
+        if method.lower() == 'bearer':
+            # tokens must not be used to extend their own lifetime
+            return HttpResponseForbidden()
+
+        token, expires = create_token(request.user, request.META['REMOTE_ADDR'])
+        self.log.info('Created token', extra=largs)
+        return HttpRestAuthResponse(request, {'token': token, 'expires': expires})
@@ -15,10 +15,12 @@
 
 from __future__ import unicode_literals
 
-from django.contrib.auth.hashers import check_password
-from django.contrib.auth.hashers import make_password
 from django.db import models
 
+from common.executor import HashUpgrade
+from common.executor import check_password
+from common.executor import make_password
+
 
 user_permissions = (
     ('users_list', 'List all users'),
@@ -55,10 +57,12 @@ class ServiceUser(models.Model):
 
     def check_password(self, raw_password):
         """Check a users password."""
-        def setter(raw_password):
-            self.set_password(raw_password)
-            self.save()
-        return check_password(raw_password, self.password, setter)
+        stored = self.password
+
+        def write(encoded):
+            # don't overwrite a password that was changed in the meantime
+            ServiceUser.objects.filter(pk=self.pk, password=stored).update(password=encoded)
+        return check_password(raw_password, stored, HashUpgrade(write))
 
     def set_property(self, key, value):
         """Set the property identified by I{key} to I{value}. If the property already exists, it is
@@ -41,6 +41,8 @@ from common.cli.helpers import write_usage
 from common.cli.helpers import write_parameters
 from common.errors import UserNotFound
 from common.errors import PropertyNotFound
+from common import throttle
+from common.hashers import Drupal7Hasher
 from common.testdata import CliMixin
 from common.testdata import PASSWORD_HASHERS
 from common.testdata import RestAuthTestBase
@@ -87,6 +89,24 @@ class GetUsersTests(RestAuthTransactionTest):  # GET /users/
         self.assertEqual(resp.status_code, http_client.OK)
         self.assertCountEqual(self.parse(resp, 'list'), [username1, username2])
 
+    def test_get_users_paginated(self):
+        users = [username1, username2, username3]
+        for username in users:
+            self.create_user(username, password1)
+
+        self.assertCountEqual(self.get_pages('/users/', 1), users)
+        self.assertCountEqual(self.get_pages('/users/', 2), users)
+
+        resp = self.get('/users/', {'limit': 10})
+        self.assertEqual(resp.status_code, http_client.OK)
+        self.assertFalse(resp.has_header('Link'))
+        self.assertCountEqual(self.parse(resp, 'list'), users)
+
+    def test_get_users_bad_limit(self):
+        for limit in ['0', '-1', 'foo']:
+            resp = self.get('/users/', {'limit': limit})
+            self.assertEqual(resp.status_code, http_client.BAD_REQUEST)
+
 
 class AddUserTests(RestAuthTransactionTest):  # POST /users/
     def get_usernames(self):
@@ -305,6 +325,17 @@ class VerifyPasswordsTest(UserTests):  # POST /users/<user>/
         resp = self.post('/users/%s/' % username1, data)
         self.assertEqual(resp.status_code, http_client.NO_CONTENT)
 
+    def test_password_groups_wrong_password(self):
+        backend.create_group(group=groupname1, service=self.service)
+        backend.add_member(group=groupname1, service=self.service, user=username1)
+
+        resp = self.post('/users/%s/' % username1, {'password': 'wrong', 'groups': [groupname1]})
+        self.assertEqual(resp.status_code, http_client.NOT_FOUND)
+        self.assertEqual(resp['Resource-Type'], 'user')
+        self.assertFalse(backend.check_password(username1, 'wrong',
+                                                groups=[(groupname1, self.service)]))
+        self.assertFalse(backend.check_password(username1, password1, groups=[]))
+
     @skipUnless(settings.DATA_BACKEND['BACKEND'] == 'backends.django.DjangoBackend', '')
     def test_update_password_hash(self):
         """Test if checking the password with an old hash automatically updates the hash."""
@@ -330,6 +361,30 @@ class VerifyPasswordsTest(UserTests):  # POST /users/<user>/
         resp = self.post('/users/%s/' % username3, {'password': None, })
         self.assertEqual(resp.status_code, http_client.BAD_REQUEST)
 
+    @override_settings(AUTH_THROTTLE={'LIMIT': 2, 'WINDOW': 60})
+    def test_throttle(self):
+        throttle._throttle = None
+        self.addCleanup(setattr, throttle, '_throttle', None)
+
+        for i in range(2):
+            resp = self.post('/users/%s/' % username1, {'password': 'wrong', })
+            self.assertEqual(resp.status_code, http_client.NOT_FOUND)
+
+        # even the right password is rejected now:
+        resp = self.post('/users/%s/' % username1, {'password': password1, })
+        self.assertEqual(resp.status_code, 429)
+
+        # other users are not affected
+        resp = self.post('/users/%s/' % username2, {'password': password2, })
+        self.assertEqual(resp.status_code, http_client.NO_CONTENT)
+
+        # non-existing users are throttled too
+        for i in range(2):
+            resp = self.post('/users/%s/' % username3, {'password': 'wrong', })
+            self.assertEqual(resp.status_code, http_client.NOT_FOUND)
+        resp = self.post('/users/%s/' % username3, {'password': 'wrong', })
+        self.assertEqual(resp.status_code, 429)
+
     def test_bad_requests(self):
         resp = self.post('/users/%s/' % username1, {})
         self.assertEqual(resp.status_code, http_client.BAD_REQUEST)
@@ -822,9 +877,31 @@ class Drupal7Test(HashTestMixin, TransactionTestCase):
         },
     }
 
+    # generated with the original (slower) implementation of Drupal7Handler._calc_checksum
+    unicode_testdata = {
+        'password': 'Dmqb6GYpsn4PThLfVe40wwCRBBT8UI1.I.5DvyV.aZ2XD7nYfmMK',
+        'pässwörd 愱': 'DaDXkV9LQTV3ppuExhSkvwOAJGrPMPczck968L5Q7ts/e8P0XdyU',
+        '': 'DIbDQequycRC9zHkQ.jkVY8H1KFplLbjqkLot36/kgvU/wLIAq6T',
+    }
+
     def generate(self, data):
         return '%s$$S$%s%s' % (self.algorithm, data['salt'], data['hash'])
 
+    def test_checksum(self):
+        # The checksum loop is optimized for speed, make sure it still produces exactly the
+        # hashes Drupal itself creates.
+        handler = Drupal7Hasher().hasher
+        for password, data in six.iteritems(self.testdata):
+            parsed = handler.from_string('$S$%s%s' % (data['salt'], data['hash']))
+            self.assertEqual(parsed._calc_checksum(password), parsed.checksum)
+            self.assertTrue(check_password(password, self.generate(data)))
+            self.assertFalse(check_password('%s-wrong' % password, self.generate(data)))
+
+        for password, encoded in six.iteritems(self.unicode_testdata):
+            encoded = '%s$$S$%s' % (self.algorithm, encoded)
+            self.assertTrue(check_password(password, encoded))
+            self.assertFalse(check_password('%s-wrong' % password, encoded))
+
 
 @skipUnless(settings.DATA_BACKEND['BACKEND'] == 'backends.django.DjangoBackend', '')
 @override_settings(PASSWORD_HASHERS=('common.hashers.Sha512Hasher',))
@@ -34,6 +34,8 @@ from common.errors import UserNotFound
 from common.responses import HttpResponseCreated
 from common.responses import HttpResponseNoContent
 from common.responses import HttpRestAuthResponse
+from common.responses import HttpRestAuthStreamingResponse
+from common.throttle import get_throttle
 from common.types import parse_dict
 from common.views import RestAuthResourceView
 from common.views import RestAuthSubResourceView
@@ -65,8 +67,13 @@ class UsersView(RestAuthView):
         if not request.user.has_perm('Users.users_list'):
             return HttpResponseForbidden()
 
-        names = [n.lower() for n in backend.list_users()]
-        return HttpRestAuthResponse(request, names)
+        limit, after = self._parse_page(request)
+        if limit is not None:
+            names, after = backend.page_users(limit, after=after)
+            return self._page_response(request, [n.lower() for n in names], after)
+
+        names = (n.lower() for n in backend.iter_users())
+        return HttpRestAuthStreamingResponse(request, names)
 
     def post(self, request, largs, dry=False):
         """Create a new user."""
@@ -143,9 +150,22 @@ class UserHandlerView(RestAuthResourceView):
         if groups is not None:
             groups = [(group, request.user) for group in groups]
 
-        if backend.check_password(user=name, password=password, groups=groups):
+        # If Throttled: 429 Too Many Requests
+        throttle = get_throttle()
+        throttle_key = 'user:%s:%s' % (request.user.username, name)
+        if throttle is not None:
+            throttle.check(throttle_key)
+
+        try:
+            matches = backend.check_password(user=name, password=password, groups=groups)
+        except UserNotFound:
+            matches = False
+
+        if matches:
             return HttpResponseNoContent()
         else:
+            if throttle is not None:
+                throttle.fail(throttle_key)
             raise UserNotFound(name)
 
     def put(self, request, largs, name):
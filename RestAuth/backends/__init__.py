@@ -25,6 +25,11 @@ def get_backend():
         'BACKEND': 'backends.django.DjangoBackend',
     }).copy()
     backend_cls = import_string(config.pop('BACKEND', 'backends.django.DjangoBackend'))
+
+    if getattr(settings, 'PASSWORD_CACHE', None):
+        from backends.mixins import PasswordCacheMixin
+        backend_cls = type(str(backend_cls.__name__), (PasswordCacheMixin, backend_cls), {})
+
     return backend_cls(**config)
 
 backend = get_backend()
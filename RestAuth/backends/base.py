@@ -17,6 +17,8 @@
 
 from __future__ import unicode_literals, absolute_import
 
+import heapq
+
 from django.utils import importlib
 
 class TransactionManagerBase(object):
@@ -31,6 +33,34 @@ class TransactionManagerBase(object):
         raise NotImplementedError
 
 
+class ChildTransactionManager(TransactionManagerBase):
+    """Enter the transactions of all child backends of a backend that wraps other backends.
+
+    The child backends are listed in the ``children`` attribute of the backend. Note that they
+    commit one after another, there is no two-phase commit.
+    """
+
+    def __init__(self, backend, dry=False):
+        super(ChildTransactionManager, self).__init__(backend, dry=dry)
+        self.managers = [child.transaction(dry=dry) for child in backend.children]
+        self.entered = []
+
+    def __enter__(self):
+        for manager in self.managers:
+            manager.__enter__()
+            self.entered.append(manager)
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        error = None
+        while self.entered:
+            try:
+                self.entered.pop().__exit__(exc_type, exc_value, traceback)
+            except Exception as e:
+                error = error or e
+        if error is not None and exc_type is None:
+            raise error
+
+
 class BackendBase(object):  # pragma: no cover
     _library = None
     library = None
@@ -57,6 +87,15 @@ class BackendBase(object):  # pragma: no cover
         except ImportError as e:
             raise ValueError("Couldn't load %r: %s" % (self.__class__.__name__, e))
 
+    def _page(self, names, limit, after=None):
+        # Keyset pagination of an unsorted iterable, keeps only limit + 1 names in memory.
+        if after is not None:
+            names = (name for name in names if name > after)
+        names = heapq.nsmallest(limit + 1, names)
+        if len(names) > limit:
+            return names[:limit], names[limit - 1]
+        return names, None
+
     def testSetUp(self):
         """Set up your backend for a test run.
 
@@ -118,13 +157,43 @@ class BackendBase(object):  # pragma: no cover
         raise NotImplementedError
 
     def list_users(self):
-        """Get a list of all users.
+        """Get all users.
 
         :return: A list of usernames.
         :rtype: list
         """
         raise NotImplementedError
 
+    def iter_users(self):
+        """Iterate over all users, used by the unpaginated ``GET /users/``.
+
+        Unlike :py:func:`~backends.base.BackendBase.list_users`, this method may return any
+        iterable, e.g. a generator fetching users in batches. The default implementation just
+        returns an iterator over :py:func:`~backends.base.BackendBase.list_users`.
+
+        :return: An iterable of usernames.
+        """
+        return iter(self.list_users())
+
+    def page_users(self, limit, after=None):
+        """Get a page of users, used by the paginated ``GET /users/``.
+
+        The cursor is an opaque string for the caller. Backends using keyset pagination return
+        users sorted by name and use the last username of a page as the cursor, but backends may
+        use other cursors (e.g. the cursor of ``HSCAN`` in Redis). The default implementation
+        sorts the result of :py:meth:`list_users`, backends should implement this method if they
+        can do better.
+
+        :param limit: The maximum number of users to return.
+        :type  limit: int
+        :param after: The cursor returned with the previous page, None for the first page.
+        :type  after: str
+        :return: A tuple of the list of usernames and the cursor of the next page. The cursor is
+            None if there are no more users.
+        :rtype: tuple
+        """
+        return self._page(self.list_users(), limit, after)
+
     def user_exists(self, user):
         """Determine if the user exists.
 
@@ -153,7 +222,7 @@ class BackendBase(object):  # pragma: no cover
         """Check a users password.
 
         If the ``groups`` parameter is given, the backend should also check if the user is a member
-        in at least one of the given groups.
+        in at least one of the given groups, usually via :py:meth:`is_member_any`.
 
         :param user: The username.
         :type  user: str
@@ -201,6 +270,33 @@ class BackendBase(object):  # pragma: no cover
         """
         raise NotImplementedError
 
+    def get_password_hash(self, user):
+        """Get the password hash of a user.
+
+        This method is used by :py:class:`~backends.sharded.ShardedBackend` to move a user to a
+        different shard.
+
+        :param user: The username.
+        :type  user: str
+        :return: The password hash in the format used by Djangos password hashing framework or
+            ``None`` if the user has no password.
+        :rtype: str
+        :raise: :py:class:`~common.errors.UserNotFound` if the user doesn't exist.
+        """
+        raise NotImplementedError
+
+    def password_hashes(self):
+        """Get the password hashes of all users.
+
+        This method is used by |bin-restauth-manage| to report hashes created by outdated
+        algorithms. The order of the hashes is not relevant and users without a password may be
+        omitted.
+
+        :return: The password hashes in the format used by Djangos password hashing framework.
+        :rtype: iterable
+        """
+        raise NotImplementedError
+
     def remove_user(self, user):
         """Remove a user.
 
@@ -303,18 +399,38 @@ class BackendBase(object):  # pragma: no cover
         """
         raise NotImplementedError
 
-    def list_groups(self, service, user=None):
+    def list_groups(self, service, user=None, depth=None):
         """Get a list of group names for the given service.
 
         :param service: The service of the named group.
         :param user: If given, only return groups that the user is a member of.
         :type  user: str
+        :param depth: Override the recursion depth to use for meta-groups if ``user`` is given.
+            Normally, the backend should use :setting:`GROUP_RECURSION_DEPTH`.
+        :type  depth: int
         :return: list of strings, each representing a group name.
         :rtype: list
         :raise: :py:class:`~common.errors.UserNotFound` if the user doesn't exist.
         """
         raise NotImplementedError
 
+    def page_groups(self, service, limit, after=None):
+        """Get a page of groups of the given service, used by the paginated ``GET /groups/``.
+
+        Cursors work like in :py:meth:`page_users`, the default implementation sorts the result of
+        :py:meth:`list_groups`.
+
+        :param service: The service of the groups.
+        :type  service: :py:class:`~Services.models.Service` or None
+        :param limit: The maximum number of groups to return.
+        :type  limit: int
+        :param after: The cursor returned with the previous page, None for the first page.
+        :type  after: str
+        :return: A tuple of the list of group names and the cursor of the next page.
+        :rtype: tuple
+        """
+        return self._page(self.list_groups(service), limit, after)
+
     def create_group(self, group, service, users=None, dry=False):
         """Create a new group for the given service.
 
@@ -444,6 +560,26 @@ class BackendBase(object):  # pragma: no cover
         """
         raise NotImplementedError
 
+    def page_members(self, group, service, limit, after=None):
+        """Get a page of members of a group, used by the paginated ``GET /groups/<group>/users/``.
+
+        Cursors work like in :py:meth:`page_users`, the default implementation sorts the result of
+        :py:meth:`members`.
+
+        :param group: The group to get the members for.
+        :type  group: str
+        :param service: The service of the given group.
+        :type  service: :py:class:`~Services.models.Service` or None
+        :param limit: The maximum number of users to return.
+        :type  limit: int
+        :param after: The cursor returned with the previous page, None for the first page.
+        :type  after: str
+        :return: A tuple of the list of usernames and the cursor of the next page.
+        :rtype: tuple
+        :raise: :py:class:`common.errors.GroupNotFound` if the named group does not exist.
+        """
+        return self._page(self.members(group, service), limit, after)
+
     def is_member(self, group, service, user):
         """Determine if a user is a member of the given group.
 
@@ -460,6 +596,42 @@ class BackendBase(object):  # pragma: no cover
         """
         raise NotImplementedError
 
+    def is_member_any(self, user, groups):
+        """Determine if a user is a member of at least one of the given groups.
+
+        Backends should answer this with as few queries as possible instead of calling
+        :py:meth:`is_member` for every group, it is used by :py:meth:`check_password`.
+
+        :param user: The user to test for membership.
+        :type  user: str
+        :param groups: A list of groups, the format is the same as in :py:func:`create_user`.
+            Groups that do not exist are ignored.
+        :type  groups: list
+        :return: True if the user is a member of at least one group, False otherwise (also if the
+            user does not exist).
+        :rtype: boolean
+        """
+        raise NotImplementedError
+
+    def members_of(self, group, service, users):
+        """Get the subset of the given users that are members of the given group.
+
+        This is the bulk variant of :py:meth:`is_member`, backends should answer it with as few
+        queries as possible.
+
+        :param group: The group to test for membership.
+        :type  group: str
+        :param service: The service of the given group.
+        :type  service: :py:class:`~Services.models.Service` or None
+        :param users: The users to test for membership.
+        :type  users: list
+        :return: list of strings, each representing a username. Users that do not exist are not
+            included.
+        :rtype: list
+        :raise: :py:class:`common.errors.GroupNotFound` if the named group does not exist.
+        """
+        raise NotImplementedError
+
     def remove_member(self, group, service, user):
         """Remove a user from the group.
 
@@ -0,0 +1,264 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of RestAuth (https://restauth.net).
+#
+# RestAuth is free software: you can redistribute it and/or modify it under the terms of the GNU
+# General Public License as published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# RestAuth is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without
+# even the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with RestAuth. If not,
+# see <http://www.gnu.org/licenses/>.
+
+from __future__ import unicode_literals, absolute_import
+
+from django.utils.module_loading import import_string
+
+from backends.base import BackendBase
+from backends.base import ChildTransactionManager
+from common.cache import LRUCache
+from common.errors import UserNotFound
+
+
+class CompositeBackend(BackendBase):
+    """Store users, properties and groups in different backends.
+
+    Users and their passwords are stored in the ``USERS`` backend, properties in the
+    ``PROPERTIES`` backend and groups in the ``GROUPS`` backend. Child backends configured
+    identically are only created once, so they may also share a backend.
+
+    Example::
+
+        DATA_BACKEND = {
+            'BACKEND': 'backends.composite.CompositeBackend',
+            'USERS': {'BACKEND': 'backends.django.DjangoBackend'},
+            'PROPERTIES': {'BACKEND': 'backends.redis.RedisBackend'},
+            'GROUPS': {'BACKEND': 'backends.redis.RedisBackend'},
+        }
+
+    The ``USERS`` backend decides if a user exists. The other backends store a copy of every user
+    (without a password), since they need it to store properties and memberships. Before a user
+    is used in another backend, the ``USERS`` backend is asked if the user exists. This check is
+    only best-effort: Answers are cached, positive answers for ``TTL`` and negative answers for
+    ``NEGATIVE_TTL`` seconds, so most operations don't need to query the ``USERS`` backend. Since
+    users are removed from all backends, a stale cache entry can't bring a removed user back to
+    life, but a user created by another process may be reported as missing until the negative
+    answer expires.
+
+    Writes that involve several backends (e.g. creating or removing users) are applied to one
+    backend after another and are not atomic. Create all users through this backend, users that
+    only exist in the ``USERS`` backend can't have properties or groups.
+
+    :param USERS: Configuration of the backend storing users and passwords, in the same format as
+        :setting:`DATA_BACKEND`.
+    :param PROPERTIES: Configuration of the backend storing properties.
+    :param GROUPS: Configuration of the backend storing groups.
+    :param EXISTS_CACHE: A dictionary with the ``SIZE``, ``TTL`` and ``NEGATIVE_TTL`` of the cache
+        for (non-)existing users, the default is ``{'SIZE': 10000, 'TTL': 60, 'NEGATIVE_TTL': 5}``.
+    """
+
+    TRANSACTION_MANAGER = ChildTransactionManager
+
+    def __init__(self, USERS, PROPERTIES, GROUPS, EXISTS_CACHE=None):
+        self.children = []
+        configs = []
+
+        def load(config):
+            if config in configs:  # same config, same backend
+                return self.children[configs.index(config)]
+
+            kwargs = dict(config)
+            backend_cls = import_string(kwargs.pop('BACKEND'))
+            backend = backend_cls(**kwargs)
+            configs.append(config)
+            self.children.append(backend)
+            return backend
+
+        self.users = load(USERS)
+        self.properties = load(PROPERTIES)
+        self.groups = load(GROUPS)
+        self.SUPPORTS_GROUP_VISIBILITY = self.groups.SUPPORTS_GROUP_VISIBILITY
+        self.SUPPORTS_SUBGROUPS = self.groups.SUPPORTS_SUBGROUPS
+
+        if EXISTS_CACHE is None:
+            EXISTS_CACHE = {}
+        self._exists = LRUCache(size=EXISTS_CACHE.get('SIZE', 10000),
+                                ttl=EXISTS_CACHE.get('TTL', 60))
+        self._negative_ttl = EXISTS_CACHE.get('NEGATIVE_TTL', 5)
+
+    def _check_user(self, user):
+        # Negative answers expire soon, so users created by other processes are found quickly.
+        exists = self._exists.get(user)
+        if exists is None:
+            exists = self.users.user_exists(user)
+            self._exists.set(user, exists, ttl=None if exists else self._negative_ttl)
+        if not exists:
+            raise UserNotFound(user)
+
+    def testSetUp(self):
+        for child in self.children:
+            child.testSetUp()
+        self._exists.clear()
+
+    def testTearDown(self):
+        for child in self.children:
+            child.testTearDown()
+        self._exists.clear()
+
+    def create_user(self, user, password=None, properties=None, groups=None, dry=False):
+        # collect the arguments for every distinct backend, the USERS backend goes first
+        calls = [(self.users, {'password': password})]
+        for backend, key, value in ((self.properties, 'properties', properties),
+                                    (self.groups, 'groups', groups)):
+            kwargs = [c[1] for c in calls if c[0] is backend]
+            if kwargs:
+                kwargs[0][key] = value
+            else:
+                calls.append((backend, {key: value}))
+
+        for backend, kwargs in calls:
+            backend.create_user(user, dry=dry, **kwargs)
+        if dry is False:
+            self._exists.delete(user)  # the user might have been cached as missing
+
+    def list_users(self):
+        return self.users.list_users()
+
+    def iter_users(self):
+        return self.users.iter_users()
+
+    def page_users(self, limit, after=None):
+        return self.users.page_users(limit, after=after)
+
+    def user_exists(self, user):
+        return self.users.user_exists(user)
+
+    def rename_user(self, user, name):
+        for child in self.children:
+            child.rename_user(user, name)
+        self._exists.delete(user)
+        self._exists.delete(name)
+
+    def check_password(self, user, password, groups=None):
+        if self.groups is self.users:
+            return self.users.check_password(user, password, groups=groups)
+
+        if not self.users.check_password(user, password):
+            return False
+        if groups is None:
+            return True
+        return self.groups.is_member_any(user, groups)
+
+    def set_password(self, user, password=None):
+        return self.users.set_password(user, password=password)
+
+    def set_password_hash(self, user, algorithm, hash):
+        return self.users.set_password_hash(user, algorithm=algorithm, hash=hash)
+
+    def get_password_hash(self, user):
+        return self.users.get_password_hash(user)
+
+    def password_hashes(self):
+        return self.users.password_hashes()
+
+    def remove_user(self, user):
+        self._exists.delete(user)
+        for child in self.children:
+            child.remove_user(user)
+
+    def get_properties(self, user):
+        self._check_user(user)
+        return self.properties.get_properties(user)
+
+    def create_property(self, user, key, value, dry=False):
+        self._check_user(user)
+        return self.properties.create_property(user, key, value, dry=dry)
+
+    def get_property(self, user, key):
+        self._check_user(user)
+        return self.properties.get_property(user, key)
+
+    def set_property(self, user, key, value):
+        self._check_user(user)
+        return self.properties.set_property(user, key, value)
+
+    def set_properties(self, user, properties):
+        self._check_user(user)
+        return self.properties.set_properties(user, properties)
+
+    def remove_property(self, user, key):
+        self._check_user(user)
+        return self.properties.remove_property(user, key)
+
+    def list_groups(self, service, user=None, depth=None):
+        if user is not None:
+            self._check_user(user)
+        return self.groups.list_groups(service, user=user, depth=depth)
+
+    def page_groups(self, service, limit, after=None):
+        return self.groups.page_groups(service, limit, after=after)
+
+    def create_group(self, group, service, users=None, dry=False):
+        return self.groups.create_group(group, service, users=users, dry=dry)
+
+    def rename_group(self, group, name, service):
+        return self.groups.rename_group(group, name, service)
+
+    def set_service(self, group, service, new_service):
+        return self.groups.set_service(group, service, new_service)
+
+    def group_exists(self, group, service):
+        return self.groups.group_exists(group, service)
+
+    def set_memberships(self, user, service, groups):
+        self._check_user(user)
+        return self.groups.set_memberships(user, service, groups)
+
+    def set_members(self, group, service, users):
+        return self.groups.set_members(group, service, users)
+
+    def add_member(self, group, service, user):
+        self._check_user(user)
+        return self.groups.add_member(group, service, user)
+
+    def members(self, group, service, depth=None):
+        return self.groups.members(group, service, depth=depth)
+
+    def page_members(self, group, service, limit, after=None):
+        return self.groups.page_members(group, service, limit, after=after)
+
+    def is_member(self, group, service, user):
+        return self.groups.is_member(group, service, user)
+
+    def is_member_any(self, user, groups):
+        return self.groups.is_member_any(user, groups)
+
+    def members_of(self, group, service, users):
+        return self.groups.members_of(group, service, users)
+
+    def remove_member(self, group, service, user):
+        return self.groups.remove_member(group, service, user)
+
+    def add_subgroup(self, group, service, subgroup, subservice):
+        return self.groups.add_subgroup(group, service, subgroup, subservice)
+
+    def set_subgroups(self, group, service, subgroups, subservice):
+        return self.groups.set_subgroups(group, service, subgroups, subservice)
+
+    def is_subgroup(self, group, service, subgroup, subservice):
+        return self.groups.is_subgroup(group, service, subgroup, subservice)
+
+    def remove_subgroup(self, group, service, subgroup, subservice):
+        return self.groups.remove_subgroup(group, service, subgroup, subservice)
+
+    def subgroups(self, group, service, filter=True):
+        return self.groups.subgroups(group, service, filter=filter)
+
+    def parents(self, group, service):
+        return self.groups.parents(group, service)
+
+    def remove_group(self, group, service):
+        return self.groups.remove_group(group, service)
@@ -17,11 +17,14 @@ from __future__ import unicode_literals, absolute_import
 
 #import warnings
 
+from django.conf import settings
 from django.db import transaction
+from django.db.models import Q
 from django.db.utils import IntegrityError
 from django.utils import six
 
 from Groups.models import Group
+from Groups.models import GroupClosure
 from Users.models import Property
 from Users.models import ServiceUser as User
 from backends.base import BackendBase
@@ -68,6 +71,15 @@ class DjangoBackend(BackendBase):
         except Group.DoesNotExist:
             raise GroupNotFound(name, service=service)
 
+    def _keyset_page(self, queryset, field, limit, after):
+        # the index on field makes every page a single range scan, no matter how far we paged
+        if after is not None:
+            queryset = queryset.filter(**{'%s__gt' % field: after})
+        names = list(queryset.order_by(field).values_list(field, flat=True)[:limit + 1])
+        if len(names) > limit:
+            return names[:limit], names[limit - 1]
+        return names, None
+
     def transaction(self, dry=False):
         return DjangoTransactionManager(dry=dry, using=self.db)
 
@@ -97,6 +109,12 @@ class DjangoBackend(BackendBase):
     def list_users(self):
         return list(User.objects.values_list('username', flat=True))
 
+    def iter_users(self):
+        return User.objects.values_list('username', flat=True).iterator()
+
+    def page_users(self, limit, after=None):
+        return self._keyset_page(User.objects.all(), 'username', limit, after)
+
     def user_exists(self, user):
         return User.objects.filter(username=user).exists()
 
@@ -113,14 +131,7 @@ class DjangoBackend(BackendBase):
             return False  # return fast if password is incorrect.
         if groups is None:
             return True  # if no groups are given, we're ok.
-
-        # TODO: this could be faster. from list_groups:
-        # groups = Group.objects.member(user=user, service=service)
-        # return list(groups.only('name').values_list('name', flat=True))
-        for group, service in groups:
-            if self.is_member(group=group, service=service, user=user):
-                return True
-        return False
+        return self.is_member_any(user, groups)
 
     def set_password(self, user, password=None):
         user = self._user(user, 'id', 'password')
@@ -137,6 +148,12 @@ class DjangoBackend(BackendBase):
         user.password = import_hash(algorithm=algorithm, hash=hash)
         user.save()
 
+    def get_password_hash(self, user):
+        return self._user(user, 'password').password or None
+
+    def password_hashes(self):
+        return User.objects.exclude(password=None).values_list('password', flat=True).iterator()
+
     def remove_user(self, user):
         qs = User.objects.filter(username=user)
         if qs.exists():
@@ -183,14 +200,17 @@ class DjangoBackend(BackendBase):
         except Property.DoesNotExist:
             raise PropertyNotFound(key)
 
-    def list_groups(self, service, user=None):
+    def list_groups(self, service, user=None, depth=None):
         if user is None:
             groups = Group.objects.filter(service=service)
         else:
             user = self._user(user, 'id')
-            groups = Group.objects.member(user=user, service=service)
+            groups = Group.objects.member(user=user, service=service, depth=depth)
         return list(groups.only('name').values_list('name', flat=True))
 
+    def page_groups(self, service, limit, after=None):
+        return self._keyset_page(Group.objects.filter(service=service), 'name', limit, after)
+
     def create_group(self, group, service, users=None, dry=False):
         with self.transaction(dry=dry):
             try:
@@ -248,10 +268,39 @@ class DjangoBackend(BackendBase):
         group = self._group(group, service, 'id')
         return list(group.get_members(depth=depth).values_list('username', flat=True))
 
+    def page_members(self, group, service, limit, after=None):
+        group = self._group(group, service, 'id')
+        return self._keyset_page(group.get_members(), 'username', limit, after)
+
     def is_member(self, group, service, user):
         group = self._group(group, service, 'id')
         return group.is_member(user)
 
+    def is_member_any(self, user, groups):
+        if not groups:
+            return False
+
+        query = Q()
+        for group, service in groups:
+            query |= Q(descendant__name=group, descendant__service=service)
+
+        # one query: is the user a member of any group that any of the given groups inherits from?
+        return GroupClosure.objects.filter(
+            query, depth__lte=settings.GROUP_RECURSION_DEPTH, ancestor__users__username=user
+        ).exists()
+
+    def members_of(self, group, service, users):
+        members = User.objects.filter(
+            username__in=users, group__descendant_links__descendant__name=group,
+            group__descendant_links__descendant__service=service,
+            group__descendant_links__depth__lte=settings.GROUP_RECURSION_DEPTH)
+        members = list(members.distinct().values_list('username', flat=True))
+
+        # An empty result might also mean that the group does not exist
+        if not members and not Group.objects.filter(name=group, service=service).exists():
+            raise GroupNotFound(group, service=service)
+        return members
+
     def remove_member(self, group, service, user):
         group = self._group(group, service, 'id')
         user = self._user(user, 'id')
@@ -264,13 +313,15 @@ class DjangoBackend(BackendBase):
     def add_subgroup(self, group, service, subgroup, subservice):
         group = self._group(group, service, 'id')
         subgroup = self._group(subgroup, subservice, 'id')
-        group.groups.add(subgroup)
+        group.groups.add(subgroup)  # GroupClosure is updated by the m2m_changed signal handler
 
     def set_subgroups(self, group, service, subgroups, subservice):
         group = self._group(group, service, 'id')
         subgroups = [self._group(name, subservice, 'id') for name in subgroups]
 
+        # Deleting from the through table does not send m2m_changed, so the closure is rebuilt
         group.groups.through.objects.filter(from_group=group, to_group__service=subservice).delete()
+        GroupClosure.objects.rebuild(GroupClosure.objects.ancestors(group.id))
         group.groups.add(*subgroups)
 
     def is_subgroup(self, group, service, subgroup, subservice):
@@ -285,7 +336,7 @@ class DjangoBackend(BackendBase):
         except Group.DoesNotExist:
             raise GroupNotFound(subgroup, service=subservice)
 
-        group.groups.remove(subgroup)
+        group.groups.remove(subgroup)  # GroupClosure is updated by the m2m_changed signal handler
 
     def subgroups(self, group, service, filter=True):
         group = self._group(group, service, 'id')
@@ -301,5 +352,6 @@ class DjangoBackend(BackendBase):
         return [(g.name, g.service) for g in group.parent_groups.select_related('service').all()]
 
     def remove_group(self, group, service):
+        # NOTE: GroupClosure is updated by the pre/post_delete signal handlers in Groups.models
         group = self._group(group, service, 'id')
         group.delete()
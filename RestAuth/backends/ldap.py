@@ -17,9 +17,80 @@
 
 from __future__ import unicode_literals, absolute_import
 
-import ldap
+import threading
+
+from collections import deque
+from contextlib import contextmanager
 
 from backends.base import BackendBase
+from common.errors import UserNotFound
+
+
+class LDAPConnectionPool(object):
+    """A bounded pool of LDAP connections.
+
+    Connections are opened lazily and checked out for a single operation, so no connection is
+    shared by two threads at the same time. If more than ``size`` connections are in use, further
+    operations wait for a free connection. If the server closed a connection (e.g. after an idle
+    timeout), all idle connections are discarded and the operation is retried once with a new
+    connection.
+
+    :param library: The ldap module.
+    :param uri: The URI of the LDAP server.
+    :param who: If given, new connections bind with this DN.
+    :param cred: The password for ``who``.
+    :param size: The maximum number of connections.
+    """
+
+    def __init__(self, library, uri, who=None, cred=None, size=10):
+        self.ldap = library
+        self.uri = uri
+        self.who = who
+        self.cred = cred
+        self._idle = deque()
+        self._slots = threading.BoundedSemaphore(size)
+
+    def _connect(self):
+        conn = self.ldap.initialize(self.uri)
+        if self.who is not None:
+            conn.simple_bind_s(self.who, self.cred)
+        return conn
+
+    @contextmanager
+    def connection(self):
+        """Check out a connection, returned to the pool unless the server closed it."""
+        self._slots.acquire()
+        try:
+            try:
+                conn = self._idle.pop()
+            except IndexError:
+                conn = self._connect()
+
+            alive = True
+            try:
+                yield conn
+            except self.ldap.SERVER_DOWN:
+                alive = False  # don't return a dead connection to the pool
+                raise
+            finally:
+                if alive:
+                    self._idle.append(conn)
+        finally:
+            self._slots.release()
+
+    def run(self, func):
+        """Call ``func`` with a pooled connection as its only argument and return its result."""
+        try:
+            with self.connection() as conn:
+                return func(conn)
+        except self.ldap.SERVER_DOWN:
+            self._idle.clear()  # other idle connections most likely timed out as well
+            with self.connection() as conn:
+                return func(conn)
+
+    def call(self, method, *args, **kwargs):
+        """Call ``method`` of a pooled connection with the given arguments."""
+        return self.run(lambda conn: getattr(conn, method)(*args, **kwargs))
 
 
 class LDAPBackend(BackendBase):
@@ -39,12 +110,18 @@ class LDAPBackend(BackendBase):
     :param GROUP_ATTR: The attribute identifying a group.
     :param GROUP_SCOPE: Search scope used when searching for group, any of ldap.SCOPE_*. The
         default is ldap.SCOPE_BASE.
+    :param POOL_SIZE: The maximum number of connections bound as ``LDAP_USER``.
+    :param BIND_POOL_SIZE: The maximum number of connections used to verify passwords by binding as
+        the user, defaults to ``POOL_SIZE``.
+    :param PAGE_SIZE: The number of users fetched at once when listing users, should not be larger
+        than the size limit of the server.
     """
     library = 'ldap'
 
     def __init__(self, LDAP_HOST, LDAP_USER, LDAP_PASS, USER_RDN, GROUP_RDN,
                  USER_CLASSES=None, USER_ATTR='uid', USER_SCOPE=None,
-                 GROUP_CLASSES=None, GROUP_ATTR='cn', GROUP_SCOPE=None):
+                 GROUP_CLASSES=None, GROUP_ATTR='cn', GROUP_SCOPE=None, POOL_SIZE=10,
+                 BIND_POOL_SIZE=None, PAGE_SIZE=1000):
         """
         Currently used for testing::
 
@@ -63,9 +140,11 @@ class LDAPBackend(BackendBase):
         if GROUP_SCOPE is None:
             GROUP_SCOPE = self.ldap.SCOPE_BASE
 
-        # initiate connection
-        self.conn = ldap.initialize(LDAP_HOST)
-        self.conn.bind_s(LDAP_USER, LDAP_PASS, ldap.AUTH_SIMPLE)
+        # connections are opened on first use, users bind on connections of their own
+        if BIND_POOL_SIZE is None:
+            BIND_POOL_SIZE = POOL_SIZE
+        self.pool = LDAPConnectionPool(self.ldap, LDAP_HOST, LDAP_USER, LDAP_PASS, size=POOL_SIZE)
+        self.bind_pool = LDAPConnectionPool(self.ldap, LDAP_HOST, size=BIND_POOL_SIZE)
 
         # set local attributes
         self.user_rdn = USER_RDN
@@ -76,6 +155,7 @@ class LDAPBackend(BackendBase):
         self.group_classes = [str(c) for c in GROUP_CLASSES]
         self.group_attr = GROUP_ATTR
         self.group_scope = GROUP_SCOPE
+        self.page_size = PAGE_SIZE
 
         self.user_dn_tmpl = '%s=%%s,%s' % (USER_ATTR, USER_RDN)
         self.user_filter = '(objectclass=%s)' % USER_CLASSES[0]
@@ -162,19 +242,43 @@ class LDAPBackend(BackendBase):
             ('sn', sn),
         )
         try:
-            return self.conn.add_s(self.user_dn_tmpl % user, record)
+            return self.pool.call('add_s', self.user_dn_tmpl % user, record)
         except self.ldap.OBJECT_CLASS_VIOLATION:
             raise  # e.g. object does not have the right properties
 
     def list_users(self):
-        """Get a list of all users.
+        """Get all users.
+
+        Users are fetched in pages of ``PAGE_SIZE`` users using the Simple Paged Results control
+        (:rfc:`2696`), so large directories don't hit the size limit of the server. Only the
+        attribute identifying a user is fetched.
+
+        The cookie identifying the next page is only valid on the connection that started the
+        search, so all pages are fetched with the same connection before the connection is
+        returned to the pool. If the server closed the connection, the search is started again on
+        a new connection.
 
         :return: A list of usernames.
         :rtype: list
         """
-        results = self.conn.search_s(self.user_rdn, self.ldap.SCOPE_SUBTREE, self.user_filter,
-                                     [str(self.user_attr)])
-        return [v[self.user_attr][0] for k, v in results]
+        from ldap.controls import SimplePagedResultsControl
+
+        def search(conn):
+            users = []
+            control = SimplePagedResultsControl(True, size=self.page_size, cookie='')
+            while True:
+                msgid = conn.search_ext(self.user_rdn, self.ldap.SCOPE_SUBTREE, self.user_filter,
+                                        [str(self.user_attr)], serverctrls=[control])
+                rtype, results, rmsgid, serverctrls = conn.result3(msgid)
+                users += [attrs[self.user_attr][0] for dn, attrs in results]
+
+                cookies = [c.cookie for c in serverctrls
+                           if c.controlType == SimplePagedResultsControl.controlType]
+                if not cookies or not cookies[0]:  # no control or an empty cookie: last page
+                    return users
+                control.cookie = cookies[0]
+
+        return self.pool.run(search)
 
     def user_exists(self, user):
         """Determine if the user exists.
@@ -186,9 +290,9 @@ class LDAPBackend(BackendBase):
         """
         dn = '%s=%s,%s' % (self.user_attr, user, self.user_rdn)
         try:
-            self.conn.search_s(dn, self.user_scope, str(self.user_filter), [str()])
+            self.pool.call('search_s', dn, self.user_scope, str(self.user_filter), [str()])
             return True
-        except ldap.NO_SUCH_OBJECT:
+        except self.ldap.NO_SUCH_OBJECT:
             return False
 
     def rename_user(self, user, name):
@@ -222,7 +326,19 @@ class LDAPBackend(BackendBase):
         :rtype: boolean
         :raise: :py:class:`~common.errors.UserNotFound` if the user doesn't exist.
         """
-        raise NotImplementedError
+        if not password:
+            return False
+
+        try:
+            self.bind_pool.call('simple_bind_s', self.user_dn_tmpl % user, password)
+        except self.ldap.INVALID_CREDENTIALS:
+            if not self.user_exists(user):
+                raise UserNotFound(user)
+            return False
+
+        if groups is None:
+            return True
+        return self.is_member_any(user, groups)
 
     def set_password(self, user, password=None):
         """Set a new password.
@@ -257,6 +373,33 @@ class LDAPBackend(BackendBase):
         """
         raise NotImplementedError
 
+    def get_password_hash(self, user):
+        """Get the password hash of a user.
+
+        This method is used by :py:class:`~backends.sharded.ShardedBackend` to move a user to a
+        different shard.
+
+        :param user: The username.
+        :type  user: str
+        :return: The password hash in the format used by Djangos password hashing framework or
+            ``None`` if the user has no password.
+        :rtype: str
+        :raise: :py:class:`~common.errors.UserNotFound` if the user doesn't exist.
+        """
+        raise NotImplementedError
+
+    def password_hashes(self):
+        """Get the password hashes of all users.
+
+        This method is used by |bin-restauth-manage| to report hashes created by outdated
+        algorithms. The order of the hashes is not relevant and users without a password may be
+        omitted.
+
+        :return: The password hashes in the format used by Djangos password hashing framework.
+        :rtype: iterable
+        """
+        raise NotImplementedError
+
     def remove_user(self, user):
         """Remove a user.
 
@@ -359,12 +502,15 @@ class LDAPBackend(BackendBase):
         """
         raise NotImplementedError
 
-    def list_groups(self, service, user=None):
+    def list_groups(self, service, user=None, depth=None):
         """Get a list of group names for the given service.
 
         :param service: The service of the named group.
         :param user: If given, only return groups that the user is a member of.
         :type  user: str
+        :param depth: Override the recursion depth to use for meta-groups if ``user`` is given.
+            Normally, the backend should use :setting:`GROUP_RECURSION_DEPTH`.
+        :type  depth: int
         :return: list of strings, each representing a group name.
         :rtype: list
         :raise: :py:class:`~common.errors.UserNotFound` if the user doesn't exist.
@@ -500,6 +646,56 @@ class LDAPBackend(BackendBase):
         """
         raise NotImplementedError
 
+    def is_member_any(self, user, groups):
+        """Determine if a user is a member of at least one of the given groups.
+
+        Backends should answer this with as few queries as possible instead of calling
+        :py:meth:`is_member` for every group, it is used by :py:meth:`check_password`.
+
+        :param user: The user to test for membership.
+        :type  user: str
+        :param groups: A list of groups, the format is the same as in :py:func:`create_user`.
+            Groups that do not exist are ignored.
+        :type  groups: list
+        :return: True if the user is a member of at least one group, False otherwise (also if the
+            user does not exist).
+        :rtype: boolean
+        """
+        from ldap.filter import escape_filter_chars
+
+        if not groups:
+            return False
+
+        # posixGroup lists its members by name in memberUid, so a single search answers this
+        names = ''.join('(%s=%s)' % (self.group_attr, escape_filter_chars(group))
+                        for group, service in groups)
+        query = '(&(objectclass=%s)(memberUid=%s)(|%s))' % (
+            self.group_classes[0], escape_filter_chars(user), names)
+        try:
+            return bool(self.pool.call('search_s', self.group_rdn, self.ldap.SCOPE_ONELEVEL,
+                                       str(query), [str(self.group_attr)]))
+        except self.ldap.NO_SUCH_OBJECT:
+            return False
+
+    def members_of(self, group, service, users):
+        """Get the subset of the given users that are members of the given group.
+
+        This is the bulk variant of :py:meth:`is_member`, backends should answer it with as few
+        queries as possible.
+
+        :param group: The group to test for membership.
+        :type  group: str
+        :param service: The service of the given group.
+        :type  service: :py:class:`~Services.models.Service` or None
+        :param users: The users to test for membership.
+        :type  users: list
+        :return: list of strings, each representing a username. Users that do not exist are not
+            included.
+        :rtype: list
+        :raise: :py:class:`common.errors.GroupNotFound` if the named group does not exist.
+        """
+        raise NotImplementedError
+
     def remove_member(self, group, service, user):
         """Remove a user from the group.
 
@@ -16,12 +16,10 @@
 from __future__ import unicode_literals, absolute_import
 
 from collections import defaultdict
+from collections import deque
 from copy import deepcopy
 
 from django.conf import settings
-from django.contrib.auth.hashers import check_password
-from django.contrib.auth.hashers import make_password
-from django.utils import six
 
 from backends.base import BackendBase
 from common.errors import GroupExists
@@ -30,6 +28,9 @@ from common.errors import PropertyExists
 from common.errors import PropertyNotFound
 from common.errors import UserExists
 from common.errors import UserNotFound
+from common.executor import HashUpgrade
+from common.executor import check_password
+from common.executor import make_password
 from common.hashers import import_hash
 
 
@@ -41,11 +42,13 @@ class MemoryTransactionManager(object):
     def __enter__(self):
         self.users = deepcopy(self.backend._users)
         self.groups = deepcopy(self.backend._groups)
+        self.memberships = deepcopy(self.backend._memberships)
 
     def __exit__(self, exc_type, exc_value, traceback):
         if self.dry or exc_type:
             self.backend._users = self.users
             self.backend._groups = self.groups
+            self.backend._memberships = self.memberships
 
 
 class MemoryBackend(BackendBase):
@@ -54,14 +57,43 @@ class MemoryBackend(BackendBase):
     def __init__(self):
         self._users = {}
         self._groups = defaultdict(dict)
+        self._memberships = defaultdict(set)  # user -> set of (group, service) tuples
 
     def testSetUp(self):
         self._users = {}
         self._groups = defaultdict(dict)
+        self._memberships = defaultdict(set)
 
     def testTearDown(self):
         self._users = {}
         self._groups = defaultdict(dict)
+        self._memberships = defaultdict(set)
+
+    def _walk(self, group, service, direction, max_depth):
+        """Breadth-first traversal of the group graph.
+
+        Yields every group reachable from the given group (including itself) via ``direction``
+        (either ``'meta-groups'`` or ``'sub-groups'``) in at most ``max_depth`` steps. Every
+        group is visited only once, so cyclic and diamond-shaped relations are cheap.
+        """
+        start = (group, service)
+        visited = set([start])
+        queue = deque([(start, 0)])
+        while queue:
+            (group, service), depth = queue.popleft()
+            yield group, service
+
+            if depth < max_depth:
+                for related in self._groups[service][group][direction]:
+                    if related not in visited and related[0] in self._groups[related[1]]:
+                        visited.add(related)
+                        queue.append((related, depth + 1))
+
+    def _rename_member(self, old, new, user):
+        # update group references in the inverted index of a user
+        memberships = self._memberships[user]
+        memberships.discard(old)
+        memberships.add(new)
 
     def create_user(self, user, password=None, properties=None, groups=None, dry=False):
         if user in self._users:
@@ -96,24 +128,31 @@ class MemoryBackend(BackendBase):
         except KeyError:
             raise UserNotFound(user)
 
+        memberships = self._memberships.pop(user, set())
+        for group, service in memberships:
+            users = self._groups[service][group]['users']
+            users.discard(user)
+            users.add(name)
+        if memberships:
+            self._memberships[name] = memberships
+
     def check_password(self, user, password, groups=None):
         try:
             stored = self._users[user]['password']
         except KeyError:
             raise UserNotFound(user)
 
-        def setter(raw_password):
-            self.set_password(user, raw_password)
+        def write(encoded):
+            # don't overwrite a password that was changed in the meantime
+            if user in self._users and self._users[user]['password'] == stored:
+                self._users[user]['password'] = encoded
 
-        if not password or not check_password(password, stored, setter):
+        if not password or not check_password(password, stored, HashUpgrade(write)):
             return False
 
         if groups is None:
             return True
-        for group, service in groups:
-            if self.is_member(group, service, user):
-                return True
-        return False
+        return self.is_member_any(user, groups)
 
     def set_password(self, user, password=None):
         try:
@@ -128,12 +167,24 @@ class MemoryBackend(BackendBase):
         django_hash = import_hash(algorithm, hash)
         self._users[user]['password'] = django_hash
 
+    def get_password_hash(self, user):
+        try:
+            return self._users[user]['password']
+        except KeyError:
+            raise UserNotFound(user)
+
+    def password_hashes(self):
+        return [u['password'] for u in self._users.values() if u['password']]
+
     def remove_user(self, user):
         try:
             del self._users[user]
         except KeyError:
             raise UserNotFound(user)
 
+        for group, service in self._memberships.pop(user, set()):
+            self._groups[service][group]['users'].discard(user)
+
     def get_properties(self, user):
         try:
             return self._users[user]['properties'].copy()
@@ -191,14 +242,19 @@ class MemoryBackend(BackendBase):
         except KeyError:
             raise PropertyNotFound(key)
 
-    def list_groups(self, service, user=None):
+    def list_groups(self, service, user=None, depth=None):
+        if depth is None:
+            depth = settings.GROUP_RECURSION_DEPTH
+
         if user is None:
             return list(self._groups[service].keys())
         elif user not in self._users:
             raise UserNotFound(user)
         else:
-            return [k for k, v in six.iteritems(self._groups[service])
-                    if self.is_member(k, service, user)]
+            groups = set()
+            for group, group_service in self._memberships.get(user, set()):
+                groups |= set(self._walk(group, group_service, 'sub-groups', depth))
+            return [g for g, s in groups if s == service]
 
     def create_group(self, group, service, users=None, dry=False):
         if group in self._groups[service]:
@@ -212,6 +268,8 @@ class MemoryBackend(BackendBase):
                 'meta-groups': set(),
                 'sub-groups': set(),
             }
+            for user in self._groups[service][group]['users']:
+                self._memberships[user].add((group, service))
 
     def rename_group(self, group, name, service):
         if group not in self._groups[service]:
@@ -220,6 +278,8 @@ class MemoryBackend(BackendBase):
             raise GroupExists(name)
 
         self._groups[service][name] = self._groups[service].pop(group)
+        for user in self._groups[service][name]['users']:
+            self._rename_member((group, service), (name, service), user)
 
     def set_service(self, group, service, new_service):
         if group not in self._groups[service]:
@@ -228,6 +288,8 @@ class MemoryBackend(BackendBase):
             raise GroupExists(group)
 
         self._groups[new_service][group] = self._groups[service].pop(group)
+        for user in self._groups[new_service][group]['users']:
+            self._rename_member((group, service), (group, new_service), user)
 
     def group_exists(self, group, service):
         return group in self._groups[service]
@@ -237,9 +299,10 @@ class MemoryBackend(BackendBase):
             raise UserNotFound(user)
 
         # delete existing memberships
-        for group in self._groups[service]:
-            if user in self._groups[service][group]['users']:
-                self._groups[service][group]['users'].remove(user)
+        memberships = self._memberships[user]
+        for group, group_service in [m for m in memberships if m[1] == service]:
+            self._groups[service][group]['users'].discard(user)
+            memberships.remove((group, group_service))
 
         # set new memberships
         for group in groups:
@@ -254,7 +317,11 @@ class MemoryBackend(BackendBase):
         for user in filter(lambda u: u not in self._users, users):
             raise UserNotFound(user)
 
+        for user in self._groups[service][group]['users']:
+            self._memberships[user].discard((group, service))
         self._groups[service][group]['users'] = set(users)
+        for user in users:
+            self._memberships[user].add((group, service))
 
     def add_member(self, group, service, user):
         if group not in self._groups[service]:
@@ -262,15 +329,7 @@ class MemoryBackend(BackendBase):
         if user not in self._users:
             raise UserNotFound(user)
         self._groups[service][group]['users'].add(user)
-
-    def _members(self, group, service, depth, max_depth):
-        members = set(self._groups[service][group]['users'])
-        if depth < max_depth:
-            for meta_group, meta_service in self._groups[service][group]['meta-groups']:
-                members |= self._members(meta_group, meta_service,
-                                         depth=depth + 1, max_depth=max_depth)
-
-        return members
+        self._memberships[user].add((group, service))
 
     def members(self, group, service, depth=None):
         if group not in self._groups[service]:
@@ -278,30 +337,49 @@ class MemoryBackend(BackendBase):
         if depth is None:
             depth = settings.GROUP_RECURSION_DEPTH
 
-        members = set(self._groups[service][group]['users'])
+        members = set()
+        for meta_group, meta_service in self._walk(group, service, 'meta-groups', depth):
+            members |= self._groups[meta_service][meta_group]['users']
+        return list(members)
+
+    def is_member(self, group, service, user):
+        if group not in self._groups[service]:
+            raise GroupNotFound(group, service=service)
 
-        if depth > 0:
-            for meta_group, meta_service in self._groups[service][group]['meta-groups']:
-                members |= self._members(meta_group, meta_service, depth=1, max_depth=depth)
+        memberships = self._memberships.get(user)
+        if not memberships:
+            return False
 
-        return list(members)
+        for meta_group in self._walk(group, service, 'meta-groups',
+                                     settings.GROUP_RECURSION_DEPTH):
+            if meta_group in memberships:
+                return True
+        return False
 
-    def _is_member(self, group, service, user, depth=0):
-        if user in self._groups[service][group]['users']:
-            return True
+    def is_member_any(self, user, groups):
+        memberships = self._memberships.get(user)
+        if not memberships:
+            return False
 
-        if depth <= settings.GROUP_RECURSION_DEPTH:
-            for meta_group, meta_service in self._groups[service][group]['meta-groups']:
-                if self._is_member(group=meta_group, service=meta_service, user=user,
-                                   depth=depth + 1):
+        for group, service in groups:
+            if group not in self._groups[service]:
+                continue
+            for meta_group in self._walk(group, service, 'meta-groups',
+                                         settings.GROUP_RECURSION_DEPTH):
+                if meta_group in memberships:
                     return True
         return False
 
-    def is_member(self, group, service, user):
+    def members_of(self, group, service, users):
         if group not in self._groups[service]:
             raise GroupNotFound(group, service=service)
 
-        return self._is_member(group, service, user)
+        users = set(users)
+        members = set()
+        for meta_group, meta_service in self._walk(group, service, 'meta-groups',
+                                                   settings.GROUP_RECURSION_DEPTH):
+            members |= self._groups[meta_service][meta_group]['users'] & users
+        return list(members)
 
     def remove_member(self, group, service, user):
         if group not in self._groups[service]:
@@ -310,6 +388,7 @@ class MemoryBackend(BackendBase):
             self._groups[service][group]['users'].remove(user)
         except KeyError:
             raise UserNotFound(user)
+        self._memberships[user].discard((group, service))
 
     def add_subgroup(self, group, service, subgroup, subservice):
         if group not in self._groups[service]:
@@ -377,7 +456,17 @@ class MemoryBackend(BackendBase):
         if group not in self._groups[service]:
             raise GroupNotFound(group, service=service)
 
-        del self._groups[service][group]
+        data = self._groups[service].pop(group)
+        for user in data['users']:
+            self._memberships[user].discard((group, service))
+
+        # remove references from related groups, so they don't apply to a new group of that name
+        for subgroup, subservice in data['sub-groups']:
+            if subgroup in self._groups[subservice]:
+                self._groups[subservice][subgroup]['meta-groups'].discard((group, service))
+        for metagroup, metaservice in data['meta-groups']:
+            if metagroup in self._groups[metaservice]:
+                self._groups[metaservice][metagroup]['sub-groups'].discard((group, service))
 
 
 class NoSubgroupsBackend(MemoryBackend):
@@ -416,8 +505,8 @@ class NoGroupVisibilityBackend(MemoryBackend):
             groups = [(g, None) for g, s in groups]
         return super(NoGroupVisibilityBackend, self).check_password(user, password, groups=groups)
 
-    def list_groups(self, service, user=None):
-        return super(NoGroupVisibilityBackend, self).list_groups(None, user=user)
+    def list_groups(self, service, user=None, depth=None):
+        return super(NoGroupVisibilityBackend, self).list_groups(None, user=user, depth=depth)
 
     def create_group(self, group, service, users=None, dry=False):
         return super(NoGroupVisibilityBackend, self).create_group(group, service=None,
@@ -447,6 +536,13 @@ class NoGroupVisibilityBackend(MemoryBackend):
     def is_member(self, group, service, user):
         return super(NoGroupVisibilityBackend, self).is_member(group, None, user)
 
+    def is_member_any(self, user, groups):
+        groups = [(g, None) for g, s in groups]
+        return super(NoGroupVisibilityBackend, self).is_member_any(user, groups)
+
+    def members_of(self, group, service, users):
+        return super(NoGroupVisibilityBackend, self).members_of(group, None, users)
+
     def remove_member(self, group, service, user):
         return super(NoGroupVisibilityBackend, self).remove_member(group, None, user)
 
@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of RestAuth (https://restauth.net).
+#
+# RestAuth is free software: you can redistribute it and/or modify it under the terms of the GNU
+# General Public License as published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# RestAuth is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without
+# even the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with RestAuth.  If not,
+# see <http://www.gnu.org/licenses/>.
+
+from __future__ import unicode_literals, absolute_import
+
+import hashlib
+import hmac
+import os
+
+from django.conf import settings
+from django.utils.crypto import constant_time_compare
+
+from common.cache import LRUCache
+
+
+class PasswordCacheMixin(object):
+    """Cache successful password verifications for a short time.
+
+    This mixin is added to the configured backend if :setting:`PASSWORD_CACHE` is set. The cache
+    stores a keyed HMAC of the username and password for every user, the key is random and never
+    leaves the process. A cache hit thus skips the (intentionally slow) password hasher.
+
+    The cache is invalidated by :py:func:`set_password`, :py:func:`set_password_hash`,
+    :py:func:`rename_user` and :py:func:`remove_user`. Since every process has its own cache,
+    changes made by other processes (e.g. |bin-restauth-user|) are only noticed once the entry
+    expires.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super(PasswordCacheMixin, self).__init__(*args, **kwargs)
+        config = settings.PASSWORD_CACHE
+        self._password_cache = LRUCache(size=config.get('SIZE', 1000), ttl=config.get('TTL', 30))
+        self._password_cache_key = os.urandom(32)
+
+    def _password_digest(self, user, password):
+        msg = '%s\0%s' % (user, password)
+        return hmac.new(self._password_cache_key, msg.encode('utf-8'), hashlib.sha256).hexdigest()
+
+    def check_password(self, user, password, groups=None):
+        if not password:
+            return super(PasswordCacheMixin, self).check_password(user, password, groups=groups)
+
+        digest = self._password_digest(user, password)
+        cached = self._password_cache.get(user)
+        if cached is not None and constant_time_compare(cached, digest):
+            if groups is None:
+                return True
+            return self.is_member_any(user, groups)
+
+        if super(PasswordCacheMixin, self).check_password(user, password, groups=groups):
+            self._password_cache.set(user, digest)
+            return True
+        return False
+
+    def set_password(self, user, password=None):
+        super(PasswordCacheMixin, self).set_password(user, password=password)
+        self._password_cache.delete(user)
+
+    def set_password_hash(self, user, algorithm, hash):
+        super(PasswordCacheMixin, self).set_password_hash(user, algorithm=algorithm, hash=hash)
+        self._password_cache.delete(user)
+
+    def rename_user(self, user, name):
+        super(PasswordCacheMixin, self).rename_user(user, name=name)
+        self._password_cache.delete(user)
+
+    def remove_user(self, user):
+        super(PasswordCacheMixin, self).remove_user(user)
+        self._password_cache.delete(user)
+
+    def testSetUp(self):
+        super(PasswordCacheMixin, self).testSetUp()
+        self._password_cache.clear()
@@ -16,10 +16,10 @@
 from __future__ import unicode_literals, absolute_import
 
 from django.conf import settings
-from django.contrib.auth.hashers import make_password
-from django.contrib.auth.hashers import check_password
 from django.utils import six
 
+from RestAuthCommon.error import BadRequest
+
 from Services.models import Service
 from backends.base import BackendBase
 from backends.base import TransactionManagerBase
@@ -30,6 +30,9 @@ from common.errors import PropertyExists
 from common.errors import PropertyNotFound
 from common.errors import UserExists
 from common.errors import UserNotFound
+from common.executor import HashUpgrade
+from common.executor import check_password
+from common.executor import make_password
 
 
 class RedisTransactionManager(TransactionManagerBase):
@@ -41,7 +44,7 @@ class RedisTransactionManager(TransactionManagerBase):
     def __exit__(self, exc_type, exc_value, traceback):
         pass
 
-# keys=[_USERS, _PROPS % user]
+# keys=[_USERS, _PROPS % user, _UG % user]
 # args=[user, password, len(properties)] + properties + groups
 # if groups:
 #   keys += [_GROUPS] + gu_keys
@@ -57,13 +60,19 @@ if last_prop > 0 then
     redis.call('hmset', KEYS[2], unpack(ARGV, 4, 3 + last_prop))
 end
 
-if #KEYS > 2 then
-    redis.call('sadd', KEYS[3], unpack(ARGV, last_prop + 1)) -- create groups
+if #KEYS > 4 then -- groups=[] only adds _GROUPS, sadd needs at least one member
+    redis.call('sadd', KEYS[4], unpack(ARGV, 4 + last_prop)) -- create groups
+    redis.call('sadd', KEYS[3], unpack(ARGV, 4 + last_prop)) -- reverse index
 
     -- add memberships
-    for i=4, #KEYS, 1 do
+    for i=5, #KEYS, 1 do
         redis.call('sadd', KEYS[i], ARGV[1])
     end
+
+    -- add groups to their service
+    for i=4 + last_prop, #ARGV, 1 do
+        redis.call('sadd', 'groups_' .. string.match(ARGV[i], '^[^_]*'), ARGV[i])
+    end
 end
 """
 
@@ -75,7 +84,14 @@ end
 redis.call('hset', KEYS[1], ARGV[1], ARGV[2])
 """
 
-# keys = [_USERS, _PROPS % user, _PROPS % name] + [members_*]
+# keys=[_USERS], args=[user, old_hash, new_hash]
+_upgrade_password_script = """
+if redis.call('hget', KEYS[1], ARGV[1]) == ARGV[2] then
+    redis.call('hset', KEYS[1], ARGV[1], ARGV[3])
+end
+"""
+
+# keys = [_USERS, _PROPS % user, _PROPS % name, _UG % user, _UG % name]
 # args = [user, name]
 _rename_user_script = """
 -- get old user
@@ -94,25 +110,33 @@ redis.call('hdel', KEYS[1], ARGV[1])
 redis.call('hset', KEYS[1], ARGV[2], hash)
 
 -- rename properties
-redis.call('rename', KEYS[2], KEYS[3])
+if redis.call('exists', KEYS[2]) == 1 then
+    redis.call('rename', KEYS[2], KEYS[3])
+end
 
-for i=4, #KEYS, 1 do
-    redis.call('srem', KEYS[i], ARGV[1])
-    redis.call('sadd', KEYS[i], ARGV[2])
+-- rename memberships
+local groups = redis.call('smembers', KEYS[4])
+for i=1, #groups, 1 do
+    redis.call('srem', 'members_' .. groups[i], ARGV[1])
+    redis.call('sadd', 'members_' .. groups[i], ARGV[2])
+end
+if #groups > 0 then
+    redis.call('rename', KEYS[4], KEYS[5])
 end
 """
 
-# keys = [_USERS, _PROPS % user] + [members_*]
+# keys = [_USERS, _PROPS % user, _UG % user]
 # args = [user]
 _remove_user_script = """
 if redis.call('hdel', KEYS[1], ARGV[1]) == 0 then
     return {err="UserNotFound"}
 end
 
-redis.call('del', KEYS[2])
-for i=3, #KEYS, 1 do
-    redis.call('srem', KEYS[i], ARGV[1])
+local groups = redis.call('smembers', KEYS[3])
+for i=1, #groups, 1 do
+    redis.call('srem', 'members_' .. groups[i], ARGV[1])
 end
+redis.call('del', KEYS[2], KEYS[3])
 """
 
 _create_property_script = """
@@ -150,17 +174,17 @@ end
 redis.call('hdel', KEYS[2], ARGV[2])
 """
 
-# keys = [g_key(service)]
-# args = [group, self._sid(service)]
+# keys = [_GROUPS, g_key]
+# args = [ref_key]
 # if users:
 #     keys += [self._gu_key(group, service), _USERS]
 #     args += users
 _create_group_script_dry = """
 if redis.call('sismember', KEYS[1], ARGV[1]) == 1 then
     return {err="GroupExists"}
-elseif #KEYS > 1 then
+elseif #KEYS > 2 then
     for i=2, #ARGV, 1 do
-        if redis.call('hexists', KEYS[3], ARGV[i]) == 0 then
+        if redis.call('hexists', KEYS[4], ARGV[i]) == 0 then
             return {err=ARGV[i]}
         end
     end
@@ -168,12 +192,16 @@ end"""
 
 _create_group_script = _create_group_script_dry + """
 redis.call('sadd', KEYS[1], ARGV[1])
-if #KEYS > 1 then
-    redis.call('sadd', KEYS[2], unpack(ARGV, 2))
+redis.call('sadd', KEYS[2], ARGV[1])
+if #KEYS > 2 then
+    redis.call('sadd', KEYS[3], unpack(ARGV, 2))
+    for i=2, #ARGV, 1 do
+        redis.call('sadd', 'usergroups_' .. ARGV[i], ARGV[1])
+    end
 end
 """
 
-# keys = [g_key, old_gu_key, new_gu_key, old_sg_key, new_sg_key] + mg_keys
+# keys = [_GROUPS, old_gu_key, new_gu_key, old_sg_key, new_sg_key, g_key, g_key] + mg_keys
 # args = [old_ref, new_ref]
 _rename_group_script = """
 if redis.call('sismember', KEYS[1], ARGV[1]) == 0 then
@@ -185,9 +213,16 @@ end
 -- rename grouop
 redis.call('srem', KEYS[1], ARGV[1])
 redis.call('sadd', KEYS[1], ARGV[2])
+redis.call('srem', KEYS[6], ARGV[1])
+redis.call('sadd', KEYS[7], ARGV[2])
 
 -- rename user keys
-if redis.call('exists', KEYS[2]) == 1 then
+local members = redis.call('smembers', KEYS[2])
+for i=1, #members, 1 do
+    redis.call('srem', 'usergroups_' .. members[i], ARGV[1])
+    redis.call('sadd', 'usergroups_' .. members[i], ARGV[2])
+end
+if #members > 0 then
     redis.call('rename', KEYS[2], KEYS[3])
 end
 -- rename subgroup key
@@ -196,13 +231,13 @@ if redis.call('exists', KEYS[4]) == 1 then
 end
 
 -- rename meta-group keys
-for i=6, #KEYS, 1 do
+for i=8, #KEYS, 1 do
     redis.call('srem', KEYS[i], ARGV[1])
     redis.call('sadd', KEYS[i], ARGV[2])
 end
 """
 
-# keys = [_GROUPS, old_gu_key, new_gu_key, old_sg_key, new_sg_key] + mg_keys
+# keys = [_GROUPS, old_gu_key, new_gu_key, old_sg_key, new_sg_key, old_g_key, new_g_key] + mg_keys
 # args = [old_ref, new_ref]
 _set_service_script = """
 if redis.call('sismember', KEYS[1], ARGV[1]) == 0 then
@@ -214,9 +249,16 @@ end
 -- rename grouop
 redis.call('srem', KEYS[1], ARGV[1])
 redis.call('sadd', KEYS[1], ARGV[2])
+redis.call('srem', KEYS[6], ARGV[1])
+redis.call('sadd', KEYS[7], ARGV[2])
 
 -- rename user keys
-if redis.call('exists', KEYS[2]) == 1 then
+local members = redis.call('smembers', KEYS[2])
+for i=1, #members, 1 do
+    redis.call('srem', 'usergroups_' .. members[i], ARGV[1])
+    redis.call('sadd', 'usergroups_' .. members[i], ARGV[2])
+end
+if #members > 0 then
     redis.call('rename', KEYS[2], KEYS[3])
 end
 -- rename subgroup key
@@ -225,32 +267,38 @@ if redis.call('exists', KEYS[4]) == 1 then
 end
 
 -- rename meta-group keys
-for i=6, #KEYS, 1 do
+for i=8, #KEYS, 1 do
     redis.call('srem', KEYS[i], ARGV[1])
     redis.call('sadd', KEYS[i], ARGV[2])
 end
 """
 
-# keys = [_USERS, g_key] + [self._gu_key(g, service) for g in self.conn.smembers(g_key)]
-# args = [user] + groups
+# keys = [_USERS, _GROUPS, _UG % user, g_key]
+# args = [user, sid] + ref_keys
 _set_memberships_script = """
 if redis.call('hexists', KEYS[1], ARGV[1]) == 0 then
     return {err="UserNotFound"}
 end
 
--- remove existing memberships
-for i=3, #KEYS, 1 do
-    -- TODO: Skip keys present in ARGV[3:]?
-    redis.call('srem', KEYS[i], ARGV[1])
+-- remove existing memberships of groups of this service
+local prefix = ARGV[2] .. '_'
+local groups = redis.call('smembers', KEYS[3])
+for i=1, #groups, 1 do
+    if string.sub(groups[i], 1, #prefix) == prefix then
+        redis.call('srem', 'members_' .. groups[i], ARGV[1])
+        redis.call('srem', KEYS[3], groups[i])
+    end
 end
 
 -- create any groups that don't exist yet
-if #ARGV > 1 then
-    redis.call('sadd', KEYS[2], unpack(ARGV, 2))
+if #ARGV > 2 then
+    redis.call('sadd', KEYS[2], unpack(ARGV, 3))
+    redis.call('sadd', KEYS[3], unpack(ARGV, 3))
+    redis.call('sadd', KEYS[4], unpack(ARGV, 3))
 end
 
 -- add user to groups
-for i=2, #ARGV, 1 do
+for i=3, #ARGV, 1 do
     redis.call('sadd', 'members_' .. ARGV[i], ARGV[1])
 end
 """
@@ -270,13 +318,21 @@ for i=2, #ARGV, 1 do
     end
 end
 
+local members = redis.call('smembers', KEYS[2])
+for i=1, #members, 1 do
+    redis.call('srem', 'usergroups_' .. members[i], ARGV[1])
+end
+
 redis.call('del', KEYS[2])
 if #ARGV > 1 then
     redis.call('sadd', KEYS[2], unpack(ARGV, 2))
+    for i=2, #ARGV, 1 do
+        redis.call('sadd', 'usergroups_' .. ARGV[i], ARGV[1])
+    end
 end
 """
 
-# keys=[_GROUPS, 'user', self._gu_key(group, service)]
+# keys=[_GROUPS, _USERS, self._gu_key(group, service), _UG % user]
 # args=[ref_key, user])
 _add_member_script = """
 if redis.call('sismember', KEYS[1], ARGV[1]) == 0 then
@@ -285,9 +341,10 @@ elseif redis.call('hexists', KEYS[2], ARGV[2]) == 0 then
     return {err="UserNotFound"}
 end
 redis.call('sadd', KEYS[3], ARGV[2])
+redis.call('sadd', KEYS[4], ARGV[1])
 """
 
-# keys=[_GROUPS, self._gu_key(group, service)]
+# keys=[_GROUPS, self._gu_key(group, service), _UG % user]
 # args=[ref_key, user])
 _remove_member_script = """
 if redis.call('sismember', KEYS[1], ARGV[1]) == 0 then
@@ -295,6 +352,7 @@ if redis.call('sismember', KEYS[1], ARGV[1]) == 0 then
 elseif redis.call('srem', KEYS[2], ARGV[2]) == 0 then
     return {err="UserNotFound"}
 end
+redis.call('srem', KEYS[3], ARGV[1])
 """
 
 # keys = [g_key, sg_key, self._sg_key(group, service), self._mg_key(subgroup, subservice)]
@@ -394,7 +452,7 @@ end
 redis.call('srem', KEYS[3], ARGV[1])
 """
 
-# keys = [g_key, gu_key, sg_key, mg_key] + mg_keys + sg_keys
+# keys = [_GROUPS, gu_key, sg_key, mg_key, g_key] + mg_keys + sg_keys
 # args = [ref_key]
 _remove_group_script = """
 if redis.call('sismember', KEYS[1], ARGV[1]) == 0 then
@@ -402,15 +460,199 @@ if redis.call('sismember', KEYS[1], ARGV[1]) == 0 then
 end
 
 redis.call('srem', KEYS[1], ARGV[1])
+local members = redis.call('smembers', KEYS[2])
+for i=1, #members, 1 do
+    redis.call('srem', 'usergroups_' .. members[i], ARGV[1])
+end
 redis.call('del', KEYS[2], KEYS[3], KEYS[4])
+redis.call('srem', KEYS[5], ARGV[1])
 
-for i=5, #KEYS, 1 do
+for i=6, #KEYS, 1 do
     redis.call('srem', KEYS[i], ARGV[1])
 end
 """
 
+# Breadth-first walk from ARGV[1] to all meta-groups up to ARGV[2] levels. "visited" guards
+# against cyclic group relations, the snippet passed via string formatting is run once for every
+# group reference ("ref") and may return early. "result" is free to use by the snippet.
+_traverse_metagroups = """
+if redis.call('sismember', KEYS[1], ARGV[1]) == 0 then
+    return {err="GroupNotFound"}
+end
+
+local max_depth = tonumber(ARGV[2])
+local visited = {[ARGV[1]]=true}
+local level = {ARGV[1]}
+local depth = 0
+local result = {}
+
+while #level > 0 do
+    local next_level = {}
+    for i=1, #level, 1 do
+        local ref = level[i]
+        %s
+        if depth < max_depth then
+            local parents = redis.call('smembers', 'metagroups_' .. ref)
+            for j=1, #parents, 1 do
+                if not visited[parents[j]] then
+                    visited[parents[j]] = true
+                    next_level[#next_level+1] = parents[j]
+                end
+            end
+        end
+    end
+    level = next_level
+    depth = depth + 1
+end
+"""
+
+# keys = [_GROUPS]
+# args = [ref_key, depth]
+_members_script = _traverse_metagroups % """
+        local members = redis.call('smembers', 'members_' .. ref)
+        for j=1, #members, 1 do
+            result[members[j]] = true
+        end""" + """
+local members = {}
+for user, _ in pairs(result) do
+    members[#members+1] = user
+end
+return members
+"""
+
+# keys = [_GROUPS]
+# args = [ref_key, depth, user]
+_is_member_script = _traverse_metagroups % """
+        if redis.call('sismember', 'members_' .. ref, ARGV[3]) == 1 then
+            return 1
+        end""" + """
+return 0
+"""
+
+# keys = [_GROUPS]
+# args = [ref_key, depth, user, ...]
+_members_of_script = _traverse_metagroups % """
+        for j=3, #ARGV, 1 do
+            local user = ARGV[j]
+            if not result[user] and redis.call('sismember', 'members_' .. ref, user) == 1 then
+                result[user] = true
+            end
+        end""" + """
+local members = {}
+for j=3, #ARGV, 1 do
+    if result[ARGV[j]] then
+        members[#members+1] = ARGV[j]
+        result[ARGV[j]] = nil
+    end
+end
+return members
+"""
+
+# Like _traverse_metagroups, but walks from all existing groups in ARGV[first..] at once. Since
+# every group is visited only once, at its shortest distance from any of the given groups, this
+# costs no more than a single walk. Returns 1 if the user is a member of any group, 0 otherwise.
+_is_member_any_function = """
+local function is_member_any(groups_key, user, max_depth, first)
+    local visited = {}
+    local level = {}
+    for i=first, #ARGV, 1 do
+        if not visited[ARGV[i]] and redis.call('sismember', groups_key, ARGV[i]) == 1 then
+            visited[ARGV[i]] = true
+            level[#level+1] = ARGV[i]
+        end
+    end
+
+    local depth = 0
+    while #level > 0 do
+        local next_level = {}
+        for i=1, #level, 1 do
+            local ref = level[i]
+            if redis.call('sismember', 'members_' .. ref, user) == 1 then
+                return 1
+            end
+            if depth < max_depth then
+                local parents = redis.call('smembers', 'metagroups_' .. ref)
+                for j=1, #parents, 1 do
+                    if not visited[parents[j]] then
+                        visited[parents[j]] = true
+                        next_level[#next_level+1] = parents[j]
+                    end
+                end
+            end
+        end
+        level = next_level
+        depth = depth + 1
+    end
+    return 0
+end
+"""
+
+# keys = [_GROUPS]
+# args = [depth, user, ref_key, ...]
+_is_member_any_script = _is_member_any_function + """
+return is_member_any(KEYS[1], ARGV[2], tonumber(ARGV[1]), 3)
+"""
+
+# Returns the stored hash and if the user is a member of any of the given groups, so verifying a
+# password costs a single round trip. If only the user is given, groups are not checked.
+# keys = [_USERS, _GROUPS]
+# args = [user, depth, ref_key, ...]
+_check_password_script = _is_member_any_function + """
+local stored = redis.call('hget', KEYS[1], ARGV[1])
+if not stored then
+    return {err="UserNotFound"}
+end
+if #ARGV == 1 then
+    return {stored, 1}
+end
+return {stored, is_member_any(KEYS[2], ARGV[1], tonumber(ARGV[2]), 3)}
+"""
+
+# Walk from the groups a user is a direct member of to all sub-groups up to ARGV[3] levels,
+# the user is an (inherited) member of all of them.
+# keys = [_USERS, _UG % user]
+# args = [user, sid, depth]
+_list_groups_script = """
+if redis.call('hexists', KEYS[1], ARGV[1]) == 0 then
+    return {err="UserNotFound"}
+end
+
+local max_depth = tonumber(ARGV[3])
+local prefix = ARGV[2] .. '_'
+local level = redis.call('smembers', KEYS[2])
+local visited = {}
+local depth = 0
+local result = {}
+
+for i=1, #level, 1 do
+    visited[level[i]] = true
+end
+
+while #level > 0 do
+    local next_level = {}
+    for i=1, #level, 1 do
+        if string.sub(level[i], 1, #prefix) == prefix then
+            result[#result+1] = level[i]
+        end
+        if depth < max_depth then
+            local subgroups = redis.call('smembers', 'subgroups_' .. level[i])
+            for j=1, #subgroups, 1 do
+                if not visited[subgroups[j]] then
+                    visited[subgroups[j]] = true
+                    next_level[#next_level+1] = subgroups[j]
+                end
+            end
+        end
+    end
+    level = next_level
+    depth = depth + 1
+end
+return result
+"""
+
 _USERS = 'users'
 _PROPS = 'props_%s'
+_UG = 'usergroups_%s'
 _GROUPS = 'groups'
 
 
@@ -447,6 +689,8 @@ class RedisBackend(BackendBase):
         self._create_user = self.conn.register_script(_create_user_script)
         self._rename_user = self.conn.register_script(_rename_user_script)
         self._set_password = self.conn.register_script(_set_password_script)
+        self._upgrade_password = self.conn.register_script(_upgrade_password_script)
+        self._check_password = self.conn.register_script(_check_password_script)
         self._remove_user = self.conn.register_script(_remove_user_script)
         self._create_property = self.conn.register_script(_create_property_script)
         self._set_property = self.conn.register_script(_set_property_script)
@@ -464,6 +708,11 @@ class RedisBackend(BackendBase):
         self._set_subgroups = self.conn.register_script(_set_subgroups_script)
         self._subgroups = self.conn.register_script(_subgroups_script)
         self._parents = self.conn.register_script(_parents_script)
+        self._members = self.conn.register_script(_members_script)
+        self._list_groups = self.conn.register_script(_list_groups_script)
+        self._is_member = self.conn.register_script(_is_member_script)
+        self._is_member_any = self.conn.register_script(_is_member_any_script)
+        self._members_of = self.conn.register_script(_members_of_script)
         self._remove_subgroup = self.conn.register_script(_remove_subgroup_script)
         self._remove_group = self.conn.register_script(_remove_group_script)
 
@@ -519,7 +768,7 @@ class RedisBackend(BackendBase):
 
         properties = self._listify(properties)
 
-        keys = [_USERS, _PROPS % user]
+        keys = [_USERS, _PROPS % user, _UG % user]
         args = [user, password, len(properties)]
         if properties:
             args += properties
@@ -539,16 +788,34 @@ class RedisBackend(BackendBase):
                 raise UserExists(user)
             raise
 
+    def _scan_cursor(self, after):
+        if after is None:
+            return 0
+        if not after.isdigit() or after == '0':
+            raise BadRequest('Invalid cursor: %s' % after)
+        return int(after)
+
     def list_users(self):
         return self.conn.hkeys(_USERS)
 
+    def iter_users(self):
+        return (user for user, stored in self.conn.hscan_iter(_USERS))
+
+    def page_users(self, limit, after=None):
+        # HSCAN returns about limit users per call, a page may contain a few more than limit users
+        cursor, users = self.conn.hscan(_USERS, self._scan_cursor(after), count=limit)
+        users = list(users)
+        while cursor and not users:  # HSCAN may return no elements at all
+            cursor, users = self.conn.hscan(_USERS, cursor, count=limit)
+            users = list(users)
+        return users, six.text_type(cursor) if cursor else None
+
     def user_exists(self, user):
         return self.conn.hexists(_USERS, user)
 
     def rename_user(self, user, name):
         try:
-            keys = [_USERS, _PROPS % user, _PROPS % name]
-            keys += list(self.conn.scan_iter(match='members_*'))
+            keys = [_USERS, _PROPS % user, _PROPS % name, _UG % user, _UG % name]
             self._rename_user(keys=keys, args=[user, name])
         except self.redis.ResponseError as e:
             if e.message == 'UserNotFound':
@@ -558,25 +825,27 @@ class RedisBackend(BackendBase):
             raise
 
     def check_password(self, user, password, groups=None):
-        # TODO: rewrite as lua script
         if password is None:
             return False
 
-        def setter(raw_password):
-            self.set_password(user, raw_password)
+        args = [user]
+        if groups is not None:
+            args.append(settings.GROUP_RECURSION_DEPTH)
+            args += [self._ref_key(group, self._sid(service)) for group, service in groups]
 
-        stored = self.conn.hget(_USERS, user)
-        if stored is None:
-            raise UserNotFound(user)
-        matches = check_password(password, stored, setter)
+        try:
+            stored, member = self._check_password(keys=[_USERS, _GROUPS], args=args)
+        except self.redis.ResponseError as e:
+            if e.message == 'UserNotFound':
+                raise UserNotFound(user)
+            raise
 
-        if groups is not None:
-            for group, service in groups:
-                if self.is_member(group, service, user):
-                    return True
-            return False
+        def write(encoded):
+            self._upgrade_password(keys=[_USERS], args=[user, stored, encoded])
 
-        return matches
+        if not check_password(password, stored, HashUpgrade(write)):
+            return False
+        return member == 1
 
     def set_password(self, user, password=None):
         password = make_password(password) if password else ''
@@ -598,9 +867,18 @@ class RedisBackend(BackendBase):
                 raise UserNotFound(user)
             raise
 
+    def get_password_hash(self, user):
+        stored = self.conn.hget(_USERS, user)
+        if stored is None:
+            raise UserNotFound(user)
+        return stored or None
+
+    def password_hashes(self):
+        return (stored for user, stored in self.conn.hscan_iter(_USERS) if stored)
+
     def remove_user(self, user):
         try:
-            keys = [_USERS, _PROPS % user] + list(self.conn.scan_iter(match='members_*'))
+            keys = [_USERS, _PROPS % user, _UG % user]
             self._remove_user(keys=keys, args=[user])
         except self.redis.ResponseError as e:
             if e.message == 'UserNotFound':
@@ -681,27 +959,36 @@ class RedisBackend(BackendBase):
                 raise PropertyNotFound(key)
             raise
 
-    def list_groups(self, service, user=None):
+    def list_groups(self, service, user=None, depth=None):
+        if depth is None:
+            depth = settings.GROUP_RECURSION_DEPTH
+
         sid = self._sid(service)
         if user is None:
-            groups = self.conn.sscan_iter(_GROUPS, match='%s_*' % sid)
-            return [self._parse_key(g)[0] for g in groups]
+            return [self._parse_key(g)[0] for g in self.conn.smembers(self._g_key(sid))]
         else:
-            # TODO: rewrite as lua script
-            if not self.conn.hexists(_USERS, user):
-                raise UserNotFound(user)
+            keys = [_USERS, _UG % user]
+            args = [user, sid, depth]
+            try:
+                groups = self._list_groups(keys=keys, args=args)
+            except self.redis.ResponseError as e:
+                if e.message == 'UserNotFound':
+                    raise UserNotFound(user)
+                raise
+            return [self._parse_key(g)[0] for g in groups]
 
-            groups = set()
-            for group in self.conn.sscan_iter(_GROUPS, match='%s_*' % sid):
-                group = self._parse_key(group)[0]
-                if self.is_member(group=group, service=service, user=user):
-                    groups.add(group)
-            return list(groups)
+    def page_groups(self, service, limit, after=None):
+        g_key = self._g_key(self._sid(service))
+        cursor, groups = self.conn.sscan(g_key, self._scan_cursor(after), count=limit)
+        while cursor and not groups:
+            cursor, groups = self.conn.sscan(g_key, cursor, count=limit)
+        groups = [self._parse_key(g)[0] for g in groups]
+        return groups, six.text_type(cursor) if cursor else None
 
     def create_group(self, group, service, users=None, dry=False):
         sid = self._sid(service)
         ref_key = self._ref_key(group, sid)
-        keys = [_GROUPS]
+        keys = [_GROUPS, self._g_key(sid)]
         args = [ref_key]
         if users:
             keys += [self._gu_key(group, sid), _USERS]
@@ -742,9 +1029,10 @@ class RedisBackend(BackendBase):
         new_gu_key = self._gu_key(name, sid)
         old_sg_key = self._sg_key(group, sid)
         new_sg_key = self._sg_key(name, sid)
+        g_key = self._g_key(sid)
         mg_keys = ['metagroups_%s' % k for k in self.conn.smembers(old_sg_key)]
 
-        keys = [_GROUPS, old_gu_key, new_gu_key, old_sg_key, new_sg_key] + mg_keys
+        keys = [_GROUPS, old_gu_key, new_gu_key, old_sg_key, new_sg_key, g_key, g_key] + mg_keys
         args = [old_ref, new_ref]
 
         try:
@@ -766,9 +1054,12 @@ class RedisBackend(BackendBase):
         new_gu_key = self._gu_key(group, new_sid)
         old_sg_key = self._sg_key(group, old_sid)
         new_sg_key = self._sg_key(group, new_sid)
+        old_g_key = self._g_key(old_sid)
+        new_g_key = self._g_key(new_sid)
         mg_keys = ['metagroups_%s' % k for k in self.conn.smembers(old_sg_key)]
 
-        keys = [_GROUPS, old_gu_key, new_gu_key, old_sg_key, new_sg_key] + mg_keys
+        keys = [_GROUPS, old_gu_key, new_gu_key, old_sg_key, new_sg_key, old_g_key, new_g_key]
+        keys += mg_keys
         args = [old_ref, new_ref]
 
         try:
@@ -788,11 +1079,8 @@ class RedisBackend(BackendBase):
         sid = self._sid(service)
         groups = [self._ref_key(g, sid) for g in groups]
 
-        # All existing and created groups may be modified
-        existing_groups = self.conn.sscan_iter(_GROUPS, match='%s_*' % sid)
-        clear_groups = set(existing_groups) | set(groups)
-        keys = [_USERS, _GROUPS] + ['members_%s' % g for g in clear_groups]
-        args = [user, ] + groups
+        keys = [_USERS, _GROUPS, _UG % user, self._g_key(sid)]
+        args = [user, sid] + groups
 
         try:
             self._set_memberships(keys=keys, args=args)
@@ -822,7 +1110,7 @@ class RedisBackend(BackendBase):
 
     def add_member(self, group, service, user):
         sid = self._sid(service)
-        keys = [_GROUPS, _USERS, self._gu_key(group, sid)]
+        keys = [_GROUPS, _USERS, self._gu_key(group, sid), _UG % user]
         args = [self._ref_key(group, sid), user]
         try:
             self._add_member(keys=keys, args=args)
@@ -833,57 +1121,49 @@ class RedisBackend(BackendBase):
                 raise UserNotFound(user)
             raise
 
-    def _parent_keys(self, ref_key, depth, max_depth):
-        parents = self.conn.smembers('metagroups_%s' % ref_key)
-        if depth < max_depth:
-            for parent in set(parents):
-                parents |= self._parent_keys(parent, depth + 1, max_depth)
-        return parents
-
     def members(self, group, service, depth=None):
-        # TODO: rewrite as lua script
-
         if depth is None:
             depth = settings.GROUP_RECURSION_DEPTH
 
-        sid = self._sid(service)
-        ref_key = self._ref_key(group, sid)
-        if not self.conn.sismember(_GROUPS, ref_key):
-            raise GroupNotFound(group, service)
-
-        members = self.conn.smembers(self._gu_key(group, sid))
-        if depth == 0:
-            return list(members)
-
-        sid = self._sid(service)
-        ref_keys = self._parent_keys(ref_key, depth=1, max_depth=depth)
-        ref_keys = ['members_%s' % k for k in ref_keys]
-        if ref_keys:
-            return list(members | self.conn.sunion(*ref_keys))
-        else:
-            return list(members)
+        ref_key = self._ref_key(group, self._sid(service))
+        try:
+            return self._members(keys=[_GROUPS], args=[ref_key, depth])
+        except self.redis.ResponseError as e:
+            if e.message == 'GroupNotFound':
+                raise GroupNotFound(group, service)
+            raise
 
     def is_member(self, group, service, user):
-        # TODO: rewrite as lua script
-        sid = self._sid(service)
-        ref_key = self._ref_key(group, sid)
-        if not self.conn.sismember(_GROUPS, ref_key):
-            raise GroupNotFound(group, service)
+        ref_key = self._ref_key(group, self._sid(service))
+        args = [ref_key, settings.GROUP_RECURSION_DEPTH, user]
+        try:
+            return self._is_member(keys=[_GROUPS], args=args) == 1
+        except self.redis.ResponseError as e:
+            if e.message == 'GroupNotFound':
+                raise GroupNotFound(group, service)
+            raise
+
+    def is_member_any(self, user, groups):
+        if not groups:
+            return False
 
-        members = self.conn.smembers(self._gu_key(group, sid))
-        if user in members:
-            return True
+        args = [settings.GROUP_RECURSION_DEPTH, user]
+        args += [self._ref_key(group, self._sid(service)) for group, service in groups]
+        return self._is_member_any(keys=[_GROUPS], args=args) == 1
 
-        ref_keys = self._parent_keys(self._ref_key(group, sid), depth=1,
-                                 max_depth=settings.GROUP_RECURSION_DEPTH)
-        ref_keys = ['members_%s' % k for k in ref_keys]
-        if ref_keys:  # we might have no parents
-            return user in self.conn.sunion(*ref_keys)
-        return False
+    def members_of(self, group, service, users):
+        ref_key = self._ref_key(group, self._sid(service))
+        args = [ref_key, settings.GROUP_RECURSION_DEPTH] + list(users)
+        try:
+            return self._members_of(keys=[_GROUPS], args=args)
+        except self.redis.ResponseError as e:
+            if e.message == 'GroupNotFound':
+                raise GroupNotFound(group, service)
+            raise
 
     def remove_member(self, group, service, user):
         sid = self._sid(service)
-        keys = [_GROUPS, self._gu_key(group, sid)]
+        keys = [_GROUPS, self._gu_key(group, sid), _UG % user]
         args = [self._ref_key(group, sid), user]
         try:
             self._remove_member(keys=keys, args=args)
@@ -997,7 +1277,7 @@ class RedisBackend(BackendBase):
 
         mg_keys = ['subgroups_%s' % g for g in metagroups]
         sg_keys = ['metagroups_%s' % g for g in subgroups]
-        keys = [_GROUPS, gu_key, sg_key, mg_key] + mg_keys + sg_keys
+        keys = [_GROUPS, gu_key, sg_key, mg_key, self._g_key(sid)] + mg_keys + sg_keys
         args = [ref_key]
         try:
             self._remove_group(keys=keys, args=args)
@@ -1006,6 +1286,24 @@ class RedisBackend(BackendBase):
                 raise GroupNotFound(group, service)
             raise
 
+    def rebuild_indexes(self):
+        """Rebuild all secondary indexes from the primary data.
+
+        This is required once when upgrading from a version of RestAuth that did not maintain
+        these indexes yet.
+        """
+        pipe = self.conn.pipeline()
+        for key in self.conn.scan_iter(match=_UG % '*'):
+            pipe.delete(key)
+        for key in self.conn.scan_iter(match=self._g_key('*')):
+            pipe.delete(key)
+
+        for ref_key in self.conn.sscan_iter(_GROUPS):
+            pipe.sadd(self._g_key(ref_key.split('_', 1)[0]), ref_key)
+            for user in self.conn.sscan_iter('members_%s' % ref_key):
+                pipe.sadd(_UG % user, ref_key)
+        pipe.execute()
+
     def testSetUp(self):
         self.conn.flushdb()
 
@@ -0,0 +1,347 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of RestAuth (https://restauth.net).
+#
+# RestAuth is free software: you can redistribute it and/or modify it under the terms of the GNU
+# General Public License as published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# RestAuth is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without
+# even the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with RestAuth. If not,
+# see <http://www.gnu.org/licenses/>.
+
+from __future__ import unicode_literals, absolute_import
+
+import bisect
+import hashlib
+import threading
+
+from collections import defaultdict
+from itertools import chain
+from multiprocessing.pool import ThreadPool
+
+from django.db import close_old_connections
+from django.utils import six
+from django.utils.module_loading import import_string
+
+from Services.models import Service
+from backends.base import BackendBase
+from backends.base import ChildTransactionManager
+from common.errors import UserExists
+from common.errors import UserNotFound
+
+
+class HashRing(object):
+    """A consistent hash ring.
+
+    Every node is placed on the ring ``replicas`` times, keys are mapped to the first node
+    following them on the ring. Adding or removing a node thus only moves the keys between that
+    node and its neighbours, about ``1/n`` of all keys with ``n`` nodes.
+
+    :param nodes: A list of ``(name, node)`` tuples. The position of a node depends only on its
+        name.
+    :type  nodes: list
+    :param replicas: The number of points per node on the ring.
+    :type  replicas: int
+    """
+
+    def __init__(self, nodes, replicas=100):
+        ring = sorted(((self._hash('%s-%s' % (name, i)), node)
+                       for name, node in nodes for i in range(replicas)), key=lambda t: t[0])
+        self._keys = [key for key, node in ring]
+        self._nodes = [node for key, node in ring]
+
+    def _hash(self, key):
+        return int(hashlib.md5(key.encode('utf-8')).hexdigest()[:16], 16)
+
+    def get(self, key):
+        i = bisect.bisect(self._keys, self._hash(key)) % len(self._keys)
+        return self._nodes[i]
+
+
+class ShardedBackend(BackendBase):
+    """Distribute users over several backends.
+
+    Every user (including its password, properties and group memberships) is stored in exactly
+    one shard, chosen by consistent hashing of the username. Groups and their subgroups are
+    created in every shard, so every shard can resolve inherited memberships of its own users on
+    its own. Operations on a single user thus query a single shard, while listing the members of a
+    group queries all shards in parallel. Users are listed one shard after another, so they can be
+    streamed to the client.
+
+    Example::
+
+        DATA_BACKEND = {
+            'BACKEND': 'backends.sharded.ShardedBackend',
+            'SHARDS': [
+                {'NAME': 'redis1', 'BACKEND': 'backends.redis.RedisBackend', 'HOST': 'redis1'},
+                {'NAME': 'redis2', 'BACKEND': 'backends.redis.RedisBackend', 'HOST': 'redis2'},
+            ],
+        }
+
+    When adding a shard, only users that hash to the new shard (about ``1/n`` of all users with
+    ``n`` shards) have to be moved, all other users stay where they are. Since the position of a
+    shard only depends on its name, always give shards a ``NAME``, otherwise the position in the
+    list is used, and removing a shard from the middle of the list would move almost all users.
+    Groups have to be created in the new shard before it is used. There are no tools to move
+    users yet, the easiest way is to export and import the data (see |bin-restauth-import-doc|).
+
+    Writes to groups are applied to every shard one after another and are not atomic, so a failing
+    shard may leave the shards inconsistent. Renaming a user to a name that maps to a different
+    shard moves the password hash, properties and group memberships to that shard. This requires
+    that the shards implement :py:meth:`~backends.base.BackendBase.get_password_hash`. If moving
+    the user fails, the copy in the new shard is removed again.
+
+    :param SHARDS: A list of backend configurations, each in the same format as
+        :setting:`DATA_BACKEND`. A ``NAME`` key determines the position of the shard on the hash
+        ring. The first shard answers queries that only involve groups.
+    :param REPLICAS: The number of points per shard on the hash ring, more points distribute users
+        more evenly.
+    """
+
+    TRANSACTION_MANAGER = ChildTransactionManager
+
+    def __init__(self, SHARDS, REPLICAS=100):
+        self.shards = []
+        nodes = []
+        for i, config in enumerate(SHARDS):
+            config = dict(config)
+            name = config.pop('NAME', six.text_type(i))
+            backend_cls = import_string(config.pop('BACKEND'))
+
+            shard = backend_cls(**config)
+            self.shards.append(shard)
+            nodes.append((name, shard))
+
+        self.children = self.shards
+        self.primary = self.shards[0]
+        self.ring = HashRing(nodes, replicas=REPLICAS)
+        self.SUPPORTS_GROUP_VISIBILITY = all(s.SUPPORTS_GROUP_VISIBILITY for s in self.shards)
+        self.SUPPORTS_SUBGROUPS = all(s.SUPPORTS_SUBGROUPS for s in self.shards)
+        self._pool = None
+        self._pool_lock = threading.Lock()
+
+    def _shard(self, user):
+        return self.ring.get(user)
+
+    def _map(self, func, shards=None):
+        # Run func for every shard in parallel.
+        if shards is None:
+            shards = self.shards
+        if len(shards) == 1:
+            return [func(shards[0])]
+
+        def run(shard):
+            try:
+                return func(shard)
+            finally:
+                close_old_connections()  # worker threads never see the end of the request
+
+        with self._pool_lock:
+            if self._pool is None:
+                self._pool = ThreadPool(len(self.shards))
+        return self._pool.map(run, shards)
+
+    def _replicate(self, func):
+        # Run func for the primary shard first, so errors are raised before other shards change.
+        result = func(self.primary)
+        if len(self.shards) > 1:
+            self._map(func, self.shards[1:])
+        return result
+
+    def _partition(self, users):
+        # Group the given users by their shard, raise UserNotFound if any user doesn't exist.
+        partitions = defaultdict(list)
+        for user in users:
+            partitions[self._shard(user)].append(user)
+        for shard, shard_users in six.iteritems(partitions):
+            for user in shard_users:
+                if not shard.user_exists(user):
+                    raise UserNotFound(user)
+        return partitions
+
+    def _create_groups(self, groups):
+        # Create missing groups in all shards before a shard would create it only for itself.
+        for group, service in groups:
+            if not self.primary.group_exists(group, service):
+                self._replicate(lambda s: s.create_group(group, service))
+
+    def testSetUp(self):
+        for shard in self.shards:
+            shard.testSetUp()
+
+    def testTearDown(self):
+        for shard in self.shards:
+            shard.testTearDown()
+
+    def create_user(self, user, password=None, properties=None, groups=None, dry=False):
+        shard = self._shard(user)
+        if groups and dry is False:
+            if shard.user_exists(user):
+                raise UserExists(user)
+            self._create_groups(groups)
+        return shard.create_user(user, password=password, properties=properties, groups=groups,
+                                 dry=dry)
+
+    def list_users(self):
+        return list(chain.from_iterable(shard.list_users() for shard in self.shards))
+
+    def iter_users(self):
+        return chain.from_iterable(shard.iter_users() for shard in self.shards)
+
+    def user_exists(self, user):
+        return self._shard(user).user_exists(user)
+
+    def _direct_memberships(self, shard, user):
+        # Only direct memberships must be copied, inherited memberships follow from them
+        services = [None]
+        if shard.SUPPORTS_GROUP_VISIBILITY:
+            services += list(Service.objects.all())
+
+        return [(group, service) for service in services
+                for group in shard.list_groups(service, user=user, depth=0)]
+
+    def rename_user(self, user, name):
+        shard = self._shard(user)
+        new_shard = self._shard(name)
+        if new_shard is shard:
+            return shard.rename_user(user, name)
+
+        # The new name maps to a different shard, so we move the user there.
+        if not shard.user_exists(user):
+            raise UserNotFound(user)
+        if new_shard.user_exists(name):
+            raise UserExists(name)
+
+        properties = shard.get_properties(user)
+        groups = self._direct_memberships(shard, user)
+        password_hash = shard.get_password_hash(user)
+
+        new_shard.create_user(name, properties=properties, groups=groups)
+        try:
+            if password_hash is not None:
+                new_shard.set_password_hash(name, algorithm='django', hash=password_hash)
+            shard.remove_user(user)
+        except Exception:
+            new_shard.remove_user(name)  # don't leave a copy of the user behind
+            raise
+
+    def check_password(self, user, password, groups=None):
+        return self._shard(user).check_password(user, password, groups=groups)
+
+    def set_password(self, user, password=None):
+        return self._shard(user).set_password(user, password=password)
+
+    def set_password_hash(self, user, algorithm, hash):
+        return self._shard(user).set_password_hash(user, algorithm=algorithm, hash=hash)
+
+    def get_password_hash(self, user):
+        return self._shard(user).get_password_hash(user)
+
+    def password_hashes(self):
+        return chain.from_iterable(shard.password_hashes() for shard in self.shards)
+
+    def remove_user(self, user):
+        return self._shard(user).remove_user(user)
+
+    def get_properties(self, user):
+        return self._shard(user).get_properties(user)
+
+    def create_property(self, user, key, value, dry=False):
+        return self._shard(user).create_property(user, key, value, dry=dry)
+
+    def get_property(self, user, key):
+        return self._shard(user).get_property(user, key)
+
+    def set_property(self, user, key, value):
+        return self._shard(user).set_property(user, key, value)
+
+    def set_properties(self, user, properties):
+        return self._shard(user).set_properties(user, properties)
+
+    def remove_property(self, user, key):
+        return self._shard(user).remove_property(user, key)
+
+    def list_groups(self, service, user=None, depth=None):
+        if user is None:
+            return self.primary.list_groups(service)
+        return self._shard(user).list_groups(service, user=user, depth=depth)
+
+    def page_groups(self, service, limit, after=None):
+        return self.primary.page_groups(service, limit, after=after)
+
+    def create_group(self, group, service, users=None, dry=False):
+        partitions = self._partition(users or [])
+        return self._replicate(lambda s: s.create_group(group, service, users=partitions.get(s),
+                                                        dry=dry))
+
+    def rename_group(self, group, name, service):
+        return self._replicate(lambda s: s.rename_group(group, name, service))
+
+    def set_service(self, group, service, new_service):
+        return self._replicate(lambda s: s.set_service(group, service, new_service))
+
+    def group_exists(self, group, service):
+        return self.primary.group_exists(group, service)
+
+    def set_memberships(self, user, service, groups):
+        shard = self._shard(user)
+        if not shard.user_exists(user):
+            raise UserNotFound(user)
+        self._create_groups([(group, service) for group in groups])
+        return shard.set_memberships(user, service, groups)
+
+    def set_members(self, group, service, users):
+        partitions = self._partition(users)
+        return self._replicate(lambda s: s.set_members(group, service, partitions.get(s, [])))
+
+    def add_member(self, group, service, user):
+        return self._shard(user).add_member(group, service, user)
+
+    def members(self, group, service, depth=None):
+        members = self._map(lambda s: s.members(group, service, depth=depth))
+        return list(chain.from_iterable(members))
+
+    def is_member(self, group, service, user):
+        return self._shard(user).is_member(group, service, user)
+
+    def is_member_any(self, user, groups):
+        return self._shard(user).is_member_any(user, groups)
+
+    def members_of(self, group, service, users):
+        partitions = defaultdict(list)
+        for user in users:
+            partitions[self._shard(user)].append(user)
+
+        # the primary shard raises GroupNotFound even if no user is stored there
+        shards = [self.primary] + [s for s in partitions if s is not self.primary]
+        members = self._map(lambda s: s.members_of(group, service, partitions.get(s, [])),
+                            shards)
+        return list(chain.from_iterable(members))
+
+    def remove_member(self, group, service, user):
+        return self._shard(user).remove_member(group, service, user)
+
+    def add_subgroup(self, group, service, subgroup, subservice):
+        return self._replicate(lambda s: s.add_subgroup(group, service, subgroup, subservice))
+
+    def set_subgroups(self, group, service, subgroups, subservice):
+        return self._replicate(lambda s: s.set_subgroups(group, service, subgroups, subservice))
+
+    def is_subgroup(self, group, service, subgroup, subservice):
+        return self.primary.is_subgroup(group, service, subgroup, subservice)
+
+    def remove_subgroup(self, group, service, subgroup, subservice):
+        return self._replicate(lambda s: s.remove_subgroup(group, service, subgroup, subservice))
+
+    def subgroups(self, group, service, filter=True):
+        return self.primary.subgroups(group, service, filter=filter)
+
+    def parents(self, group, service):
+        return self.primary.parents(group, service)
+
+    def remove_group(self, group, service):
+        return self._replicate(lambda s: s.remove_group(group, service))
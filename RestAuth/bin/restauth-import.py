@@ -48,10 +48,10 @@ try:
     import django
     django.setup()
 
+    from django.core.exceptions import ValidationError
     from django.utils import six
 
     from Services.models import Service
-    from Services.models import ServiceAddress
     from backends import backend
     from common.cli.parsers import parser
     from common.hashers import import_hash
@@ -92,9 +92,10 @@ def save_services(services, args, parser):
             print('* %s: Added service with no password.' % name)
         service.save()
 
-        for host in data.get('hosts', []):
-            address = ServiceAddress.objects.get_or_create(address=host)[0]
-            service.hosts.add(address)
+        try:
+            service.add_hosts(*data.get('hosts', []))
+        except ValidationError as e:
+            parser.error('%s: %s' % (name, e.messages[0]))
 
 
 def save_users(users, args, parser):
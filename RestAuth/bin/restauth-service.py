@@ -44,6 +44,7 @@ try:
     from django.db.utils import IntegrityError
 
     from Services.models import Service
+    from Services.models import invalidate_service_cache
     from Services.cli.parsers import parser
 except ImportError as e:  # pragma: no cover
     sys.stderr.write(
@@ -68,8 +69,10 @@ def main(args=None):
                 args.service.save()
             except IntegrityError:
                 parser.error("%s: Service already exists." % args.name)
+        invalidate_service_cache()
     elif args.action == 'rm':
         args.service.delete()
+        invalidate_service_cache()
     elif args.action == 'ls':
         for service in Service.objects.all().order_by('username'):
             print('%s: %s' % (service.name, ', '.join(service.addresses)))
@@ -99,10 +102,13 @@ def main(args=None):
     elif args.action == 'set-permissions':
         args.service.user_permissions.clear()
         args.service.user_permissions.add(*args.permissions)
+        invalidate_service_cache()
     elif args.action == 'add-permissions':
         args.service.user_permissions.add(*args.permissions)
+        invalidate_service_cache()
     elif args.action == 'rm-permissions':  # pragma: no branch
         args.service.user_permissions.remove(*args.permissions)
+        invalidate_service_cache()
 
 if __name__ == '__main__':  # pragma: no cover
     main()
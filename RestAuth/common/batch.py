@@ -0,0 +1,207 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of RestAuth (https://restauth.net).
+#
+# RestAuth is free software: you can redistribute it and/or modify it under the terms of the GNU
+# General Public License as published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# RestAuth is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without
+# even the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with RestAuth. If not,
+# see <http://www.gnu.org/licenses/>.
+
+"""This module implements ``POST /batch/``, which executes many operations in one request.
+
+The body of a batch request is a dictionary with a list of operations, each operation names the
+HTTP method and path of a normal request to ``/users/`` or ``/groups/`` and, for ``POST`` and
+``PUT`` requests, its body::
+
+    {"operations": [
+        {"method": "POST", "path": "/users/foo/", "body": {"password": "..."}},
+        {"method": "GET", "path": "/users/foo/props/"},
+        {"method": "GET", "path": "/groups/admins/users/foo/"}
+    ]}
+
+The response is a list with the result of every operation in the same order. Every result is a
+dictionary with the ``status`` code, the ``body`` (``None`` if there is no body) and ``headers``
+relevant to the client (e.g. ``Resource-Type``)::
+
+    [{"status": 204, "body": null, "headers": {}},
+     {"status": 200, "body": {"email": "foo@example.com"}, "headers": {}},
+     {"status": 404, "body": "Group not found", "headers": {"Resource-Type": "group"}}]
+
+Operations are executed by the same views as normal requests, so they check the same permissions.
+The service authenticates only once for the whole batch. Operations are executed in order, but
+consecutive ``GET`` requests don't modify any data and are executed in parallel (see
+:setting:`BATCH`). Lists are held in memory until the whole batch is done, so long lists should be
+fetched page by page using the ``limit`` query parameter.
+"""
+
+from __future__ import unicode_literals
+
+import logging
+import threading
+
+from itertools import chain
+from multiprocessing.pool import ThreadPool
+
+from django.conf import settings
+from django.core.urlresolvers import Resolver404
+from django.core.urlresolvers import resolve
+from django.db import close_old_connections
+from django.http import HttpRequest
+from django.http import QueryDict
+from django.utils import six
+from django.utils.http import urlunquote
+
+import mimeparse
+
+from common import routers
+from common.content_handlers import get_handler
+from common.content_handlers import get_supported
+from common.middleware import RestAuthMiddleware
+from common.responses import HttpRestAuthResponse
+from common.types import get_response_type
+from common.views import RestAuthView
+
+METHODS = {'GET', 'POST', 'PUT', 'DELETE'}
+PREFIXES = ('/users/', '/groups/')
+HIDDEN_HEADERS = {'content-type', 'content-length'}
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def _get_pool(threads):
+    global _pool
+
+    with _pool_lock:
+        if _pool is None:
+            _pool = ThreadPool(threads)
+    return _pool
+
+
+class BatchView(RestAuthView):
+    """Handle requests to ``/batch/``."""
+
+    http_method_names = ['post']
+    log = logging.getLogger('batch')
+    post_required = (('operations', list),)
+
+    def _parse_operations(self, request):
+        operations = self._parse_post(request)
+        max_operations = settings.BATCH.get('MAX_OPERATIONS', 100)
+        assert len(operations) <= max_operations, \
+            'A batch may contain at most %s operations.' % max_operations
+
+        for op in operations:
+            assert isinstance(op, dict), 'Operation is not a dictionary.'
+            assert op.get('method') in METHODS, 'Unsupported method: %s' % op.get('method')
+            assert isinstance(op.get('path'), six.string_types), 'Operation has no path.'
+            assert isinstance(op.get('body', {}), dict), \
+                'Body of an operation is not a dictionary.'
+        return operations
+
+    def _sub_request(self, request, op):
+        path, _sep, query = op['path'].partition('?')
+        sub = HttpRequest()
+        sub.method = op['method']
+        sub.path = sub.path_info = urlunquote(path)
+        sub.GET = QueryDict(query)
+        sub.META = dict((k, v) for k, v in six.iteritems(request.META)
+                        if k not in ('HTTP_AUTHORIZATION', 'REMOTE_USER'))
+        sub.META['REQUEST_METHOD'] = sub.method
+        sub.META['QUERY_STRING'] = query
+        sub.META['CONTENT_TYPE'] = self.handler.mime
+        sub._body = self.handler.marshal_dict(op['body']) if 'body' in op else b''
+        sub.META['CONTENT_LENGTH'] = str(len(sub._body))
+
+        # the service is already authenticated, so login_required() calls the view right away
+        sub.user = request.user
+        sub.version = request.version
+        return sub
+
+    def _execute(self, request, op):
+        sub = self._sub_request(request, op)
+        try:
+            if not sub.path.startswith(PREFIXES):
+                raise Resolver404()
+            match = resolve(sub.path)
+        except Resolver404:
+            return {'status': 404, 'body': None, 'headers': {}}
+
+        routers.set_request(sub)
+        try:
+            response = match.func(sub, *match.args, **match.kwargs)
+        except Exception as e:
+            response = RestAuthMiddleware().process_exception(sub, e)
+            if response is None:  # not a RestAuth error, the traceback is already logged
+                return {'status': 500, 'body': None, 'headers': {}}
+        finally:
+            routers.set_request(request)
+
+        return self._result(response)
+
+    def _execute_parallel(self, request, ops):
+        try:
+            return [self._execute(request, op) for op in ops]
+        finally:
+            routers.set_request(None)
+            close_old_connections()  # worker threads never see the end of the request
+
+    def _result(self, response):
+        if isinstance(response, HttpRestAuthResponse):
+            body = response.response_object
+        elif response.streaming:  # always a list
+            body = self.response_handler.unmarshal_list(b''.join(response.streaming_content))
+        elif response.content:
+            body = response.content.decode('utf-8')
+        else:
+            body = None
+
+        headers = dict((k, v) for k, v in response.items() if k.lower() not in HIDDEN_HEADERS)
+        return {'status': response.status_code, 'body': body, 'headers': headers}
+
+    def _map(self, request, ops):
+        threads = settings.BATCH.get('THREADS', 4)
+        if threads <= 1 or len(ops) <= 1:
+            return [self._execute(request, op) for op in ops]
+
+        request.user.get_all_permissions()  # load permissions once, not in every thread
+
+        # every thread executes a slice of the operations, so connections are only closed once
+        size = -(-len(ops) // threads)
+        slices = [ops[i:i + size] for i in range(0, len(ops), size)]
+        results = _get_pool(threads).map(lambda ops: self._execute_parallel(request, ops), slices)
+        return list(chain.from_iterable(results))
+
+    def post(self, request, largs):
+        """Execute many operations at once."""
+
+        # If BadRequest: 400 Bad Request
+        operations = self._parse_operations(request)
+        self.handler = get_handler(mimeparse.best_match(get_supported(),
+                                                        request.META['CONTENT_TYPE']))
+        self.response_handler = get_handler(get_response_type(request))
+
+        results = [None] * len(operations)
+        reads = []  # consecutive GET requests, executed in parallel before the next write
+
+        def flush():
+            for i, result in zip(reads, self._map(request, [operations[i] for i in reads])):
+                results[i] = result
+            del reads[:]
+
+        for i, op in enumerate(operations):
+            if op['method'] == 'GET':
+                reads.append(i)
+            else:
+                flush()
+                results[i] = self._execute(request, op)
+        flush()
+
+        self.log.debug('Executed %s operations', len(operations), extra=largs)
+        return HttpRestAuthResponse(request, results)
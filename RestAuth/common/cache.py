@@ -0,0 +1,79 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of RestAuth (https://restauth.net).
+#
+# RestAuth is free software: you can redistribute it and/or modify it under the terms of the GNU
+# General Public License as published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# RestAuth is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without
+# even the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with RestAuth.  If not,
+# see <http://www.gnu.org/licenses/>.
+
+"""In-process caches."""
+
+from __future__ import unicode_literals
+
+import threading
+import time
+
+try:
+    from collections import OrderedDict
+except ImportError:  # pragma: python2.6
+    from django.utils.datastructures import SortedDict as OrderedDict
+
+
+class LRUCache(object):
+    """A thread-safe cache with a maximum size and a time-to-live for its entries.
+
+    If the cache is full, the least recently used entry is evicted. Expired entries are removed
+    when they are accessed.
+
+    :param size: The maximum number of entries in the cache.
+    :type  size: int
+    :param ttl: The number of seconds an entry is valid.
+    :type  ttl: int
+    """
+
+    def __init__(self, size, ttl):
+        self.size = size
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            try:
+                expires, value = self._data.pop(key)
+            except KeyError:
+                return default
+
+            if expires < time.time():
+                return default
+
+            self._data[key] = (expires, value)  # re-insert as most recently used
+            return value
+
+    def set(self, key, value, ttl=None):
+        if ttl is None:
+            ttl = self.ttl
+
+        with self._lock:
+            self._data.pop(key, None)
+            while self._data and len(self._data) >= self.size:
+                del self._data[next(iter(self._data))]
+            self._data[key] = (time.time() + ttl, value)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
@@ -20,6 +20,7 @@ from __future__ import unicode_literals
 from RestAuthCommon.error import PreconditionFailed
 from RestAuthCommon.error import ResourceConflict
 from RestAuthCommon.error import ResourceNotFound
+from RestAuthCommon.error import RestAuthException
 
 
 class PasswordInvalid(PreconditionFailed):
@@ -42,6 +43,11 @@ class GroupExists(ResourceConflict):
     pass
 
 
+class Throttled(RestAuthException):
+    """Raised if a client failed to authenticate too often, see :setting:`AUTH_THROTTLE`."""
+    response_code = 429
+
+
 class UserNotFound(ResourceNotFound):
     def __init__(self, name):
         self.name = name
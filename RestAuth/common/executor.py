@@ -0,0 +1,337 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of RestAuth (https://restauth.net).
+#
+# RestAuth is free software: you can redistribute it and/or modify it under the terms of the GNU
+# General Public License as published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# RestAuth is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without
+# even the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with RestAuth.  If not,
+# see <http://www.gnu.org/licenses/>.
+
+"""Offload password hashing to a pool of worker processes.
+
+:py:func:`make_password` and :py:func:`check_password` are drop-in replacements for the functions
+of the same name in :py:mod:`django.contrib.auth.hashers`. If :setting:`HASHING_EXECUTOR` is set,
+the (intentionally slow) password hashers run in a :py:class:`HashingExecutor`, otherwise they run
+inline.
+
+If :setting:`DEFERRED_REHASH` is set, outdated hashes found by :py:func:`check_password` are not
+upgraded immediately but by a :py:class:`RehashQueue` in the background.
+"""
+
+from __future__ import unicode_literals
+
+import logging
+import multiprocessing
+import os
+import threading
+import time
+
+import django
+
+from django.conf import settings
+from django.contrib.auth import hashers
+from django.utils.six.moves import queue
+
+log = logging.getLogger(__name__)
+
+
+def _get_context():
+    # Forking a process while other threads hold a lock (e.g. of the logging module) may deadlock
+    # the child, so workers are started from a clean process where Python supports this.
+    if not hasattr(multiprocessing, 'get_context'):  # pragma: py2
+        return multiprocessing
+    if 'forkserver' in multiprocessing.get_all_start_methods():  # pragma: py3
+        return multiprocessing.get_context('forkserver')
+    return multiprocessing.get_context('spawn')  # pragma: py3
+
+
+def _init_worker():
+    django.setup()  # workers that are not forked have to load the settings on their own
+
+
+def _run(func, *args):
+    # Runs in the worker process, also returns when the worker started the task.
+    started = time.time()
+    return func(*args), started
+
+
+def _make_password(password):
+    return hashers.make_password(password)
+
+
+def _check_password(password, encoded):
+    # The setter must run in the calling process, so we only tell it that it must be called.
+    must_update = []
+    correct = hashers.check_password(password, encoded, lambda p: must_update.append(True))
+    return correct, bool(must_update)
+
+
+class HashingExecutor(object):
+    """A process pool for password hashing with a bounded queue.
+
+    If more than ``queue_size`` tasks are pending, further submissions block until a slot becomes
+    available. The pool is created by :py:meth:`start` or on first use (and recreated after a
+    fork), so it is safe to create an instance before a preforking webserver forks its workers.
+    On Python 3, worker processes are started with the ``forkserver`` (or ``spawn``) method. On
+    Python 2, they are forked, so the pool should be started before the process starts any other
+    threads.
+
+    The executor collects a few metrics: ``queue_depth`` is the number of currently pending tasks,
+    ``max_queue_depth`` the highest value ever seen, ``tasks`` the number of completed tasks and
+    ``wait_time`` the total number of seconds tasks waited before a worker started them. The
+    metrics are logged (at level ``INFO``) at most every ``stats_interval`` seconds.
+
+    :param processes: The number of worker processes, defaults to the number of CPUs.
+    :type  processes: int
+    :param queue_size: The maximum number of pending tasks, defaults to four times the number of
+        processes.
+    :type  queue_size: int
+    :param stats_interval: Log the metrics at most every ``stats_interval`` seconds, ``0``
+        disables logging.
+    :type  stats_interval: int
+    """
+
+    def __init__(self, processes=None, queue_size=None, stats_interval=60):
+        self.processes = processes or multiprocessing.cpu_count()
+        self.queue_size = queue_size or self.processes * 4
+        self.stats_interval = stats_interval
+
+        self._pool = None
+        self._pid = None
+        self._pool_lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(self.queue_size)
+        self._stats_lock = threading.Lock()
+
+        self.queue_depth = 0
+        self.max_queue_depth = 0
+        self.tasks = 0
+        self.wait_time = 0.0
+        self._stats_logged = time.time()
+
+    @property
+    def pool(self):
+        with self._pool_lock:
+            if self._pool is None or self._pid != os.getpid():
+                self._pool = _get_context().Pool(self.processes, initializer=_init_worker)
+                self._pid = os.getpid()
+            return self._pool
+
+    def start(self):
+        """Start the worker processes, if they are not running yet."""
+        self.pool
+
+    def submit(self, func, *args):
+        """Run ``func`` with the given arguments in a worker process and return its result."""
+
+        submitted = time.time()
+        if not self._slots.acquire(False):
+            log.warning('Hashing queue is full (%s tasks), waiting for a free slot.',
+                        self.queue_size)
+            self._slots.acquire()
+
+        with self._stats_lock:
+            self.queue_depth += 1
+            self.max_queue_depth = max(self.queue_depth, self.max_queue_depth)
+
+        try:
+            result, started = self.pool.apply_async(_run, (func, ) + args).get()
+        finally:
+            with self._stats_lock:
+                self.queue_depth -= 1
+            self._slots.release()
+
+        with self._stats_lock:
+            self.tasks += 1
+            self.wait_time += max(started - submitted, 0)
+        self._log_stats()
+        return result
+
+    def stats(self):
+        """Get a dictionary with the current metrics."""
+
+        with self._stats_lock:
+            return {
+                'queue_depth': self.queue_depth,
+                'max_queue_depth': self.max_queue_depth,
+                'tasks': self.tasks,
+                'wait_time': self.wait_time,
+                'avg_wait_time': self.wait_time / self.tasks if self.tasks else 0.0,
+            }
+
+    def _log_stats(self):
+        now = time.time()
+        with self._stats_lock:
+            if not self.stats_interval or now - self._stats_logged < self.stats_interval:
+                return
+            self._stats_logged = now
+
+        stats = self.stats()
+        stats['pid'] = os.getpid()
+        log.info('Hashing executor (pid %(pid)s): %(tasks)s tasks, queue depth %(queue_depth)s '
+                 '(max. %(max_queue_depth)s), average wait time %(avg_wait_time).3f seconds.',
+                 stats)
+
+    def close(self):
+        with self._pool_lock:
+            if self._pool is not None and self._pid == os.getpid():
+                self._pool.terminate()
+                self._pool.join()
+            self._pool = None
+
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_executor():
+    """Get the executor configured by :setting:`HASHING_EXECUTOR` or ``None`` if not configured."""
+
+    global _executor
+
+    config = getattr(settings, 'HASHING_EXECUTOR', None)
+    if not config:
+        return None
+
+    with _executor_lock:
+        if _executor is None:
+            _executor = HashingExecutor(processes=config.get('PROCESSES'),
+                                        queue_size=config.get('QUEUE_SIZE'),
+                                        stats_interval=config.get('STATS_INTERVAL', 60))
+        return _executor
+
+
+def make_password(password):
+    executor = get_executor()
+    if executor is None or password is None:
+        return hashers.make_password(password)
+    return executor.submit(_make_password, password)
+
+
+class HashUpgrade(object):
+    """A setter for :py:func:`check_password` that upgrades an outdated hash.
+
+    Hashing the password and writing the new hash are two separate steps, so that the
+    :py:class:`RehashQueue` can hash passwords first and then write a whole batch at once.
+
+    :param write: A callable that receives the new hash and stores it. It should not overwrite the
+        hash if it was changed in the meantime.
+    """
+
+    def __init__(self, write):
+        self.write = write
+
+    def __call__(self, password):
+        self.write(make_password(password))
+
+
+class RehashQueue(object):
+    """Upgrade outdated password hashes in a background thread.
+
+    Upgrades are hashed at most ``rate`` per second and then written in batches of up to
+    ``batch_size`` within a single backend transaction. If more than ``queue_size`` upgrades are
+    pending, further upgrades are dropped. They are queued again the next time the user logs in.
+    """
+
+    def __init__(self, batch_size=None, rate=None, queue_size=None):
+        self.batch_size = batch_size or 20
+        self.rate = rate or 10
+        self.queue = queue.Queue(queue_size or 1000)
+        self.upgraded = 0
+        self.dropped = 0
+
+        self._thread = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def put(self, upgrade, password):
+        with self._lock:
+            if self._thread is None or self._pid != os.getpid():
+                self._thread = threading.Thread(target=self._run, name='RehashQueue')
+                self._thread.daemon = True
+                self._thread.start()
+                self._pid = os.getpid()
+
+        try:
+            self.queue.put_nowait((upgrade, password))
+        except queue.Full:
+            self.dropped += 1
+
+    def _run(self):
+        while True:
+            batch = [self.queue.get()]
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+
+            try:
+                self.process(batch)
+            except Exception:
+                log.exception('Could not upgrade password hashes.')
+
+    def process(self, batch):
+        """Hash the passwords and write the new hashes of a batch of upgrades."""
+
+        from backends import backend
+
+        hashes = []
+        for upgrade, password in batch:
+            started = time.time()
+            hashes.append((upgrade, make_password(password)))
+
+            delay = 1.0 / self.rate - (time.time() - started)
+            if delay > 0:
+                time.sleep(delay)
+
+        with backend.transaction():
+            for upgrade, encoded in hashes:
+                upgrade.write(encoded)
+                self.upgraded += 1
+
+
+_rehash_queue = None
+
+
+def get_rehash_queue():
+    """Get the queue configured by :setting:`DEFERRED_REHASH` or ``None`` if not configured."""
+
+    global _rehash_queue
+
+    config = getattr(settings, 'DEFERRED_REHASH', None)
+    if not config:
+        return None
+
+    with _executor_lock:
+        if _rehash_queue is None:
+            _rehash_queue = RehashQueue(batch_size=config.get('BATCH_SIZE'),
+                                        rate=config.get('RATE'),
+                                        queue_size=config.get('QUEUE_SIZE'))
+        return _rehash_queue
+
+
+def check_password(password, encoded, setter=None):
+    if isinstance(setter, HashUpgrade):
+        rehash_queue = get_rehash_queue()
+        if rehash_queue is not None:
+            upgrade = setter
+
+            def setter(password):
+                rehash_queue.put(upgrade, password)
+
+    executor = get_executor()
+    if executor is None:
+        return hashers.check_password(password, encoded, setter)
+    if password is None or not hashers.is_password_usable(encoded):
+        return False
+
+    correct, must_update = executor.submit(_check_password, password, encoded)
+    if setter and correct and must_update:
+        setter(password)
+    return correct
@@ -0,0 +1,119 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of RestAuth (https://restauth.net).
+#
+# RestAuth is free software: you can redistribute it and/or modify it under the terms of the GNU
+# General Public License as published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# RestAuth is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without
+# even the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with RestAuth.  If not,
+# see <http://www.gnu.org/licenses/>.
+
+from __future__ import unicode_literals
+
+import math
+import multiprocessing
+import time
+
+from optparse import make_option
+
+from django.conf import settings
+from django.contrib.auth.hashers import PBKDF2PasswordHasher
+from django.core.management.base import BaseCommand
+from django.core.management.base import CommandError
+from django.utils.module_loading import import_string
+
+from Services.models import get_service_hasher
+from common.hashers import HmacSha256Hasher
+
+PASSWORD = 'benchmark-password'
+
+
+def percentile(timings, percent):
+    """Get the given percentile (nearest rank) of a sorted list of timings."""
+    index = int(math.ceil(percent * len(timings) / 100.0)) - 1
+    return timings[max(0, min(index, len(timings) - 1))]
+
+
+def measure(func, samples):
+    """Call ``func`` ``samples`` times and return the sorted durations in seconds."""
+    timings = []
+    for i in range(samples):
+        start = time.time()
+        func()
+        timings.append(time.time() - start)
+    return sorted(timings)
+
+
+class Command(BaseCommand):
+    help = "Benchmark all configured password hashers and recommend PBKDF2 iterations."
+
+    option_list = BaseCommand.option_list + (
+        make_option('--samples', type='int', default=20, metavar='N',
+                    help="Measure every hasher N times (default: %default)."),
+        make_option('--target', type='float', default=100.0, metavar='MS',
+                    help="Recommend PBKDF2 iterations for a verification latency of MS "
+                         "milliseconds (default: %default)."),
+        make_option('--hasher', action='append', dest='hashers', metavar='ALGORITHM',
+                    help="Only benchmark the hasher for ALGORITHM (e.g. \"drupal7\"). May be "
+                         "given multiple times."),
+    )
+
+    def benchmark(self, hasher, samples):
+        salt = hasher.salt()
+        encoded = hasher.encode(PASSWORD, salt)
+        encode = measure(lambda: hasher.encode(PASSWORD, salt), samples)
+        verify = measure(lambda: hasher.verify(PASSWORD, encoded), samples)
+        return encode, verify
+
+    def handle(self, *args, **options):
+        samples = options['samples']
+        target = options['target'] / 1000.0
+        if samples < 1:
+            raise CommandError('--samples must be at least 1.')
+        cores = multiprocessing.cpu_count()
+
+        self.stdout.write('%-30s %10s %10s %10s %10s %12s %12s' % (
+            'hasher', 'enc. p50', 'enc. p99', 'ver. p50', 'ver. p99', 'ver./s', 'ver./s (%s CPUs)'
+            % cores))
+        for path in settings.PASSWORD_HASHERS:
+            try:
+                hasher = import_string(path)()
+                if options['hashers'] and hasher.algorithm not in options['hashers']:
+                    continue
+                encode, verify = self.benchmark(hasher, samples)
+            except Exception as e:
+                self.stdout.write('%-30s skipped: %s' % (path.rsplit('.', 1)[-1], e))
+                continue
+
+            # estimate based on the median, assuming the hasher is CPU-bound
+            per_second = 1 / max(percentile(verify, 50), 1e-9)
+            self.stdout.write('%-30s %8.2fms %8.2fms %8.2fms %8.2fms %12d %12d' % (
+                hasher.algorithm,
+                percentile(encode, 50) * 1000, percentile(encode, 99) * 1000,
+                percentile(verify, 50) * 1000, percentile(verify, 99) * 1000,
+                per_second, per_second * cores))
+
+        # PBKDF2 scales linearly with the number of iterations
+        hasher = PBKDF2PasswordHasher()
+        verify = self.benchmark(hasher, samples)[1]
+        per_iteration = percentile(verify, 50) / hasher.iterations
+        iterations = int(target / per_iteration // 1000 * 1000) or 1000
+        self.stdout.write('')
+        self.stdout.write('Recommended PBKDF2 iterations for %.0fms per verification: %s '
+                          '(currently %s).' % (target * 1000, iterations, hasher.iterations))
+
+        # Service passwords are random, so they don't need a slow hasher
+        service_hasher = get_service_hasher()
+        service_time = percentile(self.benchmark(service_hasher, samples)[1], 50)
+        self.stdout.write('Service passwords (%s): %.3fms per verification.' % (
+            service_hasher.algorithm, service_time * 1000))
+        if service_hasher.algorithm != HmacSha256Hasher.algorithm:
+            hmac_time = percentile(self.benchmark(HmacSha256Hasher(), samples)[1], 50)
+            self.stdout.write(
+                'common.hashers.HmacSha256Hasher would save %.3fms per uncached service request.'
+                % ((service_time - hmac_time) * 1000))
@@ -0,0 +1,59 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of RestAuth (https://restauth.net).
+#
+# RestAuth is free software: you can redistribute it and/or modify it under the terms of the GNU
+# General Public License as published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# RestAuth is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without
+# even the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with RestAuth.  If not,
+# see <http://www.gnu.org/licenses/>.
+
+from __future__ import unicode_literals
+
+from collections import defaultdict
+
+from django.contrib.auth.hashers import get_hasher
+from django.contrib.auth.hashers import identify_hasher
+from django.contrib.auth.hashers import is_password_usable
+from django.core.management.base import CommandError
+from django.core.management.base import NoArgsCommand
+
+from backends import backend
+
+
+class Command(NoArgsCommand):
+    help = "Report how many password hashes still use outdated algorithms or parameters."
+
+    def handle_noargs(self, **options):
+        preferred = get_hasher()
+        algorithms = defaultdict(int)
+        total = outdated = 0
+
+        try:
+            for encoded in backend.password_hashes():
+                if not is_password_usable(encoded):
+                    continue
+
+                total += 1
+                try:
+                    hasher = identify_hasher(encoded)
+                except ValueError:
+                    algorithms['unknown'] += 1
+                    outdated += 1
+                    continue
+
+                algorithms[hasher.algorithm] += 1
+                if hasher.algorithm != preferred.algorithm or preferred.must_update(encoded):
+                    outdated += 1
+        except NotImplementedError:
+            raise CommandError('The backend cannot list password hashes.')
+
+        for algorithm, count in sorted(algorithms.items()):
+            self.stdout.write('%s: %s' % (algorithm, count))
+        self.stdout.write('%s of %s hashes are outdated (preferred algorithm: %s).'
+                          % (outdated, total, preferred.algorithm))
@@ -0,0 +1,32 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of RestAuth (https://restauth.net).
+#
+# RestAuth is free software: you can redistribute it and/or modify it under the terms of the GNU
+# General Public License as published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# RestAuth is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without
+# even the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with RestAuth. If not,
+# see <http://www.gnu.org/licenses/>.
+
+from __future__ import unicode_literals
+
+from django.core.management.base import CommandError
+from django.core.management.base import NoArgsCommand
+
+from backends import backend
+from backends.redis import RedisBackend
+
+
+class Command(NoArgsCommand):
+    help = "Rebuild the secondary indexes used by the Redis backend."
+
+    def handle_noargs(self, **options):
+        if not isinstance(backend, RedisBackend):
+            raise CommandError('This command only works with the Redis backend.')
+        backend.rebuild_indexes()
+        self.stdout.write('Rebuilt indexes.')
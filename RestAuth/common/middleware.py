@@ -28,6 +28,7 @@ from django.http import HttpResponse
 
 from RestAuthCommon.error import RestAuthException
 
+from common import routers
 from common.errors import GroupNotFound
 from common.errors import PropertyNotFound
 from common.errors import UserNotFound
@@ -73,3 +74,14 @@ class RestAuthMiddleware:
             return HttpResponse(' '.join(ex.args), status=ex.response_code)
         else:  # pragma: no cover
             log.critical(traceback.format_exc())
+
+
+class ReplicaRouterMiddleware(object):
+    """Tell :py:class:`~common.routers.ReplicaRouter` which request is currently handled."""
+
+    def process_request(self, request):
+        routers.set_request(request)
+
+    def process_response(self, request, response):
+        routers.set_request(None)
+        return response
@@ -0,0 +1,127 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of RestAuth (https://restauth.net).
+#
+# RestAuth is free software: you can redistribute it and/or modify it under the terms of the GNU
+# General Public License as published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# RestAuth is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without
+# even the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with RestAuth.  If not,
+# see <http://www.gnu.org/licenses/>.
+
+"""Parse IP networks and look up addresses in a set of networks."""
+
+from __future__ import unicode_literals
+
+import binascii
+import socket
+
+from django.utils import six
+from django.utils.ipv6 import clean_ipv6_address
+
+_FAMILIES = {
+    4: (socket.AF_INET, 32),
+    6: (socket.AF_INET6, 128),
+}
+
+
+def parse_address(address):
+    """Parse an IPv4 or IPv6 address.
+
+    :return: A tuple of the IP version and the address as integer.
+    :raises ValueError: If the address is not a valid IP address.
+    """
+    for version, (family, bits) in six.iteritems(_FAMILIES):
+        try:
+            packed = socket.inet_pton(family, address)
+        except (socket.error, ValueError, UnicodeError):
+            continue
+        return version, int(binascii.hexlify(packed), 16)
+    raise ValueError('%s: Not a valid IPv4 or IPv6 address.' % address)
+
+
+def parse_network(network):
+    """Parse an IPv4 or IPv6 network in CIDR notation, e.g. ``192.168.0.0/24``.
+
+    A plain address is treated as network with the maximum prefix length.
+
+    :return: A tuple of the IP version, the network address as integer and the prefix length.
+    :raises ValueError: If the network is not valid or has host bits set.
+    """
+    address, sep, prefixlen = network.partition('/')
+    version, value = parse_address(address)
+    bits = _FAMILIES[version][1]
+
+    if sep:
+        if not prefixlen.isdigit() or int(prefixlen) > bits:
+            raise ValueError('%s: Invalid prefix length.' % network)
+        prefixlen = int(prefixlen)
+    else:
+        prefixlen = bits
+
+    if value & ~_mask(bits, prefixlen):
+        raise ValueError('%s: Network has host bits set.' % network)
+    return version, value, prefixlen
+
+
+def normalize_network(network):
+    """Get the canonical string representation of a network.
+
+    Single addresses are returned without a prefix length, so they compare equal to addresses
+    stored by earlier versions of RestAuth.
+
+    :raises ValueError: If the network is not valid.
+    """
+    version, value, prefixlen = parse_network(network)
+    address = network.partition('/')[0]
+    if version == 4:
+        address = socket.inet_ntop(socket.AF_INET, socket.inet_pton(socket.AF_INET, address))
+    else:
+        address = clean_ipv6_address(address)
+
+    if prefixlen == _FAMILIES[version][1]:
+        return address
+    return '%s/%s' % (address, prefixlen)
+
+
+def _mask(bits, prefixlen):
+    return ((1 << prefixlen) - 1) << (bits - prefixlen)
+
+
+class PrefixIndex(object):
+    """Map IP networks to values and find the values of all networks containing an address.
+
+    Networks are stored in one dictionary per IP version and prefix length. A lookup masks the
+    address once for every prefix length in use, so it costs a handful of dictionary lookups no
+    matter how many networks there are.
+    """
+
+    def __init__(self):
+        self._networks = {}  # (version, prefixlen) -> {network: set(values)}
+
+    def add(self, network, value):
+        """Add ``value`` for the given network (see :py:func:`parse_network`)."""
+        version, address, prefixlen = parse_network(network)
+        networks = self._networks.setdefault((version, prefixlen), {})
+        networks.setdefault(address, set()).add(value)
+
+    def lookup(self, address):
+        """Get the values of all networks containing ``address``.
+
+        Invalid addresses are not contained in any network.
+        """
+        try:
+            version, address = parse_address(address)
+        except ValueError:
+            return set()
+
+        bits = _FAMILIES[version][1]
+        values = set()
+        for (net_version, prefixlen), networks in six.iteritems(self._networks):
+            if net_version == version:
+                values.update(networks.get(address & _mask(bits, prefixlen), ()))
+        return values
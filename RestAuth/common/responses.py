@@ -15,7 +15,11 @@
 
 from __future__ import unicode_literals
 
+from itertools import chain
+from itertools import islice
+
 from django.http import HttpResponse
+from django.http import StreamingHttpResponse
 
 from common.types import get_response_type
 from common.content_handlers import get_handler
@@ -26,10 +30,47 @@ class HttpRestAuthResponse(HttpResponse):
         mime_type = get_response_type(request)
         handler = get_handler(mime_type)
         body = handler.marshal(response_object)
+        self.response_object = response_object
 
         HttpResponse.__init__(self, body, mime_type, status, mime_type)
 
 
+class HttpRestAuthStreamingResponse(StreamingHttpResponse):
+    """Send a list while it is marshalled, for lists too large to build in memory.
+
+    JSON lists are marshalled in chunks of ``chunk_size`` elements. Other formats can't be
+    marshalled incrementally, so the whole list is marshalled at once. The first chunk is
+    marshalled right away, so errors raised by the iterable (e.g. if a group doesn't exist) are
+    still raised before the response is sent.
+
+    :param iterable: The elements of the list.
+    :param chunk_size: The number of elements marshalled at once.
+    """
+
+    def __init__(self, request, iterable, status=200, chunk_size=1000):
+        mime_type = get_response_type(request)
+        handler = get_handler(mime_type)
+
+        if handler.mime == 'application/json':
+            chunks = self._marshal_json(handler, iter(iterable), chunk_size)
+            content = chain([next(chunks)], chunks)  # marshal the first chunk right away
+        else:
+            content = [handler.marshal_list(list(iterable))]
+
+        StreamingHttpResponse.__init__(self, content, mime_type, status, mime_type)
+
+    def _marshal_json(self, handler, iterator, chunk_size):
+        # marshal_list() returns "[...]", we strip the brackets and join the chunks with commas
+        chunk = handler.marshal_list(list(islice(iterator, chunk_size)))
+        yield chunk[:-1]
+
+        chunk = list(islice(iterator, chunk_size))
+        while chunk:
+            yield b',' + handler.marshal_list(chunk)[1:-1]
+            chunk = list(islice(iterator, chunk_size))
+        yield b']'
+
+
 class HttpResponseNoContent(HttpResponse):
     status_code = 204
 
@@ -15,9 +15,78 @@
 
 from __future__ import unicode_literals
 
+import hashlib
+import logging
 import random
+import threading
+import time
 
 from django.conf import settings
+from django.core.cache import caches
+from django.db import connections
+
+log = logging.getLogger(__name__)
+_local = threading.local()
+
+
+def set_request(request):
+    """Set the request currently handled by this thread, see :py:class:`ReplicaRouter`."""
+    _local.request = request
+
+
+def _pin_keys(request):
+    # Keys identifying the resource of the current request: the collection of users or groups and,
+    # if the path names one, the user or group. Creating a user or group pins the collection,
+    # since the new name is not part of the path.
+    service = getattr(request, 'user', None)
+    if service is None or not service.is_authenticated():
+        return []
+
+    path = request.path.strip('/').split('/')
+    if path[0] not in ('users', 'groups'):
+        return []
+
+    keys = [(service.username, path[0], '')]
+    if len(path) > 1:
+        keys.append((service.username, path[0], path[1]))
+
+    # names may contain characters that are not valid in (e.g.) memcached keys
+    return ['restauth-pin-%s' % hashlib.sha1('/'.join(key).encode('utf-8')).hexdigest()
+            for key in keys]
+
+
+def replica_lag(connection):
+    """Get the replication lag of a database in seconds.
+
+    Returns ``0`` for databases that are not a replica or where the lag can not be determined and
+    ``None`` if replication is broken.
+
+    A PostgreSQL replica that replayed everything it received has no lag, even if the primary had
+    no writes for a while. Otherwise the lag is the time since the last replayed transaction, or
+    ``None`` if no transaction was replayed yet.
+    """
+    with connection.cursor() as cursor:
+        if connection.vendor == 'postgresql':
+            # the functions were renamed in PostgreSQL 10
+            if connection.pg_version >= 100000:
+                position = 'pg_last_wal_%s_lsn()'
+            else:
+                position = 'pg_last_xlog_%s_location()'
+            cursor.execute("SELECT CASE WHEN NOT pg_is_in_recovery() THEN 0 "
+                           "WHEN %s = %s THEN 0 "
+                           "ELSE EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()) "
+                           "END" % (position % 'receive', position % 'replay'))
+            return cursor.fetchone()[0]
+        elif connection.vendor == 'mysql':
+            cursor.execute("SHOW SLAVE STATUS")
+            row = cursor.fetchone()
+            if row is None:
+                return 0
+            columns = [c[0] for c in cursor.description]
+            return row[columns.index('Seconds_Behind_Master')]
+        else:
+            cursor.execute("SELECT 1")
+            return 0
 
 
 class MasterSlave(object):
@@ -58,3 +127,110 @@ class MultipleMasterSlave(object):
         databases = settings.DATABASES.keys()
         choices = [db for db in databases if db.startswith('master')]
         return random.choice(choices)
+
+
+class ReplicaRouter(object):
+    """This router sends writes to a single primary and spreads reads over healthy replicas.
+
+    Every database in ``DATABASES`` (including the primary) receives read operations. Databases
+    are chosen at random, weighted by the inverse of their measured latency. Every
+    ``CHECK_INTERVAL`` seconds, the router measures the latency and replication lag of a database
+    (MySQL and PostgreSQL only) with a single query. Databases that fail this check or lag more
+    than ``MAX_LAG`` seconds receive no reads until the next check succeeds. If no replica is
+    healthy, all reads go to the primary.
+
+    If a service writes to a user or group, reads of the same service for the same user or group
+    are sent to the primary for ``PIN_WINDOW`` seconds, so the service always reads its own writes.
+    This requires the :py:class:`~common.middleware.ReplicaRouterMiddleware`. Pins are stored in
+    the cache named by ``PIN_CACHE``, so they apply to all processes sharing that cache.
+
+    The router is configured with :setting:`REPLICA_ROUTER`.
+    """
+
+    def __init__(self):
+        config = getattr(settings, 'REPLICA_ROUTER', None) or {}
+        self.primary = config.get('PRIMARY', 'default')
+        self.max_lag = config.get('MAX_LAG', 10)
+        self.interval = config.get('CHECK_INTERVAL', 10)
+        self.pin_window = config.get('PIN_WINDOW', 5)
+        self.pinned = caches[config.get('PIN_CACHE', 'default')]
+
+        # alias -> [time of the last check, latency or None if unhealthy]
+        self.state = dict((alias, [0, None]) for alias in settings.DATABASES)
+        self.lock = threading.Lock()
+
+    def check(self, alias):
+        """Measure latency and replication lag of the given database."""
+        start = time.time()
+        try:
+            lag = replica_lag(connections[alias])
+        except Exception as e:
+            log.warning('%s: Health check failed: %s', alias, e)
+            return None
+
+        latency = max(time.time() - start, 0.001)
+        if alias != self.primary and (lag is None or lag > self.max_lag):
+            log.warning('%s: Replication lag is %s seconds', alias, lag)
+            return None
+        return latency
+
+    def weights(self):
+        """Get a list of ``(alias, weight)`` tuples of all healthy databases."""
+        now = time.time()
+        due = []
+        with self.lock:
+            for alias, state in self.state.items():
+                if state[0] + self.interval <= now:
+                    state[0] = now  # other threads don't check this database at the same time
+                    due.append(alias)
+
+        for alias in due:
+            latency = self.check(alias)
+            with self.lock:
+                state = self.state[alias]
+                if latency is not None and state[1] is not None:
+                    latency = 0.7 * state[1] + 0.3 * latency  # smooth out outliers
+                state[1] = latency
+
+        with self.lock:
+            return [(alias, 1 / state[1]) for alias, state in self.state.items()
+                    if state[1] is not None]
+
+    def is_pinned(self):
+        request = getattr(_local, 'request', None)
+        if request is None:
+            return False
+
+        # The pin is only looked up once per request, db_for_write() updates the cached result.
+        pinned = getattr(request, '_replica_pinned', None)
+        if pinned is None:
+            keys = _pin_keys(request)
+            if not keys:  # the service is not authenticated yet
+                return False
+            pinned = request._replica_pinned = bool(self.pinned.get_many(keys))
+        return pinned
+
+    def db_for_read(self, model, **hints):
+        if self.is_pinned():
+            return self.primary
+
+        weights = self.weights()
+        total = sum(weight for alias, weight in weights)
+        choice = random.uniform(0, total)
+        for alias, weight in weights:
+            choice -= weight
+            if choice <= 0:
+                return alias
+        return self.primary
+
+    def db_for_write(self, model, **hints):
+        request = getattr(_local, 'request', None)
+        if request is not None:
+            keys = _pin_keys(request)
+            if keys:  # pin the named user or group, or the collection if none is named
+                self.pinned.set(keys[-1], True, self.pin_window)
+                request._replica_pinned = True
+        return self.primary
+
+    def allow_relation(self, obj1, obj2, **hints):
+        return True
@@ -34,6 +34,7 @@ from django.utils.six import StringIO
 from RestAuthCommon import handlers
 
 from Groups.models import group_permissions
+from Services.models import invalidate_service_cache
 from Services.models import service_create
 from Users.models import prop_permissions
 from Users.models import user_permissions
@@ -118,6 +119,7 @@ class RestAuthTestBase(object):
             self.service.user_permissions.add(p)
 
         cache.clear()
+        invalidate_service_cache()
 
     def get(self, url, data=None, **kwargs):
         if data is None:
@@ -140,10 +142,24 @@ class RestAuthTestBase(object):
         return self.c.delete(url, **kwargs)
 
     def parse(self, response, typ):
-        body = response.content.decode('utf-8')
+        if response.streaming:
+            body = b''.join(response.streaming_content).decode('utf-8')
+        else:
+            body = response.content.decode('utf-8')
         func = getattr(self.handler, 'unmarshal_%s' % typ)
         return func(body)
 
+    def get_pages(self, url, limit):
+        """Get all pages of a paginated list by following the ``Link`` headers."""
+        names = []
+        resp = self.get(url, {'limit': limit})
+        while True:
+            self.assertEqual(resp.status_code, 200)
+            names += self.parse(resp, 'list')
+            if not resp.has_header('Link'):
+                return names
+            resp = self.c.get(re.match('<(.*)>; rel="next"', resp['Link']).group(1))
+
     def create_user(self, username, password=None):
         backend.create_user(user=username, password=password, properties={
             'date joined': datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
@@ -16,12 +16,18 @@
 from __future__ import unicode_literals
 
 import inspect
+import logging
 import os
 import re
 
 from django.conf import settings
 from django.contrib.auth.hashers import load_hashers
+from django.contrib.auth.hashers import make_password
 from django.core.exceptions import ImproperlyConfigured
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import connections
+from django.test import SimpleTestCase
 from django.test.client import Client
 from django.test.client import RequestFactory
 from django.test.utils import override_settings
@@ -34,16 +40,42 @@ from django.utils.six.moves import http_client
 from RestAuthCommon import handlers
 
 from Services.models import Service
+from Services.models import invalidate_service_cache
 from Users.validators import Validator
 from Users.validators import get_validators
 from Users.validators import load_username_validators
 from Users.validators import validate_username
 from backends import backend
 from backends.base import BackendBase
+from backends.composite import CompositeBackend
+from backends.ldap import LDAPConnectionPool
+from backends.memory import MemoryBackend
+from backends.mixins import PasswordCacheMixin
+from backends.sharded import HashRing
+from backends.sharded import ShardedBackend
+from common.cache import LRUCache
+from common import executor
+from common.executor import HashUpgrade
+from common.executor import HashingExecutor
+from common.executor import RehashQueue
+from common.executor import _check_password
+from common.executor import _make_password
 from common.content_handlers import get_handler
 from common.content_handlers import load_handlers
+from common.errors import Throttled
+from common.errors import UserExists
+from common.errors import UserNotFound
 from common.errors import UsernameInvalid
+from common import routers
+from common.middleware import ReplicaRouterMiddleware
 from common.middleware import RestAuthMiddleware
+from common.network import PrefixIndex
+from common.network import normalize_network
+from common.responses import HttpRestAuthStreamingResponse
+from common.routers import ReplicaRouter
+from common.routers import replica_lag
+from common.throttle import MemoryThrottle
+from common.throttle import RedisThrottle
 from common.testdata import RestAuthTest
 from common.testdata import RestAuthTransactionTest
 from common.testdata import CliMixin
@@ -52,6 +84,8 @@ from common.testdata import groupname1
 from common.testdata import groupname2
 from common.testdata import groupname3
 from common.testdata import groupname4
+from common.testdata import password1
+from common.testdata import password2
 from common.testdata import propkey1
 from common.testdata import propkey2
 from common.testdata import propval1
@@ -102,6 +136,94 @@ class RestAuthMiddlewareTests(TestCase):
         self.assertEqual(resp.status_code, http_client.UNSUPPORTED_MEDIA_TYPE)
 
 
+class ReplicaRouterTests(TestCase):
+    def setUp(self):
+        self.factory = RequestFactory()
+        self.service = Service(username='example.com')
+        self.middleware = ReplicaRouterMiddleware()
+        self.addCleanup(routers.set_request, None)
+
+        # the primary is unhealthy, so reads go to the replica unless they are pinned
+        self.router = ReplicaRouter()
+        self.router.state = {'default': [0, None], 'replica': [0, None]}
+        self.latencies = {'default': None, 'replica': 0.01}
+        self.router.check = lambda alias: self.latencies[alias]
+        self.router.pinned.clear()
+
+    def request(self, method, path, service=None):
+        request = getattr(self.factory, method)(path)
+        request.user = service or self.service
+        self.middleware.process_request(request)
+
+    def test_weights(self):
+        self.assertEqual(self.router.weights(), [('replica', 100)])
+        self.assertEqual(self.router.db_for_read(Service), 'replica')
+
+        # databases are only checked every CHECK_INTERVAL seconds
+        self.latencies = {'default': 0.02, 'replica': None}
+        self.assertEqual(self.router.weights(), [('replica', 100)])
+
+        self.router.state['default'][0] = self.router.state['replica'][0] = 0
+        self.assertEqual(self.router.weights(), [('default', 50)])
+        self.assertEqual(self.router.db_for_read(Service), 'default')
+
+        # no database is healthy
+        self.latencies['default'] = None
+        self.router.state['default'][0] = 0
+        self.assertEqual(self.router.db_for_read(Service), 'default')
+
+    def test_pinning(self):
+        self.request('get', '/users/%s/' % username1)
+        self.assertEqual(self.router.db_for_read(Service), 'replica')
+        self.assertEqual(self.router.db_for_write(Service), 'default')
+        self.assertEqual(self.router.db_for_read(Service), 'default')
+
+        self.request('get', '/users/%s/' % username2)
+        self.assertEqual(self.router.db_for_read(Service), 'replica')
+        self.request('get', '/groups/%s/' % username1)
+        self.assertEqual(self.router.db_for_read(Service), 'replica')
+
+        # other services are not pinned
+        self.request('get', '/users/%s/' % username1, service=Service(username='example.net'))
+        self.assertEqual(self.router.db_for_read(Service), 'replica')
+
+        # creating a user pins all users, since the path doesn't name the user
+        self.request('post', '/users/')
+        self.router.db_for_write(Service)
+        self.request('get', '/users/%s/' % username2)
+        self.assertEqual(self.router.db_for_read(Service), 'default')
+
+        # pins are visible to routers in other processes sharing the cache
+        other = ReplicaRouter()
+        other.state = self.router.state
+        self.request('get', '/groups/%s/' % username1)
+        self.assertEqual(other.db_for_read(Service), 'replica')
+        self.request('post', '/groups/%s/' % username1)
+        self.router.db_for_write(Service)
+        self.request('get', '/groups/%s/' % username1)
+        self.assertEqual(other.db_for_read(Service), 'default')
+
+    def test_pin_lookup(self):
+        lookups = []
+        get_many = self.router.pinned.get_many
+        self.router.pinned.get_many = lambda keys: lookups.append(keys) or get_many(keys)
+        self.addCleanup(delattr, self.router.pinned, 'get_many')
+
+        # the pin is looked up only once per request
+        self.request('get', '/users/%s/' % username1)
+        self.assertEqual(self.router.db_for_read(Service), 'replica')
+        self.assertEqual(self.router.db_for_read(Service), 'replica')
+        self.assertEqual(len(lookups), 1)
+
+        # ... and updated by writes
+        self.router.db_for_write(Service)
+        self.assertEqual(self.router.db_for_read(Service), 'default')
+        self.assertEqual(len(lookups), 1)
+
+    def test_replica_lag(self):
+        self.assertEqual(replica_lag(connections['default']), 0)
+
+
 @skipUnless(settings.DATA_BACKEND['BACKEND'] == 'backends.django.DjangoBackend', '')
 class ContentTypeTests(RestAuthTest):
     def setUp(self):
@@ -155,6 +277,682 @@ class BackendInterfaceTest(RestAuthTest):
                 "%s has a different signature" % name
             )
 
+
+class BatchTests(RestAuthTransactionTest):
+    def setUp(self):
+        super(BatchTests, self).setUp()
+        self.create_user(username1, password1)
+        backend.set_property(user=username1, key=propkey1, value=propval1)
+        backend.create_group(group=groupname1, service=self.service, users=[username1])
+
+    def batch(self, operations):
+        resp = self.post('/batch/', {'operations': operations})
+        self.assertEqual(resp.status_code, http_client.OK)
+        return self.parse(resp, 'list')
+
+    def test_batch(self):
+        results = self.batch([
+            {'method': 'POST', 'path': '/users/%s/' % username1, 'body': {'password': password1}},
+            {'method': 'POST', 'path': '/users/%s/' % username1, 'body': {'password': password2}},
+            {'method': 'GET', 'path': '/users/%s/props/%s/' % (username1, propkey1)},
+            {'method': 'GET', 'path': '/groups/%s/users/%s/' % (groupname1, username1)},
+            {'method': 'GET', 'path': '/groups/%s/users/%s/' % (groupname2, username1)},
+            {'method': 'GET', 'path': '/users/?limit=10'},
+        ])
+
+        self.assertEqual([r['status'] for r in results], [204, 404, 200, 204, 404, 200])
+        self.assertEqual(results[1]['headers']['Resource-Type'], 'user')
+        self.assertEqual(results[2]['body'], {'value': propval1})
+        self.assertEqual(results[4]['headers']['Resource-Type'], 'group')
+        self.assertEqual(results[5]['body'], [username1])
+
+    def test_order(self):
+        results = self.batch([
+            {'method': 'GET', 'path': '/users/%s/' % username2},
+            {'method': 'POST', 'path': '/users/', 'body': {'user': username2}},
+            {'method': 'GET', 'path': '/users/%s/' % username2},
+            {'method': 'GET', 'path': '/users/'},
+        ])
+        self.assertEqual([r['status'] for r in results], [404, 201, 204, 200])
+        self.assertCountEqual(results[3]['body'], [username1, username2])
+
+    def test_unknown_path(self):
+        results = self.batch([
+            {'method': 'GET', 'path': '/foo/'},
+            {'method': 'POST', 'path': '/tokens/', 'body': {}},
+            {'method': 'POST', 'path': '/batch/', 'body': {'operations': []}},
+        ])
+        self.assertEqual([r['status'] for r in results], [404, 404, 404])
+
+    def test_permissions(self):
+        self.service.user_permissions.clear()
+        invalidate_service_cache()
+
+        results = self.batch([{'method': 'GET', 'path': '/users/'}])
+        self.assertEqual(results[0]['status'], http_client.FORBIDDEN)
+
+    def test_bad_request(self):
+        for operations in [['foo'], [{'method': 'PATCH', 'path': '/users/'}],
+                           [{'method': 'GET'}], [{'method': 'GET', 'path': '/users/'}] * 101]:
+            resp = self.post('/batch/', {'operations': operations})
+            self.assertEqual(resp.status_code, http_client.BAD_REQUEST)
+
+        # errors of single operations don't fail the batch
+        results = self.batch([{'method': 'POST', 'path': '/users/', 'body': {'foo': 'bar'}}])
+        self.assertEqual(results[0]['status'], http_client.BAD_REQUEST)
+
+    @skipUnless(settings.DATA_BACKEND['BACKEND'] != 'backends.django.DjangoBackend',
+                'threads do not share the in-memory test database')
+    def test_parallel(self):
+        operations = [{'method': 'GET', 'path': '/users/%s/props/%s/' % (username1, propkey1)},
+                      {'method': 'GET', 'path': '/users/%s/props/%s/' % (username1, propkey2)}]
+        with self.settings(BATCH={'MAX_OPERATIONS': 100, 'THREADS': 4}):
+            results = self.batch(operations * 5)
+        self.assertEqual([r['status'] for r in results], [200, 404] * 5)
+
+
+class PaginationTests(TestCase):
+    def setUp(self):
+        self.backend = MemoryBackend()
+        for user in ['c', 'a', 'd', 'b']:
+            self.backend.create_user(user)
+
+    def test_page(self):
+        self.assertEqual(self.backend.page_users(2), (['a', 'b'], 'b'))
+        self.assertEqual(self.backend.page_users(2, after='b'), (['c', 'd'], None))
+        self.assertEqual(self.backend.page_users(3, after='a'), (['b', 'c', 'd'], None))
+        self.assertEqual(self.backend.page_users(10), (['a', 'b', 'c', 'd'], None))
+        self.assertEqual(self.backend.page_users(2, after='d'), ([], None))
+
+    def test_streaming_response(self):
+        handler = handlers.JSONContentHandler()
+        request = RequestFactory().get('/users/', HTTP_ACCEPT=handler.mime)
+        for names in [[], ['a'], ['a', 'b'], ['a', 'b', 'c', 'd', 'e']]:
+            resp = HttpRestAuthStreamingResponse(request, iter(names), chunk_size=2)
+            body = b''.join(resp.streaming_content).decode('utf-8')
+            self.assertEqual(handler.unmarshal_list(body), names)
+
+
+class LRUCacheTests(TestCase):
+    def test_eviction(self):
+        cache = LRUCache(size=2, ttl=60)
+        cache.set('a', 1)
+        cache.set('b', 2)
+        self.assertEqual(cache.get('a'), 1)  # 'b' is now the least recently used entry
+
+        cache.set('c', 3)
+        self.assertEqual(len(cache), 2)
+        self.assertEqual(cache.get('a'), 1)
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(cache.get('c'), 3)
+
+    def test_ttl(self):
+        cache = LRUCache(size=2, ttl=-1)
+        cache.set('a', 1)
+        self.assertIsNone(cache.get('a'))
+        self.assertEqual(len(cache), 0)
+
+    def test_set_ttl(self):
+        cache = LRUCache(size=2, ttl=60)
+        cache.set('a', 1, ttl=-1)
+        cache.set('b', 2)
+        self.assertIsNone(cache.get('a'))
+        self.assertEqual(cache.get('b'), 2)
+
+    def test_delete(self):
+        cache = LRUCache(size=2, ttl=60)
+        cache.set('a', 1)
+        cache.delete('a')
+        cache.delete('b')
+        self.assertIsNone(cache.get('a'))
+
+
+class ThrottleTests(TestCase):
+    throttle_class = MemoryThrottle
+    kwargs = {}
+
+    def get_throttle(self, **kwargs):
+        kwargs.update(self.kwargs)
+        throttle = self.throttle_class(**kwargs)
+        self.addCleanup(throttle.clear)
+        return throttle
+
+    def test_throttle(self):
+        throttle = self.get_throttle(LIMIT=2, WINDOW=60)
+        throttle.check('a')
+        throttle.fail('a')
+        throttle.check('a')
+        throttle.fail('a')
+        self.assertRaises(Throttled, throttle.check, 'a')
+        throttle.check('b')
+
+    def test_window(self):
+        throttle = self.get_throttle(LIMIT=1, WINDOW=0)
+        throttle.fail('a')
+        throttle.check('a')
+
+
+class MemoryThrottleTests(ThrottleTests):
+    def test_size(self):
+        throttle = self.get_throttle(LIMIT=1, WINDOW=60, SIZE=2)
+        throttle.fail('a')
+        throttle.fail('b')
+        throttle.fail('a')  # 'b' is now the least recently failed key
+        throttle.fail('c')
+        self.assertRaises(Throttled, throttle.check, 'a')
+        throttle.check('b')
+        self.assertRaises(Throttled, throttle.check, 'c')
+
+
+@skipUnless(settings.DATA_BACKEND['BACKEND'] == 'backends.redis.RedisBackend', '')
+class RedisThrottleTests(ThrottleTests):
+    throttle_class = RedisThrottle
+
+    @property
+    def kwargs(self):
+        return {'HOST': settings.DATA_BACKEND.get('HOST', 'localhost'),
+                'PORT': settings.DATA_BACKEND.get('PORT', 6379),
+                'DB': settings.DATA_BACKEND.get('DB', 0)}
+
+
+class PrefixIndexTests(TestCase):
+    def test_normalize(self):
+        self.assertEqual(normalize_network('127.0.0.1'), '127.0.0.1')
+        self.assertEqual(normalize_network('127.0.0.1/32'), '127.0.0.1')
+        self.assertEqual(normalize_network('10.0.0.0/8'), '10.0.0.0/8')
+        self.assertEqual(normalize_network('2001:DB8:0::/48'), '2001:db8::/48')
+        self.assertEqual(normalize_network('0.0.0.0/0'), '0.0.0.0/0')
+
+        for network in ['10.0.0.1/8', '10.0.0.0/33', '10.0.0.0/-1', '10.0.0.0/', '::1/129',
+                        'foo', '1.2.3']:
+            self.assertRaises(ValueError, normalize_network, network)
+
+    def test_lookup(self):
+        index = PrefixIndex()
+        index.add('10.0.0.0/8', 'a')
+        index.add('10.1.0.0/16', 'b')
+        index.add('10.1.2.3', 'c')
+        index.add('::1', 'a')
+        index.add('2001:db8::/32', 'b')
+
+        self.assertEqual(index.lookup('10.1.2.3'), set(['a', 'b', 'c']))
+        self.assertEqual(index.lookup('10.1.2.4'), set(['a', 'b']))
+        self.assertEqual(index.lookup('10.2.0.1'), set(['a']))
+        self.assertEqual(index.lookup('11.0.0.1'), set())
+        self.assertEqual(index.lookup('::1'), set(['a']))
+        self.assertEqual(index.lookup('2001:db8:1::1'), set(['b']))
+        self.assertEqual(index.lookup('::2'), set())
+        self.assertEqual(index.lookup('foobar'), set())
+
+
+@override_settings(PASSWORD_HASHERS=('django.contrib.auth.hashers.PBKDF2PasswordHasher',
+                                     'common.hashers.Sha512Hasher',
+                                     'common.hashers.MediaWikiHasher',
+                                     'common.hashers.Drupal7Hasher',
+                                     'django.contrib.auth.hashers.MD5PasswordHasher'))
+class BenchmarkHashersTests(SimpleTestCase):
+    def test_benchmark(self):
+        stdout = six.StringIO()
+        call_command('benchmark_hashers', samples=2, target=50, stdout=stdout)
+        output = stdout.getvalue()
+
+        for algorithm in ['pbkdf2_sha256', 'sha512', 'mediawiki', 'drupal7']:
+            self.assertTrue(re.search('^%s +[0-9.]+ms' % algorithm, output, re.MULTILINE),
+                            '%s not benchmarked' % algorithm)
+        self.assertTrue(re.search('^Recommended PBKDF2 iterations for 50ms per verification: '
+                                  '[0-9]+', output, re.MULTILINE))
+        self.assertTrue(re.search('^Service passwords \\([a-z0-9_]+\\): [0-9.]+ms', output,
+                                  re.MULTILINE))
+
+    def test_hasher(self):
+        stdout = six.StringIO()
+        call_command('benchmark_hashers', samples=1, hashers=['drupal7'], stdout=stdout)
+        output = stdout.getvalue()
+
+        self.assertTrue(re.search('^drupal7 +[0-9.]+ms', output, re.MULTILINE))
+        self.assertFalse(re.search('^sha512 ', output, re.MULTILINE))
+
+    def test_percentile(self):
+        from common.management.commands.benchmark_hashers import percentile
+        timings = list(range(1, 101))
+        self.assertEqual(percentile(timings, 50), 50)
+        self.assertEqual(percentile(timings, 99), 99)
+        self.assertEqual(percentile([1], 99), 1)
+
+
+class HashingExecutorTests(TestCase):
+    def setUp(self):
+        self.executor = HashingExecutor(processes=1, queue_size=2)
+
+    def tearDown(self):
+        self.executor.close()
+
+    def test_hashing(self):
+        encoded = self.executor.submit(_make_password, password1)
+        self.assertEqual(self.executor.submit(_check_password, password1, encoded), (True, False))
+        self.assertEqual(self.executor.submit(_check_password, password2, encoded)[0], False)
+
+        stats = self.executor.stats()
+        self.assertEqual(stats['queue_depth'], 0)
+        self.assertEqual(stats['max_queue_depth'], 1)
+        self.assertEqual(stats['tasks'], 3)
+
+    def test_must_update(self):
+        encoded = make_password(password1, hasher='md5')
+        self.assertEqual(self.executor.submit(_check_password, password1, encoded), (True, True))
+
+    def test_log_stats(self):
+        logged = []
+
+        class Handler(logging.Handler):
+            def emit(self, record):
+                logged.append(record.getMessage())
+
+        handler = Handler()
+        level = executor.log.level
+        executor.log.addHandler(handler)
+        executor.log.setLevel(logging.INFO)
+        try:
+            self.executor.submit(_make_password, password1)
+            self.assertEqual(logged, [])  # interval not yet elapsed
+
+            self.executor.stats_interval = 0.001
+            self.executor._stats_logged -= 1
+            self.executor.submit(_make_password, password1)
+            self.assertEqual(len(logged), 1)
+            self.assertIn('2 tasks', logged[0])
+        finally:
+            executor.log.removeHandler(handler)
+            executor.log.setLevel(level)
+
+
+@override_settings(PASSWORD_HASHERS=('django.contrib.auth.hashers.PBKDF2PasswordHasher',
+                                     'django.contrib.auth.hashers.MD5PasswordHasher'))
+class RehashTests(RestAuthTransactionTest):
+    def setUp(self):
+        super(RehashTests, self).setUp()
+        backend.create_user(username1)
+        backend.set_password_hash(username1, 'django', make_password(password1, hasher='md5'))
+
+    def legacy_hashes(self):
+        stdout = six.StringIO()
+        call_command('legacy_hashes', stdout=stdout)
+        return stdout.getvalue()
+
+    def test_process(self):
+        hashes = []
+        queue = RehashQueue(rate=1000)
+        queue.process([(HashUpgrade(hashes.append), password1)])
+        self.assertEqual(queue.upgraded, 1)
+        self.assertTrue(executor.check_password(password1, hashes[0]))
+        self.assertTrue(hashes[0].startswith('pbkdf2_sha256$'))
+
+    def test_upgrade(self):
+        self.assertIn('1 of 1 hashes are outdated', self.legacy_hashes())
+        self.assertTrue(backend.check_password(username1, password1))
+        self.assertIn('0 of 1 hashes are outdated', self.legacy_hashes())
+        self.assertTrue(backend.check_password(username1, password1))
+
+    def test_legacy_hashes_not_implemented(self):
+        def password_hashes():
+            raise NotImplementedError
+        backend.password_hashes = password_hashes
+        self.addCleanup(delattr, backend, 'password_hashes')
+
+        self.assertRaises(CommandError, self.legacy_hashes)
+
+    def record_upgrades(self):
+        queued = []
+
+        class RecordingQueue(RehashQueue):
+            def put(self, upgrade, password):
+                queued.append((upgrade, password))
+
+        executor._rehash_queue = RecordingQueue(rate=1000)
+        self.addCleanup(setattr, executor, '_rehash_queue', None)
+        return queued
+
+    @override_settings(DEFERRED_REHASH={'RATE': 1000})
+    def test_deferred(self):
+        queued = self.record_upgrades()
+        self.assertTrue(backend.check_password(username1, password1))
+        self.assertEqual(len(queued), 1)
+        self.assertIn('1 of 1 hashes are outdated', self.legacy_hashes())
+
+        executor._rehash_queue.process(queued)
+        self.assertIn('0 of 1 hashes are outdated', self.legacy_hashes())
+        self.assertTrue(backend.check_password(username1, password1))
+
+    @override_settings(DEFERRED_REHASH={'RATE': 1000})
+    def test_password_changed(self):
+        queued = self.record_upgrades()
+        self.assertTrue(backend.check_password(username1, password1))
+        backend.set_password(username1, password2)
+
+        # the upgrade must not overwrite the new password
+        executor._rehash_queue.process(queued)
+        self.assertFalse(backend.check_password(username1, password1))
+        self.assertTrue(backend.check_password(username1, password2))
+
+
+@override_settings(PASSWORD_CACHE={'SIZE': 10, 'TTL': 60})
+class PasswordCacheTests(SimpleTestCase):
+    def setUp(self):
+        self.backend = type(str('CachedBackend'), (PasswordCacheMixin, MemoryBackend), {})()
+        self.backend.create_user(username1, password1)
+
+    def assertCached(self):
+        # replace the stored hash behind the backends back, the cache still knows the password
+        self.backend._users[username1]['password'] = None
+        self.assertTrue(self.backend.check_password(username1, password1))
+
+    def assertNotCached(self, user=username1, password=password1):
+        self.backend._users[user]['password'] = None
+        self.assertFalse(self.backend.check_password(user, password))
+
+    def test_hit(self):
+        self.assertTrue(self.backend.check_password(username1, password1))
+        self.assertCached()
+        self.assertFalse(self.backend.check_password(username1, password2))
+
+    def test_groups(self):
+        self.backend.create_group(group=groupname1, service=None)
+        self.assertTrue(self.backend.check_password(username1, password1))
+        self.assertFalse(self.backend.check_password(username1, password1,
+                                                     groups=[(groupname1, None)]))
+
+        self.backend.add_member(group=groupname1, service=None, user=username1)
+        self.assertTrue(self.backend.check_password(username1, password1,
+                                                    groups=[(groupname1, None)]))
+
+    def test_set_password(self):
+        self.assertTrue(self.backend.check_password(username1, password1))
+        self.backend.set_password(username1, password1)
+        self.assertNotCached()
+
+    def test_set_password_hash(self):
+        self.assertTrue(self.backend.check_password(username1, password1))
+        self.backend.set_password_hash(username1, 'django', 'md5$salt$%s' % ('0' * 32))
+        self.assertNotCached()
+
+    def test_rename_user(self):
+        self.assertTrue(self.backend.check_password(username1, password1))
+        self.backend.rename_user(username1, username2)
+        self.backend.create_user(username1)
+        self.assertNotCached()
+        self.assertNotCached(username2)
+
+    def test_remove_user(self):
+        self.assertTrue(self.backend.check_password(username1, password1))
+        self.backend.remove_user(username1)
+        self.backend.create_user(username1)
+        self.assertNotCached()
+
+
+class CompositeBackendTests(TestCase):
+    def setUp(self):
+        # users and properties share a backend, groups are stored separately
+        self.backend = CompositeBackend(
+            USERS={'BACKEND': 'backends.memory.MemoryBackend'},
+            PROPERTIES={'BACKEND': 'backends.memory.MemoryBackend'},
+            GROUPS={'BACKEND': 'backends.memory.NoGroupVisibilityBackend'},
+        )
+        self.backend.create_user(username1, password1, properties={propkey1: propval1},
+                                 groups=[(groupname1, None)])
+
+    def test_children(self):
+        self.assertEqual(len(self.backend.children), 2)
+        self.assertIs(self.backend.users, self.backend.properties)
+
+        users, groups = self.backend.users, self.backend.groups
+        self.assertTrue(users.check_password(username1, password1))
+        self.assertFalse(groups.check_password(username1, password1))
+        self.assertEqual(users.get_properties(username1), {propkey1: propval1})
+        self.assertFalse(users.group_exists(groupname1, None))
+        self.assertEqual(groups.list_groups(None, user=username1), [groupname1])
+
+    def test_check_password(self):
+        self.backend.create_group(groupname2, None)
+        self.assertTrue(self.backend.check_password(username1, password1))
+        self.assertTrue(self.backend.check_password(username1, password1,
+                                                    groups=[(groupname1, None)]))
+        self.assertFalse(self.backend.check_password(username1, password2,
+                                                     groups=[(groupname1, None)]))
+        self.assertFalse(self.backend.check_password(username1, password1,
+                                                     groups=[(groupname2, None)]))
+
+    def test_exists_cache(self):
+        # users that only exist in the groups backend do not exist
+        self.backend.groups.create_user(username2)
+        self.assertRaises(UserNotFound, self.backend.add_member, groupname1, None, username2)
+        self.assertRaises(UserNotFound, self.backend.list_groups, None, user=username2)
+
+        # existing users are cached, the USERS backend is not queried again
+        self.assertEqual(self.backend.get_properties(username1), {propkey1: propval1})
+        self.backend.users._users.pop(username1)
+        self.assertEqual(self.backend.list_groups(None, user=username1), [groupname1])
+
+        # missing users are cached as well
+        self.backend.users.create_user(username2)
+        self.assertRaises(UserNotFound, self.backend.get_properties, username2)
+
+        # ... but creating the user through this backend removes the entry
+        self.backend.users.remove_user(username2)
+        self.backend.groups.remove_user(username2)
+        self.backend.create_user(username2)
+        self.assertEqual(self.backend.get_properties(username2), {})
+
+    def test_remove_user(self):
+        self.backend.remove_user(username1)
+        for child in self.backend.children:
+            self.assertFalse(child.user_exists(username1))
+        self.assertRaises(UserNotFound, self.backend.get_properties, username1)
+
+        self.backend.create_user(username1)
+        self.assertEqual(self.backend.get_properties(username1), {})
+        self.assertEqual(self.backend.list_groups(None, user=username1), [])
+
+    def test_rename_user(self):
+        self.backend.rename_user(username1, username2)
+        self.assertRaises(UserNotFound, self.backend.get_properties, username1)
+        self.assertTrue(self.backend.check_password(username2, password1,
+                                                    groups=[(groupname1, None)]))
+        self.assertEqual(self.backend.get_properties(username2), {propkey1: propval1})
+
+
+class ShardedBackendTests(TestCase):
+    if six.PY2:
+        assertCountEqual = TestCase.assertItemsEqual
+
+    def setUp(self):
+        self.backend = ShardedBackend(SHARDS=[
+            {'NAME': 'shard1', 'BACKEND': 'backends.memory.MemoryBackend'},
+            {'NAME': 'shard2', 'BACKEND': 'backends.memory.MemoryBackend'},
+            {'NAME': 'shard3', 'BACKEND': 'backends.memory.MemoryBackend'},
+        ])
+        self.users = ['user%s' % i for i in range(30)]
+        for user in self.users:
+            self.backend.create_user(user, password1)
+
+    def test_routing(self):
+        for user in self.users:
+            shards = [s for s in self.backend.shards if s.user_exists(user)]
+            self.assertEqual(shards, [self.backend._shard(user)])
+            self.assertTrue(self.backend.check_password(user, password1))
+
+        self.assertTrue(all(s.list_users() for s in self.backend.shards))
+        self.assertCountEqual(self.backend.list_users(), self.users)
+
+    def test_groups(self):
+        self.backend.create_group(groupname1, None, users=self.users[:10])
+        self.backend.create_group(groupname2, None)
+        self.backend.set_members(groupname2, None, self.users[10:15])
+        self.backend.add_subgroup(groupname1, None, groupname2, None)
+        for shard in self.backend.shards:
+            self.assertEqual(shard.subgroups(groupname1, None), [groupname2])
+
+        self.assertCountEqual(self.backend.members(groupname2, None), self.users[:15])
+        self.assertCountEqual(self.backend.members_of(groupname2, None, self.users[5:20]),
+                              self.users[5:15])
+        self.assertTrue(self.backend.is_member(groupname2, None, self.users[0]))
+        self.assertTrue(self.backend.check_password(self.users[0], password1,
+                                                    groups=[(groupname2, None)]))
+        self.assertFalse(self.backend.check_password(self.users[20], password1,
+                                                     groups=[(groupname2, None)]))
+
+        self.assertRaises(UserNotFound, self.backend.set_members, groupname1, None, [username1])
+        self.assertCountEqual(self.backend.members(groupname1, None), self.users[:10])
+
+    def test_implicit_groups(self):
+        self.backend.create_user(username1, groups=[(groupname1, None)])
+        self.backend.set_memberships(self.users[0], None, [groupname2])
+
+        for shard in self.backend.shards:
+            self.assertTrue(shard.group_exists(groupname1, None))
+            self.assertTrue(shard.group_exists(groupname2, None))
+        self.assertEqual(self.backend.list_groups(None, user=username1), [groupname1])
+        self.assertEqual(self.backend.list_groups(None, user=self.users[0]), [groupname2])
+
+    def test_rename(self):
+        self.backend.create_group(groupname1, None)
+        self.backend.create_group(groupname2, None, users=[self.users[0]])
+        self.backend.add_subgroup(groupname2, None, groupname1, None)
+        self.backend.set_properties(self.users[0], {propkey1: propval1})
+
+        # find new names in the same and in a different shard
+        shard = self.backend._shard(self.users[0])
+        names = ['renamed%s' % i for i in range(100)]
+        same = [n for n in names if self.backend._shard(n) is shard][0]
+        other = [n for n in names if self.backend._shard(n) is not shard][0]
+
+        self.backend.rename_user(self.users[0], same)
+        self.backend.rename_user(same, other)
+        self.assertFalse(self.backend.user_exists(same))
+        self.assertFalse(shard.user_exists(other))
+        self.assertTrue(self.backend.check_password(other, password1))
+        self.assertEqual(self.backend.get_properties(other), {propkey1: propval1})
+        self.assertCountEqual(self.backend.list_groups(None, user=other), [groupname1, groupname2])
+        self.assertEqual(self.backend.list_groups(None, user=other, depth=0), [groupname2])
+        self.assertEqual(self.backend.members(groupname2, None, depth=0), [other])
+        self.assertEqual(self.backend.members(groupname1, None, depth=0), [])
+
+        self.assertRaises(UserNotFound, self.backend.rename_user, same, self.users[1])
+        self.assertRaises(UserExists, self.backend.rename_user, other, self.users[1])
+
+        # a failed move removes the copy in the new shard
+        other_shard = self.backend._shard(other)
+        moved = [n for n in names if self.backend._shard(n) is not other_shard][-1]
+
+        def remove_user(user):
+            raise RuntimeError('shard is down')
+        other_shard.remove_user = remove_user
+
+        self.assertRaises(RuntimeError, self.backend.rename_user, other, moved)
+        self.assertFalse(self.backend.user_exists(moved))
+        self.assertTrue(self.backend.check_password(other, password1))
+
+    def test_rebalance(self):
+        users = ['user%s' % i for i in range(1000)]
+        ring = HashRing([('shard1', 1), ('shard2', 2), ('shard3', 3)])
+        new_ring = HashRing([('shard1', 1), ('shard2', 2), ('shard3', 3), ('shard4', 4)])
+
+        # only users that are now in the new shard move
+        moved = [u for u in users if ring.get(u) != new_ring.get(u)]
+        self.assertEqual(set(new_ring.get(u) for u in moved), set([4]))
+        self.assertLess(len(moved), 400)
+
+
+class FakeLDAP(object):
+    """A stand-in for the ldap module, the server closes connections marked as dead."""
+
+    class SERVER_DOWN(Exception):
+        pass
+
+    def __init__(self):
+        self.connections = []
+
+    def initialize(self, uri):
+        conn = FakeLDAPConnection()
+        self.connections.append(conn)
+        return conn
+
+
+class FakeLDAPConnection(object):
+    def __init__(self):
+        self.alive = True
+        self.who = None
+
+    def simple_bind_s(self, who, cred):
+        self.who = who
+
+    def whoami_s(self):
+        if not self.alive:
+            raise FakeLDAP.SERVER_DOWN()
+        return self.who
+
+
+class LDAPConnectionPoolTests(TestCase):
+    def setUp(self):
+        self.ldap = FakeLDAP()
+        self.pool = LDAPConnectionPool(self.ldap, 'ldap://localhost', 'cn=admin', 'nopass', size=2)
+
+    def test_checkout(self):
+        with self.pool.connection() as conn:
+            self.assertEqual(conn.who, 'cn=admin')
+            self.assertEqual(len(self.pool._idle), 0)
+        self.assertEqual(list(self.pool._idle), [conn])
+
+        # the connection is reused
+        with self.pool.connection() as conn2:
+            self.assertIs(conn2, conn)
+        self.assertEqual(self.pool.call('whoami_s'), 'cn=admin')
+        self.assertEqual(self.ldap.connections, [conn])
+
+    def test_size(self):
+        with self.pool.connection() as conn1:
+            with self.pool.connection() as conn2:
+                self.assertIsNot(conn1, conn2)
+                self.assertFalse(self.pool._slots.acquire(False))  # a third caller would wait
+            self.assertTrue(self.pool._slots.acquire(False))
+            self.pool._slots.release()
+        self.assertEqual(len(self.pool._idle), 2)
+
+    def test_dead_connection(self):
+        with self.pool.connection() as conn:
+            pass
+        conn.alive = False
+
+        def use():
+            with self.pool.connection() as conn:
+                conn.whoami_s()
+        self.assertRaises(FakeLDAP.SERVER_DOWN, use)
+        self.assertEqual(len(self.pool._idle), 0)
+
+    def test_retry(self):
+        with self.pool.connection() as conn1:
+            with self.pool.connection() as conn2:
+                pass
+        conn1.alive = conn2.alive = False
+
+        # all idle connections are dropped and the call is retried once with a new connection
+        self.assertEqual(self.pool.call('whoami_s'), 'cn=admin')
+        self.assertEqual(len(self.ldap.connections), 3)
+        self.assertEqual(list(self.pool._idle), [self.ldap.connections[2]])
+
+        # if the server is really down, the call fails after the retry
+        original = self.ldap.initialize
+
+        def initialize(uri):
+            conn = original(uri)
+            conn.alive = False
+            return conn
+        self.ldap.initialize = initialize
+        self.pool._idle[0].alive = False
+        self.assertRaises(FakeLDAP.SERVER_DOWN, self.pool.call, 'whoami_s')
+        self.assertEqual(len(self.ldap.connections), 4)
+        self.assertEqual(len(self.pool._idle), 0)
+
+
 validators = (
     'Users.validators.EmailValidator',
     'Users.validators.MediaWikiValidator',
@@ -261,6 +1059,31 @@ class BasicTests(RestAuthTest):
         self.assertEqual(response.status_code, 200)
 
 
+@skipUnless(settings.DATA_BACKEND['BACKEND'] == 'backends.redis.RedisBackend', '')
+class RedisIndexTests(RestAuthTest):
+    def test_rebuild_indexes(self):
+        backend.create_user(username1, password1)
+        backend.create_user(username2, password1)
+        backend.create_group(group=groupname1, service=self.service, users=[username1])
+        backend.create_group(group=groupname2, service=self.service)
+        backend.add_subgroup(group=groupname1, service=self.service, subgroup=groupname2,
+                             subservice=self.service)
+        backend.add_member(group=groupname2, service=self.service, user=username2)
+
+        # simulate data written by an older version
+        backend.conn.delete('usergroups_%s' % username1, 'usergroups_%s' % username2,
+                            'groups_%s' % self.service.id)
+        self.assertEqual(backend.list_groups(service=self.service), [])
+        self.assertEqual(backend.list_groups(service=self.service, user=username1), [])
+
+        call_command('rebuild_redis_indexes', stdout=six.StringIO())
+        self.assertCountEqual(backend.list_groups(service=self.service), [groupname1, groupname2])
+        self.assertCountEqual(backend.list_groups(service=self.service, user=username1),
+                              [groupname1, groupname2])
+        self.assertCountEqual(backend.list_groups(service=self.service, user=username2),
+                              [groupname2])
+
+
 class RestAuthImportTests(RestAuthTransactionTest, CliMixin):
     base = os.path.join(os.path.dirname(__file__), 'testdata')
 
@@ -348,6 +1171,19 @@ class RestAuthImportTests(RestAuthTransactionTest, CliMixin):
                     stderr,
                     ".*error: 'groups' does not appear to be a dictionary.")
 
+        # invalid host of a service
+        path = os.path.join(self.base, 'faulty7.json')
+        with capture() as (stdout, stderr):
+            try:
+                restauth_import([path])
+                self.fail('No exception thrown.')
+            except SystemExit as e:
+                self.assertEqual(e.code, 2)
+                self.assertHasLine(
+                    stderr,
+                    '.*error: new.example.com: Enter a valid IPv4 or IPv6 address or network.$')
+        self.assertFalse(Service.objects.filter(username='new.example.com').exists())
+
         path = os.path.join(self.base, 'faulty6.json')
         with capture() as (stdout, stderr):
             restauth_import([path])
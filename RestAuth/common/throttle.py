@@ -0,0 +1,157 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of RestAuth (https://restauth.net).
+#
+# RestAuth is free software: you can redistribute it and/or modify it under the terms of the GNU
+# General Public License as published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# RestAuth is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without
+# even the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with RestAuth.  If not,
+# see <http://www.gnu.org/licenses/>.
+
+"""Throttle clients that repeatedly fail to authenticate.
+
+A throttle counts failed attempts per key in a sliding window of ``WINDOW`` seconds. Once a key has
+``LIMIT`` failures in the window, :py:meth:`~MemoryThrottle.check` raises
+:py:class:`~common.errors.Throttled` (and RestAuth responds with ``429 Too Many Requests``) before
+any password is hashed. Please see :setting:`AUTH_THROTTLE` for how to configure throttling.
+"""
+
+from __future__ import unicode_literals
+
+import threading
+import time
+import uuid
+
+from collections import deque
+
+from django.conf import settings
+from django.utils import importlib
+from django.utils.module_loading import import_string
+
+from common.errors import Throttled
+
+try:
+    from collections import OrderedDict
+except ImportError:  # pragma: python2.6
+    from django.utils.datastructures import SortedDict as OrderedDict
+
+_throttle = None
+_throttle_lock = threading.Lock()
+
+
+class MemoryThrottle(object):
+    """Keep failed attempts in memory of the current process.
+
+    :param LIMIT: Number of failures allowed in ``WINDOW`` seconds.
+    :param WINDOW: Length of the sliding window in seconds.
+    :param SIZE: The maximum number of keys to remember. If there are more keys, the least
+        recently failed key is forgotten.
+    """
+
+    def __init__(self, LIMIT=10, WINDOW=60, SIZE=10000):
+        self.limit = LIMIT
+        self.window = WINDOW
+        self.size = SIZE
+        self._failures = OrderedDict()
+        self._lock = threading.Lock()
+
+    def check(self, key):
+        """Raise :py:class:`~common.errors.Throttled` if ``key`` failed too often."""
+        with self._lock:
+            failures = self._failures.get(key)
+            if failures is None:
+                return
+
+            self._expire(failures, time.time())
+            if not failures:
+                del self._failures[key]
+            elif len(failures) >= self.limit:
+                raise Throttled('Too many failed attempts, try again later.')
+
+    def fail(self, key):
+        """Record a failed attempt for ``key``."""
+        now = time.time()
+        with self._lock:
+            failures = self._failures.pop(key, None)
+            if failures is None:
+                failures = deque(maxlen=self.limit)
+                while len(self._failures) >= self.size:
+                    del self._failures[next(iter(self._failures))]
+            else:
+                self._expire(failures, now)
+            failures.append(now)
+            self._failures[key] = failures  # re-insert as most recently failed key
+
+    def clear(self):
+        with self._lock:
+            self._failures.clear()
+
+    def _expire(self, failures, now):
+        while failures and failures[0] <= now - self.window:
+            failures.popleft()
+
+
+class RedisThrottle(object):
+    """Keep failed attempts in Redis, so that the counters are shared by all processes.
+
+    Every key is stored as sorted set of failure timestamps that expires after ``WINDOW`` seconds.
+
+    :param LIMIT: Number of failures allowed in ``WINDOW`` seconds.
+    :param WINDOW: Length of the sliding window in seconds.
+    :param HOST: The hostname where the redis installation runs.
+    :param PORT: The port ot he redis installation.
+    :param DB: The id of the Redis database.
+    """
+
+    def __init__(self, LIMIT=10, WINDOW=60, HOST='localhost', PORT=6379, DB=0, **kwargs):
+        redis = importlib.import_module('redis')
+        self.limit = LIMIT
+        self.window = WINDOW
+        self.conn = redis.StrictRedis(host=HOST, port=PORT, db=DB, **kwargs)
+
+    def _key(self, key):
+        return 'throttle_%s' % key
+
+    def check(self, key):
+        """Raise :py:class:`~common.errors.Throttled` if ``key`` failed too often."""
+        count = self.conn.zcount(self._key(key), time.time() - self.window, '+inf')
+        if count >= self.limit:
+            raise Throttled('Too many failed attempts, try again later.')
+
+    def fail(self, key):
+        """Record a failed attempt for ``key``."""
+        now = time.time()
+        key = self._key(key)
+
+        pipe = self.conn.pipeline()
+        pipe.zadd(key, now, uuid.uuid4().hex)
+        pipe.zremrangebyscore(key, '-inf', now - self.window)
+        pipe.expire(key, int(self.window) + 1)
+        pipe.execute()
+
+    def clear(self):
+        keys = self.conn.keys(self._key('*'))
+        if keys:
+            self.conn.delete(*keys)
+
+
+def get_throttle():
+    """Get the throttle configured by :setting:`AUTH_THROTTLE` or ``None`` if not configured."""
+
+    global _throttle
+
+    config = getattr(settings, 'AUTH_THROTTLE', None)
+    if not config:
+        return None
+
+    with _throttle_lock:
+        if _throttle is None:
+            config = config.copy()
+            cls = import_string(config.pop('BACKEND', 'common.throttle.MemoryThrottle'))
+            _throttle = cls(**config)
+        return _throttle
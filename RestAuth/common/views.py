@@ -19,10 +19,12 @@ This module implements common baseclasses used in other RestAuth views..
 
 from __future__ import unicode_literals
 
+from django.utils.encoding import iri_to_uri
 from django.views.generic.base import View
 
 from RestAuthCommon.strprep import stringprep
 
+from common.responses import HttpRestAuthResponse
 from common.types import assert_format
 from common.types import parse_dict
 
@@ -40,6 +42,28 @@ class RestAuthView(View):
         return assert_format(data=data, required=getattr(self, 'put_required', None),
                              optional=getattr(self, 'put_optional', None))
 
+    def _parse_page(self, request):
+        """Get the ``limit`` and ``after`` query parameters of a list request.
+
+        :return: A tuple of the limit and the cursor, ``(None, None)`` if the list is not
+            paginated.
+        """
+        limit = request.GET.get('limit')
+        if not limit:
+            return None, None
+        assert limit.isdigit() and int(limit) > 0, 'limit must be a positive integer.'
+        return int(limit), request.GET.get('after') or None
+
+    def _page_response(self, request, names, after):
+        """Return a page of a list with a ``Link`` header to the next page, if there is one."""
+        response = HttpRestAuthResponse(request, names)
+        if after is not None:
+            query = request.GET.copy()
+            query['after'] = after
+            url = '%s?%s' % (iri_to_uri(request.path), query.urlencode())
+            response['Link'] = '<%s>; rel="next"' % url
+        return response
+
     def dispatch(self, request, **kwargs):
         """
         Adds the 'service' logging argument, and passes that as extra